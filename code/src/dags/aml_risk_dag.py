@@ -12,10 +12,17 @@ from dags.utils.entity_extraction import extract_entities_from_text
 from dags.utils.data_enrichment import (
     get_open_corporates_data, 
     check_sanctions, 
+    check_sanctions_batch,
     query_wikidata, 
+    query_wikidata_batch,
     check_pep_list, 
-    check_adverse_news
+    screen_pep_batch,
+    check_adverse_news, check_adverse_news_batch,
+    collect_news_articles
 )
+from dags.utils.concurrent_checks import run_checks
+from dags.utils.name_normalization import entity_name_key
+from dags.utils.network_expansion import expand_network
 from dags.utils.risk_assessment import generate_risk_assessment
 from dags.utils.knowledge_base_utils import initialize_knowledge_base, migrate_transaction_to_knowledge_base
 from dags.utils.neo4j_utils import retrieve_entity_history, store_transaction_results
@@ -27,6 +34,23 @@ from config.settings import RESULTS_FOLDER
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def _batch_result(batch_results, *keys):
+    """
+    Get an entity's result from a batch task, unless the batch failed for it.
+    
+    Args:
+        batch_results: The results of the batch task, possibly None
+        keys: The keys of the entity's result, e.g. the schema and the name
+        
+    Returns:
+        The result, or None if it is missing or failed and the entity must be checked on its own
+    """
+    result = batch_results or {}
+    for key in keys:
+        result = result.get(key) or {}
+    return result if result and result.get('status') != 'failed' else None
+
 # Define default arguments for the DAG
 default_args = {
     'owner': 'airflow',
@@ -97,10 +121,48 @@ with DAG(
         logger.info(f"Retrieved history for entities in transaction: {transaction_id}")
         return history
     
+    @task
+    def screen_sanctions(entities, **context):
+        """Screen all organizations and people of the transaction against sanctions lists in one batch."""
+        batch = [('Company', org.get('name', '')) for org in entities.get('organizations', [])]
+        batch += [('Person', person.get('name', '')) for person in entities.get('people', [])]
+        return check_sanctions_batch(batch, **context)
+    
+    @task
+    def screen_adverse_media(entities, **context):
+        """Check all organizations and people of the transaction for adverse media, scoring the articles in one batch."""
+        batch = [('Company', org.get('name', '')) for org in entities.get('organizations', [])]
+        batch += [('Person', person.get('name', '')) for person in entities.get('people', [])]
+        return check_adverse_news_batch(batch, **context)
+    
+    @task
+    def query_organizations_wikidata(entities, **context):
+        """Look up all organizations of the transaction on Wikidata in one batch."""
+        names = [org.get('name', '') for org in entities.get('organizations', [])]
+        return query_wikidata_batch(names, **context)
+    
+    @task
+    def expand_officer_network(transaction_info, entities, wikidata_results, **context):
+        """Expand the officer network around the organizations over several hops, screening each hop in one batch."""
+        wikidata_results = wikidata_results or {}
+        seeds = [
+            {'name': name, 'entity_id': result['data']['entity_id']}
+            for name, result in wikidata_results.items()
+            if result.get('status') == 'success' and result.get('data')
+        ]
+        # The transaction's parties and the officers discovered on Wikidata are screened by their own tasks
+        screened_names = [org.get('name', '') for org in entities.get('organizations', [])]
+        screened_names += [person.get('name', '') for person in entities.get('people', [])]
+        screened_names += [
+            person.get('name', '') for result in wikidata_results.values()
+            for person in result.get('associated_people', [])
+        ]
+        return expand_network(transaction_info["transaction_id"], seeds, screened_names, **context)
+    
     # ========== ENTITY PROCESSING TASKS ==========
     
     @task_group
-    def process_organizations(transaction_info, entities, entity_history):
+    def process_organizations(transaction_info, entities, entity_history, sanctions_results, wikidata_results, news_results):
         """Process all organizations in the transaction."""
         
         @task
@@ -109,19 +171,20 @@ with DAG(
             return entities_dict.get("organizations", [])
         
         @task
-        def process_organization(organization, history_map, **context):
+        def process_organization(organization, history_map, sanctions_results, wikidata_results, news_results, **context):
             """Process a single organization with all relevant checks."""
             org_name = organization.get('name', '')
             logger.info(f"Processing organization: {org_name}")
             
             transaction_id = context['dag_run'].conf.get('transaction_id')
             
-            results = {
-                'opencorporates': get_open_corporates_data(organization, transaction_id=transaction_id, **context),
-                'sanctions': check_sanctions('Company', org_name, transaction_id=transaction_id, **context),
-                'wikidata': query_wikidata(org_name, transaction_id=transaction_id, **context),
-                'news': check_adverse_news(org_name, transaction_id=transaction_id, **context)
-            }
+            # The provider checks run concurrently, each with its own timeout
+            results = run_checks({
+                'opencorporates': lambda: get_open_corporates_data(organization, transaction_id=transaction_id, **context),
+                'sanctions': lambda: _batch_result(sanctions_results, 'Company', org_name) or check_sanctions('Company', org_name, transaction_id=transaction_id, **context),
+                'wikidata': lambda: _batch_result(wikidata_results, org_name) or query_wikidata(org_name, transaction_id=transaction_id, **context),
+                'news': lambda: _batch_result(news_results, 'Company', org_name) or check_adverse_news(org_name, transaction_id=transaction_id, **context)
+            })
             
             # Add discovered people from Wikidata
             results['discovered_people'] = results['wikidata'].get('associated_people', [])
@@ -141,13 +204,16 @@ with DAG(
         # Process each organization and return results
         org_results = process_organization.expand(
             organization=orgs_list,
-            history_map=[entity_history]
+            history_map=[entity_history],
+            sanctions_results=[sanctions_results],
+            wikidata_results=[wikidata_results],
+            news_results=[news_results]
         )
         
         return org_results
     
     @task_group
-    def process_people(transaction_info, entities, entity_history):
+    def process_people(transaction_info, entities, entity_history, sanctions_results, news_results):
         """Process all people in the transaction."""
         
         @task
@@ -156,18 +222,25 @@ with DAG(
             return entities_dict.get("people", [])
         
         @task
-        def process_person(person, history_map, **context):
+        def screen_people_pep(people, **context):
+            """Screen all people against the PEP list in a single pass."""
+            names = [person.get('name', '') for person in people]
+            return screen_pep_batch(names, **context)
+        
+        @task
+        def process_person(person, history_map, pep_results, sanctions_results, news_results, **context):
             """Process a single person with all relevant checks."""
             person_name = person.get('name', '')
             logger.info(f"Processing person: {person_name}")
             
             transaction_id = context['dag_run'].conf.get('transaction_id')
             
-            results = {
-                'pep': check_pep_list(person_name, transaction_id=transaction_id, **context),
-                'sanctions': check_sanctions('Person', person_name, transaction_id=transaction_id, **context),
-                'news': check_adverse_news(person_name, transaction_id=transaction_id, **context)
-            }
+            # The provider checks run concurrently, each with its own timeout
+            results = run_checks({
+                'pep': lambda: _batch_result(pep_results, person_name) or check_pep_list(person_name, transaction_id=transaction_id, **context),
+                'sanctions': lambda: _batch_result(sanctions_results, 'Person', person_name) or check_sanctions('Person', person_name, transaction_id=transaction_id, **context),
+                'news': lambda: _batch_result(news_results, 'Person', person_name) or check_adverse_news(person_name, transaction_id=transaction_id, **context)
+            })
             
             # Add historical data if available
             if history_map and person_name in history_map:
@@ -181,10 +254,16 @@ with DAG(
         # Get the people list
         people_list = extract_people(entities)
         
+        # Screen everyone against the PEP list at once
+        pep_results = screen_people_pep(people_list)
+        
         # Process each person and return results
         people_results = process_person.expand(
             person=people_list,
-            history_map=[entity_history]
+            history_map=[entity_history],
+            pep_results=[pep_results],
+            sanctions_results=[sanctions_results],
+            news_results=[news_results]
         )
         
         return people_results
@@ -203,7 +282,7 @@ with DAG(
                 results = org_result.get('results', {})
                 if 'discovered_people' in results:
                     for person in results['discovered_people']:
-                        name = person.get('name', '').lower()
+                        name = entity_name_key(person.get('name', ''))
                         if name and name not in seen_names:
                             discovered_people.append(person)
                             seen_names.add(name)
@@ -212,20 +291,41 @@ with DAG(
             return discovered_people
         
         @task
-        def process_discovered_person(person, history_map, **context):
+        def screen_discovered_people_pep(discovered_people, **context):
+            """Screen all discovered people against the PEP list in a single pass."""
+            names = [person.get('name', '') for person in discovered_people]
+            return screen_pep_batch(names, **context)
+        
+        @task
+        def screen_discovered_people_sanctions(discovered_people, **context):
+            """Screen all discovered people against sanctions lists in one batch."""
+            return check_sanctions_batch(
+                [('Person', person.get('name', '')) for person in discovered_people], **context
+            )
+        
+        @task
+        def screen_discovered_people_news(discovered_people, **context):
+            """Check all discovered people for adverse media, scoring the articles in one batch."""
+            return check_adverse_news_batch(
+                [('Person', person.get('name', '')) for person in discovered_people], **context
+            )
+        
+        @task
+        def process_discovered_person(person, history_map, pep_results, sanctions_results, news_results, **context):
             """Process a single discovered person with all relevant checks."""
             person_name = person.get('name', '')
             logger.info(f"Processing discovered person: {person_name}")
             
             transaction_id = context['dag_run'].conf.get('transaction_id')
             
-            results = {
-                'pep': check_pep_list(person_name, transaction_id=transaction_id, **context),
-                'sanctions': check_sanctions('Person', person_name, transaction_id=transaction_id, **context),
-                'news': check_adverse_news(person_name, transaction_id=transaction_id, **context),
-                'source': person.get('source', 'wikidata'),
-                'entity_connection': person.get('entity_connection', '')
-            }
+            # The provider checks run concurrently, each with its own timeout
+            results = run_checks({
+                'pep': lambda: _batch_result(pep_results, person_name) or check_pep_list(person_name, transaction_id=transaction_id, **context),
+                'sanctions': lambda: _batch_result(sanctions_results, 'Person', person_name) or check_sanctions('Person', person_name, transaction_id=transaction_id, **context),
+                'news': lambda: _batch_result(news_results, 'Person', person_name) or check_adverse_news(person_name, transaction_id=transaction_id, **context)
+            })
+            results['source'] = person.get('source', 'wikidata')
+            results['entity_connection'] = person.get('entity_connection', '')
             
             # Add historical data if available
             if history_map and person_name in history_map:
@@ -239,10 +339,22 @@ with DAG(
         # Extract discovered people
         discovered_list = extract_discovered_people(org_results)
         
+        # Screen all discovered people against the PEP list at once
+        pep_results = screen_discovered_people_pep(discovered_list)
+        
+        # Screen all discovered people against sanctions lists at once
+        sanctions_results = screen_discovered_people_sanctions(discovered_list)
+        
+        # Check all discovered people for adverse media at once
+        news_results = screen_discovered_people_news(discovered_list)
+        
         # Process each discovered person
         discovered_results = process_discovered_person.expand(
             person=discovered_list,
-            history_map=[entity_history]
+            history_map=[entity_history],
+            pep_results=[pep_results],
+            sanctions_results=[sanctions_results],
+            news_results=[news_results]
         )
             
         return discovered_results
@@ -256,7 +368,8 @@ with DAG(
         entity_history,
         org_results, 
         people_results, 
-        discovered_people_results
+        discovered_people_results,
+        network_expansion
     ):
         """Combine all processing results into a single structure for risk assessment."""
         # Extract transaction info
@@ -271,7 +384,8 @@ with DAG(
             "entity_history": entity_history,
             "organizations": {},
             "people": {},
-            "discovered_people": {}
+            "discovered_people": {},
+            "network_expansion": (network_expansion or {}).get("data")
         }
         
         if org_results:
@@ -292,6 +406,14 @@ with DAG(
                 if name:
                     all_results["discovered_people"][name] = person_result.get('results', {})
         
+        # The news results only refer to their articles, which are added once here
+        all_results["news_articles"] = collect_news_articles(
+            transaction_id,
+            list(all_results["organizations"].values())
+            + list(all_results["people"].values())
+            + list(all_results["discovered_people"].values())
+        )
+        
         return all_results
     
     @task
@@ -367,10 +489,14 @@ with DAG(
     transaction_info = get_transaction_data()
     entities = extract_entities(transaction_info)
     entity_history = get_entity_history(transaction_info, entities)
+    sanctions_results = screen_sanctions(entities)
+    wikidata_results = query_organizations_wikidata(entities)
+    news_results = screen_adverse_media(entities)
+    network_expansion = expand_officer_network(transaction_info, entities, wikidata_results)
     
     # Process entities
-    org_results = process_organizations(transaction_info, entities, entity_history)
-    people_results = process_people(transaction_info, entities, entity_history)
+    org_results = process_organizations(transaction_info, entities, entity_history, sanctions_results, wikidata_results, news_results)
+    people_results = process_people(transaction_info, entities, entity_history, sanctions_results, news_results)
     discovered_people_results = process_discovered_people(transaction_info, org_results, entity_history)
     
     # Combine results and assess risk
@@ -380,7 +506,8 @@ with DAG(
         entity_history,
         org_results,
         people_results,
-        discovered_people_results
+        discovered_people_results,
+        network_expansion
     )
     
     risk_assessment = assess_risk(transaction_info, all_results)
@@ -2,6 +2,7 @@ import os
 from airflow.models import Variable
 from dotenv import load_dotenv
 import random
+import threading
 load_dotenv()
 
 # Path configurations
@@ -11,6 +12,72 @@ FAILED_FOLDER = os.environ.get('FAILED_FOLDER', '/opt/airflow/data/failed')
 RESULTS_FOLDER = os.environ.get('RESULTS_FOLDER', '/opt/airflow/data/results')
 SANCTION_DATA_FOLDER = os.environ.get('SANCTION_DATA_FOLDER', '/opt/airflow/data/sanctions')
 PEP_DATA_FILE = os.environ.get('PEP_DATA_FILE', '/opt/airflow/data/pep/pep_data.csv')
+# Compiled, memory-mapped PEP index shared by all workers on a node
+PEP_INDEX_FILE = os.environ.get('PEP_INDEX_FILE', f"{os.path.splitext(PEP_DATA_FILE)[0]}.idx")
+
+# PEP dataset refresh: latest OpenSanctions export, its metadata (for the
+# dataset version) and the share of changed records that triggers a full rebuild
+PEP_DATA_URL = os.environ.get('PEP_DATA_URL', 'https://data.opensanctions.org/datasets/latest/peps/targets.simple.csv')
+PEP_METADATA_URL = os.environ.get('PEP_METADATA_URL', 'https://data.opensanctions.org/datasets/latest/peps/index.json')
+PEP_REFRESH_SCHEDULE = os.environ.get('PEP_REFRESH_SCHEDULE', '@daily')
+PEP_DELTA_COMPACTION_RATIO = float(os.environ.get('PEP_DELTA_COMPACTION_RATIO', '0.2'))
+
+# PEP matching configuration
+PEP_MATCH_THRESHOLD = float(os.environ.get('PEP_MATCH_THRESHOLD', '0.85'))
+PEP_MATCH_TOP_K = int(os.environ.get('PEP_MATCH_TOP_K', '10'))
+# Batches of at least this many names are screened with the vectorized similarity engine
+PEP_VECTORIZED_MIN_BATCH = int(os.environ.get('PEP_VECTORIZED_MIN_BATCH', '100'))
+
+# Sanctions screening: 'remote' queries the OpenSanctions API, 'local' matches
+# against the exports in SANCTION_DATA_FOLDER and 'auto' uses the local exports
+# when there are any
+SANCTIONS_SCREENING_MODE = os.environ.get('SANCTIONS_SCREENING_MODE', 'auto')
+SANCTIONS_INDEX_FILE = os.environ.get('SANCTIONS_INDEX_FILE', os.path.join(SANCTION_DATA_FOLDER, 'sanctions.idx'))
+SANCTIONS_MATCH_THRESHOLD = float(os.environ.get('SANCTIONS_MATCH_THRESHOLD', '0.70'))
+SANCTIONS_MATCH_TOP_K = int(os.environ.get('SANCTIONS_MATCH_TOP_K', '5'))
+# Re-screening of the entities in Neo4j against entries added to or changed in the
+# local sanctions exports; the folder keeps the last screened list state and the reports
+SANCTIONS_RESCREEN_FOLDER = os.environ.get('SANCTIONS_RESCREEN_FOLDER', '/opt/airflow/data/rescreening')
+SANCTIONS_RESCREEN_SCHEDULE = os.environ.get('SANCTIONS_RESCREEN_SCHEDULE', '@daily')
+
+# Corporate registry lookups: 'remote' only queries the OpenCorporates API,
+# 'local' only the mirror of the bulk files imported from REGISTRY_DATA_FOLDER,
+# and 'auto' prefers the mirror and falls back to the API where it has no answer
+REGISTRY_LOOKUP_MODE = os.environ.get('REGISTRY_LOOKUP_MODE', 'auto')
+REGISTRY_DATA_FOLDER = os.environ.get('REGISTRY_DATA_FOLDER', '/opt/airflow/data/registry')
+REGISTRY_MIRROR_FILE = os.environ.get('REGISTRY_MIRROR_FILE', os.path.join(REGISTRY_DATA_FOLDER, 'registry_mirror.db'))
+
+# Wikidata lookups: 'remote' queries the SPARQL endpoint, 'local' only the subset
+# store built from a truthy dump, and 'auto' prefers the store where it finds the
+# organization
+WIKIDATA_LOOKUP_MODE = os.environ.get('WIKIDATA_LOOKUP_MODE', 'auto')
+WIKIDATA_STORE_FILE = os.environ.get('WIKIDATA_STORE_FILE', '/opt/airflow/data/wikidata/wikidata_subset.db')
+
+# Multi-hop expansion of the officer network around a transaction's organizations:
+# maximum distance in hops, neighbours followed per entity and entities in total
+NETWORK_EXPANSION_MAX_HOPS = int(os.environ.get('NETWORK_EXPANSION_MAX_HOPS', '3'))
+NETWORK_EXPANSION_MAX_FANOUT = int(os.environ.get('NETWORK_EXPANSION_MAX_FANOUT', '10'))
+NETWORK_EXPANSION_MAX_NODES = int(os.environ.get('NETWORK_EXPANSION_MAX_NODES', '200'))
+
+# Per-entity store of adverse media articles: GDELT is asked only for the articles
+# seen since an entity's watermark, at most once per refresh interval (seconds)
+NEWS_STORE_FILE = os.environ.get('NEWS_STORE_FILE', '/opt/airflow/data/news/news_store.db')
+NEWS_REFRESH_INTERVAL = int(os.environ.get('NEWS_REFRESH_INTERVAL', '21600'))
+NEWS_RETENTION_DAYS = int(os.environ.get('NEWS_RETENTION_DAYS', '730'))
+
+# Local adverse media scoring: articles kept per entity, minimum score (0 to 1)
+# and age in days at which an article's score is halved
+ADVERSE_MEDIA_TOP_K = int(os.environ.get('ADVERSE_MEDIA_TOP_K', '10'))
+ADVERSE_MEDIA_MIN_SCORE = float(os.environ.get('ADVERSE_MEDIA_MIN_SCORE', '0.15'))
+ADVERSE_MEDIA_HALF_LIFE_DAYS = float(os.environ.get('ADVERSE_MEDIA_HALF_LIFE_DAYS', '365'))
+
+# GDELT fetches per adverse media batch; the rest of its entities are checked by their own tasks
+ADVERSE_MEDIA_BATCH_MAX_FETCHES = int(os.environ.get('ADVERSE_MEDIA_BATCH_MAX_FETCHES', '12'))
+
+# Evidence of the risk assessment prompt: maximum tokens of the compacted
+# verification results and items kept of each list before shrinking
+RISK_ASSESSMENT_TOKEN_BUDGET = int(os.environ.get('RISK_ASSESSMENT_TOKEN_BUDGET', '16000'))
+EVIDENCE_TOP_K = int(os.environ.get('EVIDENCE_TOP_K', '5'))
 
 # Create folders if they don't exist
 for folder in [TRANSACTION_FOLDER, PROCESSED_FOLDER, FAILED_FOLDER, RESULTS_FOLDER, SANCTION_DATA_FOLDER]:
@@ -21,6 +88,41 @@ OPENCORPORATES_API_KEY = os.environ.get('OPENCORPORATES_API_KEY',
                                         Variable.get("OPENCORPORATES_API_KEY", default_var=""))
 OPENSANCTIONS_API_KEY = os.environ.get('OPENSANCTIONS_API_KEY', 
                                        Variable.get("OPENSANCTIONS_API_KEY", default_var=""))
+# Maximum number of queries sent in one OpenSanctions /match request
+OPENSANCTIONS_MAX_BATCH = int(os.environ.get('OPENSANCTIONS_MAX_BATCH', '50'))
+
+# Shared HTTP client for the enrichment providers: (connect, read) timeouts in
+# seconds, retries with exponential backoff and kept-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '30'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '3'))
+HTTP_BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', '0.5'))
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '10'))
+HTTP_USER_AGENT = os.environ.get('HTTP_USER_AGENT', 'aml-risk-assessment/1.0 (entity screening)')
+
+# Cross-transaction cache of enrichment provider responses: backend ('sqlite',
+# 'redis' or 'none'), time to live in seconds per provider and maximum size
+ENRICHMENT_CACHE_BACKEND = os.environ.get('ENRICHMENT_CACHE_BACKEND', 'sqlite')
+ENRICHMENT_CACHE_FILE = os.environ.get('ENRICHMENT_CACHE_FILE', '/opt/airflow/data/cache/enrichment_cache.db')
+ENRICHMENT_CACHE_REDIS_URL = os.environ.get('ENRICHMENT_CACHE_REDIS_URL', 'redis://redis:6379/1')
+ENRICHMENT_CACHE_TTLS = os.environ.get(
+    'ENRICHMENT_CACHE_TTLS', 'opencorporates=604800,wikidata=604800,opensanctions=86400'
+)
+ENRICHMENT_CACHE_MAX_ENTRIES = int(os.environ.get('ENRICHMENT_CACHE_MAX_ENTRIES', '100000'))
+
+# Provider rate limits shared by all workers, as "provider=requests per second:burst"
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://redis:6379/2')
+RATE_LIMITS = os.environ.get(
+    'RATE_LIMITS', 'opencorporates=2:5,opensanctions=5:10,wikidata=5:5,gdelt=0.2:1'
+)
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', '120'))
+
+# Provider checks of an entity task run concurrently: checks at the same time and
+# seconds each check may take, as "check=seconds"
+PROVIDER_CHECK_MAX_WORKERS = int(os.environ.get('PROVIDER_CHECK_MAX_WORKERS', '4'))
+PROVIDER_CHECK_TIMEOUTS = os.environ.get(
+    'PROVIDER_CHECK_TIMEOUTS', 'opencorporates=90,sanctions=60,wikidata=90,news=90,pep=60'
+)
 
 class GeminiKeyRotator:
     """
@@ -51,6 +153,7 @@ class GeminiKeyRotator:
         
         # Track key usage to help with load balancing
         self.key_usage = {key: 0 for key in self.keys}
+        self._lock = threading.Lock()
         
     def get_key(self):
         """
@@ -61,18 +164,19 @@ class GeminiKeyRotator:
         if len(self.keys) == 1:
             return self.keys[0]
         
-        # Find keys with minimum usage
-        min_usage = min(self.key_usage.values())
-        least_used_keys = [
-            key for key, usage in self.key_usage.items() 
-            if usage == min_usage
-        ]
-        
-        # Randomly select from least-used keys
-        selected_key = random.choice(least_used_keys)
-        
-        # Increment usage count
-        self.key_usage[selected_key] += 1
+        with self._lock:
+            # Find keys with minimum usage
+            min_usage = min(self.key_usage.values())
+            least_used_keys = [
+                key for key, usage in self.key_usage.items() 
+                if usage == min_usage
+            ]
+            
+            # Randomly select from least-used keys
+            selected_key = random.choice(least_used_keys)
+            
+            # Increment usage count
+            self.key_usage[selected_key] += 1
         
         return selected_key
     
@@ -82,9 +186,10 @@ class GeminiKeyRotator:
         
         :param key: The API key that failed
         """
-        if key in self.key_usage:
-            # Increase usage count to reduce future selection probability
-            self.key_usage[key] += 10
+        with self._lock:
+            if key in self.key_usage:
+                # Increase usage count to reduce future selection probability
+                self.key_usage[key] += 10
     
     def get_key_count(self):
         """
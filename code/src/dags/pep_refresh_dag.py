@@ -0,0 +1,67 @@
+from airflow import DAG
+from airflow.decorators import task
+from airflow.utils.dates import days_ago
+import logging
+from datetime import timedelta
+
+from dags.utils.pep_refresh import refresh_pep_dataset
+
+# Import settings
+from config.settings import (
+    PEP_DATA_FILE, PEP_INDEX_FILE, PEP_DATA_URL, PEP_METADATA_URL,
+    PEP_REFRESH_SCHEDULE, PEP_DELTA_COMPACTION_RATIO
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Define default arguments for the DAG
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'email_on_failure': False,
+    'email_on_retry': False,
+    'retries': 2,
+    'retry_delay': timedelta(minutes=10),
+}
+
+# Create the DAG
+with DAG(
+    'pep_dataset_refresh',
+    default_args=default_args,
+    description='Apply the latest OpenSanctions PEP snapshot to the compiled PEP index',
+    schedule_interval=PEP_REFRESH_SCHEDULE,
+    start_date=days_ago(1),
+    tags=['aml', 'pep', 'refresh'],
+    catchup=False,
+    max_active_runs=1,
+) as dag:
+
+    @task
+    def refresh_pep_data(**context):
+        """
+        Download (or take from the run configuration) a PEP snapshot and apply it.
+
+        A manual run can pass 'snapshot_file' and 'version' in its configuration
+        to apply a snapshot that was already downloaded.
+        """
+        conf = context['dag_run'].conf or {}
+
+        result = refresh_pep_dataset(
+            PEP_DATA_FILE,
+            PEP_INDEX_FILE,
+            snapshot_file=conf.get('snapshot_file'),
+            source_url=conf.get('source_url', PEP_DATA_URL),
+            metadata_url=PEP_METADATA_URL,
+            version=conf.get('version'),
+            compaction_ratio=PEP_DELTA_COMPACTION_RATIO,
+        )
+
+        if result["status"] != "success":
+            raise RuntimeError(result["reason"])
+
+        logger.info(f"PEP dataset refresh: {result['data']}")
+        return result["data"]
+
+    refresh_pep_data()
@@ -0,0 +1,64 @@
+from airflow import DAG
+from airflow.decorators import task
+from airflow.utils.dates import days_ago
+import logging
+from datetime import timedelta
+
+from dags.utils.sanctions_rescreening import rescreen_sanctions_delta
+
+# Import settings
+from config.settings import (
+    SANCTION_DATA_FOLDER, SANCTIONS_RESCREEN_FOLDER, SANCTIONS_RESCREEN_SCHEDULE,
+    SANCTIONS_MATCH_THRESHOLD
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Define default arguments for the DAG
+default_args = {
+    'owner': 'airflow',
+    'depends_on_past': False,
+    'email_on_failure': False,
+    'email_on_retry': False,
+    'retries': 2,
+    'retry_delay': timedelta(minutes=10),
+}
+
+# Create the DAG
+with DAG(
+    'sanctions_rescreening',
+    default_args=default_args,
+    description='Re-screen stored entities against sanctions entries added or changed since the last run',
+    schedule_interval=SANCTIONS_RESCREEN_SCHEDULE,
+    start_date=days_ago(1),
+    tags=['aml', 'sanctions', 'rescreening'],
+    catchup=False,
+    max_active_runs=1,
+) as dag:
+
+    @task
+    def rescreen_sanctions(**context):
+        """
+        Match the changed sanctions entries against the entities in Neo4j and flag their transactions.
+
+        A manual run can pass 'full': true in its configuration to match all
+        entries instead of the changed ones only.
+        """
+        conf = context['dag_run'].conf or {}
+
+        result = rescreen_sanctions_delta(
+            SANCTION_DATA_FOLDER,
+            SANCTIONS_RESCREEN_FOLDER,
+            conf.get('threshold', SANCTIONS_MATCH_THRESHOLD),
+            full=bool(conf.get('full', False)),
+        )
+
+        if result["status"] == "failed":
+            raise RuntimeError(result["reason"])
+
+        logger.info(f"Sanctions re-screening: {result['data'] or result['reason']}")
+        return result["data"]
+
+    rescreen_sanctions()
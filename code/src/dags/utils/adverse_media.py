@@ -0,0 +1,192 @@
+"""
+Local scoring of adverse media articles.
+
+GDELT returns every article matching an entity and its query terms, most of
+them neutral. The articles of all entities of a transaction are scored here
+in one batch, combining:
+
+    sentiment   VADER compound score of the title (NLTK's vader_lexicon),
+                only its negative part counts
+    themes      hits of a lexicon of financial crime themes (fraud, money
+                laundering, sanctions, corruption, ...), counted for all
+                titles at once with a sparse title-term matrix
+    recency     exponential decay with a half-life in days
+
+Only the top K articles per entity above a minimum score are kept, so the
+news results and the risk assessment prompt stay small. The results refer to
+the articles by their id in the news store, which holds each article once.
+Without NLTK or its vader_lexicon, GDELT's tone is used for the sentiment
+where available.
+"""
+import re
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy import sparse
+
+from dags.utils.news_store import parse_seendate
+
+logger = logging.getLogger(__name__)
+
+# Financial crime themes and the title terms (words or word pairs) that signal them
+THEME_LEXICON = {
+    'fraud': ('fraud', 'fraudulent', 'fraudster', 'fraudsters', 'scam', 'scams', 'ponzi', 'swindle',
+              'embezzlement', 'embezzled', 'forgery', 'misappropriation', 'deceptive'),
+    'money_laundering': ('money laundering', 'laundering', 'laundered', 'launder', 'shell companies',
+                         'shell company', 'illicit funds', 'dirty money'),
+    'sanctions': ('sanction', 'sanctions', 'sanctioned', 'ofac', 'blacklist', 'blacklisted', 'asset freeze',
+                  'frozen assets', 'export controls', 'evasion'),
+    'corruption': ('corruption', 'corrupt', 'bribe', 'bribes', 'bribery', 'kickback', 'kickbacks', 'graft',
+                   'cronyism', 'nepotism'),
+    'tax_crime': ('tax evasion', 'tax fraud', 'tax haven', 'offshore accounts'),
+    'terrorism': ('terrorism', 'terrorist', 'terror financing', 'terrorist financing', 'extremist'),
+    'organized_crime': ('cartel', 'mafia', 'smuggling', 'trafficking', 'organized crime', 'racketeering'),
+    'legal_action': ('lawsuit', 'sued', 'indicted', 'indictment', 'charged', 'charges', 'arrested', 'arrest',
+                     'convicted', 'conviction', 'guilty', 'sentenced', 'prosecutors', 'prosecution', 'raid',
+                     'raided', 'investigation', 'probe', 'subpoena'),
+    'regulatory': ('fine', 'fined', 'fines', 'penalty', 'penalties', 'settlement', 'violation', 'violations',
+                   'misconduct', 'scandal', 'whistleblower', 'revoked', 'suspended'),
+}
+
+# Weights of the negative sentiment and of the theme hits in an article's score
+SENTIMENT_WEIGHT = 0.4
+THEME_WEIGHT = 0.6
+
+# Recency decay of articles without a usable date
+UNDATED_DECAY = 0.5
+
+# GDELT tone giving the most negative sentiment when VADER is unavailable
+GDELT_TONE_SCALE = 10.0
+
+_THEMES = list(THEME_LEXICON)
+_TERMS = sorted({term for terms in THEME_LEXICON.values() for term in terms})
+_TERM_INDEX = {term: position for position, term in enumerate(_TERMS)}
+_TERM_THEMES = sparse.csr_matrix(np.array(
+    [[1.0 if term in THEME_LEXICON[theme] else 0.0 for theme in _THEMES] for term in _TERMS]
+))
+
+_WORD_PATTERN = re.compile(r"[a-z]+")
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+
+def _sentiment_analyzer():
+    """Get the VADER analyzer, or False if NLTK or its vader_lexicon is unavailable."""
+    global _analyzer
+
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                try:
+                    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+                    _analyzer = SentimentIntensityAnalyzer()
+                except (ImportError, LookupError) as e:
+                    logger.warning(f"VADER sentiment unavailable, using GDELT tone instead: {str(e)}")
+                    _analyzer = False
+    return _analyzer
+
+
+def _title_terms(title: str) -> List[str]:
+    """Get the words and word pairs of a title."""
+    words = _WORD_PATTERN.findall(title.lower())
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def theme_matrix(titles: Sequence[str]) -> sparse.csr_matrix:
+    """
+    Count the lexicon hits of every theme in a batch of titles.
+
+    Args:
+        titles: The article titles
+
+    Returns:
+        Sparse matrix of the hits, with one row per title and one column per theme of THEME_LEXICON
+    """
+    rows, columns = [], []
+    for row, title in enumerate(titles):
+        for term in set(_title_terms(title or '')):
+            if term in _TERM_INDEX:
+                rows.append(row)
+                columns.append(_TERM_INDEX[term])
+    title_terms = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, columns)), shape=(len(titles), len(_TERMS))
+    )
+    return title_terms @ _TERM_THEMES
+
+
+def title_sentiment(articles: Sequence[Dict]) -> np.ndarray:
+    """
+    Score the sentiment of a batch of article titles.
+
+    Args:
+        articles: The GDELT articles
+
+    Returns:
+        Array of sentiments from -1 (most negative) to 1 (most positive)
+    """
+    analyzer = _sentiment_analyzer()
+    if analyzer:
+        return np.array([analyzer.polarity_scores(article.get('title') or '')['compound'] for article in articles])
+    return np.clip(
+        np.array([float(article.get('tone') or 0) for article in articles]) / GDELT_TONE_SCALE, -1.0, 1.0
+    )
+
+
+def _recency_decay(articles: Sequence[Dict], half_life_days: float, now: datetime) -> np.ndarray:
+    ages = np.array([
+        (now - seen).total_seconds() / 86400 if seen else np.nan
+        for seen in (parse_seendate(article.get('seendate')) for article in articles)
+    ], dtype=float)
+    decay = np.power(0.5, np.clip(ages, 0, None) / half_life_days)
+    return np.where(np.isnan(decay), UNDATED_DECAY, decay)
+
+
+def score_articles(articles_by_entity: Dict[str, List[Dict]], top_k: int, min_score: float,
+                   half_life_days: float, now: Optional[datetime] = None) -> Dict[str, List[Dict]]:
+    """
+    Score the articles of many entities in one batch and keep the most adverse ones.
+
+    Args:
+        articles_by_entity: Dictionary mapping entity names to their stored
+            articles (see dags.utils.news_store.NewsStore.articles)
+        top_k: Maximum number of articles kept per entity
+        min_score: Score from 0 to 1 below which an article is not adverse
+        half_life_days: Age in days at which an article's score is halved
+        now: Time the ages are measured at, now by default
+
+    Returns:
+        Dictionary mapping entity names to references to their adverse
+        articles, most adverse first: the 'article_id' with the article's
+        'sentiment', 'themes' and 'score'
+    """
+    now = now or datetime.now(timezone.utc)
+    owners = [name for name, articles in articles_by_entity.items() for _ in articles]
+    articles = [article for name in articles_by_entity for article in articles_by_entity[name]]
+    results = {name: [] for name in articles_by_entity}
+    if not articles:
+        return results
+
+    themes = theme_matrix([article.get('title') or '' for article in articles]).toarray()
+    sentiment = title_sentiment(articles)
+    theme_score = 1.0 - np.power(0.5, themes.sum(axis=1))
+    scores = (SENTIMENT_WEIGHT * np.clip(-sentiment, 0, 1) + THEME_WEIGHT * theme_score) \
+        * _recency_decay(articles, half_life_days, now)
+
+    for position in np.argsort(-scores, kind='stable'):
+        name = owners[position]
+        if scores[position] < min_score or len(results[name]) >= top_k:
+            continue
+        article = articles[position]
+        results[name].append({
+            "article_id": article.get("article_id"),
+            "sentiment": round(float(sentiment[position]), 3),
+            "themes": [theme for theme, hits in zip(_THEMES, themes[position]) if hits],
+            "score": round(float(scores[position]), 3),
+        })
+    logger.info(f"Scored {len(articles)} articles of {len(articles_by_entity)} entities, "
+                f"kept {sum(len(kept) for kept in results.values())} adverse articles")
+    return results
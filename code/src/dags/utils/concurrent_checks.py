@@ -0,0 +1,104 @@
+"""
+Concurrent provider checks of a single entity.
+
+An entity task checks its entity with several providers (OpenCorporates,
+OpenSanctions, Wikidata, GDELT, the PEP list). The checks are independent, so
+they run in a bounded thread pool and the task takes as long as its slowest
+check instead of the sum of all of them.
+
+Every check has a deadline counted from the start of the checks. A check
+that misses it is reported as failed, with the same result shape as a failed
+call of its provider, and the task moves on. Its thread stops at its next
+rate limit wait, which raises once the deadline has passed, or when its
+request in flight times out; the interpreter still joins it at exit.
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional
+
+from dags.config.settings import PROVIDER_CHECK_TIMEOUTS, PROVIDER_CHECK_MAX_WORKERS
+from dags.utils.rate_limiter import set_deadline
+
+logger = logging.getLogger(__name__)
+
+# Seconds a check without a configured timeout may take
+DEFAULT_CHECK_TIMEOUT = 120.0
+
+# Data of the failed results of each provider's checks, None for the others
+FAILED_DATA = {
+    'sanctions': {"data": []},
+    'news': {"data": []},
+    'wikidata': {"data": None, "associated_people": []},
+}
+
+
+def parse_timeouts(timeouts: str) -> Dict[str, float]:
+    """
+    Parse per-check timeouts of the form "check=seconds,check=seconds".
+
+    Args:
+        timeouts: The timeout specification
+
+    Returns:
+        Dictionary mapping check names to timeouts in seconds
+    """
+    parsed = {}
+    for item in timeouts.split(','):
+        check, _, seconds = item.partition('=')
+        if check.strip() and seconds.strip():
+            parsed[check.strip()] = float(seconds)
+    return parsed
+
+
+def _failed_result(name: str, reason: str) -> Dict:
+    """Get the result of a failed check, shaped like a failed call of its provider."""
+    return {"status": "failed", "reason": reason, **FAILED_DATA.get(name, {"data": None})}
+
+
+def _run_check(check: Callable[[], Dict], deadline: float) -> Dict:
+    """Run a check, with the rate limit waits of its requests bound by its deadline."""
+    set_deadline(deadline)
+    try:
+        return check()
+    finally:
+        set_deadline(None)
+
+
+def run_checks(checks: Dict[str, Callable[[], Dict]], timeouts: Optional[Dict[str, float]] = None,
+               max_workers: int = PROVIDER_CHECK_MAX_WORKERS) -> Dict[str, Dict]:
+    """
+    Run the provider checks of an entity concurrently.
+
+    Args:
+        checks: Dictionary mapping check names, e.g. 'sanctions', to functions
+            without arguments returning the check's result
+        timeouts: Seconds each check may take, PROVIDER_CHECK_TIMEOUTS by default
+        max_workers: Maximum number of checks running at the same time
+
+    Returns:
+        Dictionary mapping the check names to their results, in the order of the checks
+    """
+    timeouts = parse_timeouts(PROVIDER_CHECK_TIMEOUTS) if timeouts is None else timeouts
+    results = {}
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(checks))), thread_name_prefix='check')
+    try:
+        deadlines = {name: started + timeouts.get(name, DEFAULT_CHECK_TIMEOUT) for name in checks}
+        futures = {name: executor.submit(_run_check, check, deadlines[name]) for name, check in checks.items()}
+        for name, future in futures.items():
+            timeout = deadlines[name] - started
+            try:
+                results[name] = future.result(timeout=max(0.0, deadlines[name] - time.monotonic()))
+            except FutureTimeoutError:
+                logger.warning(f"The {name} check timed out after {timeout:.0f}s")
+                results[name] = _failed_result(name, f"The {name} check timed out after {timeout:.0f}s")
+            except Exception as e:
+                logger.error(f"Error in the {name} check: {str(e)}")
+                results[name] = _failed_result(name, f"Error in the {name} check: {str(e)}")
+    finally:
+        # Checks past their deadline stop at their next rate limit wait
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    logger.info(f"Ran {len(checks)} checks in {time.monotonic() - started:.1f}s")
+    return results
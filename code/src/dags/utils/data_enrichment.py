@@ -1,25 +1,47 @@
 import os
 import json
+import time
 import logging
+import sqlite3
 import requests
-import pycountry
-import re
-import csv
-from SPARQLWrapper import SPARQLWrapper, JSON
+from datetime import datetime
 
 from dags.config.settings import (
-    RESULTS_FOLDER, OPENCORPORATES_API_KEY, OPENSANCTIONS_API_KEY, 
-    PEP_DATA_FILE
+    RESULTS_FOLDER, OPENCORPORATES_API_KEY, OPENSANCTIONS_API_KEY, OPENSANCTIONS_MAX_BATCH,
+    PEP_DATA_FILE, PEP_INDEX_FILE, PEP_MATCH_THRESHOLD, PEP_MATCH_TOP_K,
+    PEP_VECTORIZED_MIN_BATCH, SANCTION_DATA_FOLDER, SANCTIONS_SCREENING_MODE, SANCTIONS_INDEX_FILE,
+    SANCTIONS_MATCH_THRESHOLD, SANCTIONS_MATCH_TOP_K, REGISTRY_LOOKUP_MODE, REGISTRY_MIRROR_FILE,
+    WIKIDATA_LOOKUP_MODE, WIKIDATA_STORE_FILE, NEWS_STORE_FILE, NEWS_REFRESH_INTERVAL, NEWS_RETENTION_DAYS,
+    ADVERSE_MEDIA_TOP_K, ADVERSE_MEDIA_MIN_SCORE, ADVERSE_MEDIA_HALF_LIFE_DAYS, ADVERSE_MEDIA_BATCH_MAX_FETCHES
 )
 
 # Import the transaction folder utilities
 from dags.utils.transaction_folder import (
     get_transaction_folder, save_transaction_data, load_transaction_data
 )
+from dags.utils.adverse_media import score_articles
+from dags.utils.enrichment_cache import get_enrichment_cache
+from dags.utils.http_client import get_http_session
+from dags.utils.jurisdiction import resolve_jurisdiction
+from dags.utils.name_normalization import entity_name_key
+from dags.utils.news_store import get_news_store
+from dags.utils.pep_index import get_pep_index, get_pep_similarity_engine
+from dags.utils.registry_mirror import get_registry_mirror, search_registry_mirror
+from dags.utils.sanctions_store import get_sanctions_index, match_sanctions, sanctions_export_files
+from dags.utils.similarity_engine import search_batch_vectorized
+from dags.utils.wikidata_store import get_wikidata_store
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+WIKIDATA_SPARQL_URL = "https://query.wikidata.org/sparql"
+
+# Organizations looked up on Wikidata per pair of batch requests
+WIKIDATA_BATCH_SIZE = 50
+
+# Articles requested per GDELT query, the API's maximum
+GDELT_MAX_RECORDS = 250
+
 def _get_transaction_id_from_context(context=None, obj=None):
     """
     Extract transaction ID from context, object, or default to 'unknown_transaction'.
@@ -45,9 +67,26 @@ def _get_transaction_id_from_context(context=None, obj=None):
     
     return "unknown_transaction"
 
+def _record_screening_dataset(transaction_id, dataset, version):
+    """
+    Record which version of a screening list was used in the transaction's knowledge base.
+    
+    Each list has a file of its own in screening_datasets/, as the lists are
+    screened concurrently.
+    
+    Args:
+        transaction_id: The transaction ID
+        dataset: Name of the screening list, e.g. 'pep'
+        version: Version of the list that was screened against
+    """
+    save_transaction_data(
+        RESULTS_FOLDER, transaction_id, f"{dataset}.json",
+        {"version": version, "screened_at": datetime.now().isoformat()}, subfolder="screening_datasets"
+    )
+
 def get_open_corporates_data(organization_info, **context):
     """
-    Get company information from OpenCorporates API.
+    Get company information from the local registry mirror or the OpenCorporates API.
     """
     try:
         organization_name = organization_info.get('name')
@@ -65,17 +104,41 @@ def get_open_corporates_data(organization_info, **context):
         
         # Add jurisdiction if available
         if jurisdiction:
-            # Convert country name to code if needed
-            try:
-                country = pycountry.countries.get(name=jurisdiction)
-                if country:
-                    params["country_code"] = country.alpha_2.lower()
-            except:
+            # Narrow the search to the registry of the jurisdiction, e.g. 'gb' or 'us_de'
+            resolved = resolve_jurisdiction(jurisdiction)
+            if resolved and resolved.subdivision_code:
+                params["jurisdiction_code"] = resolved.opencorporates_code
+            elif resolved:
+                params["country_code"] = resolved.country_code.lower()
+            else:
                 logger.warning(f"Could not convert jurisdiction {jurisdiction} to country code")
         
-        response = requests.get("https://api.opencorporates.com/v0.4/companies/search", params=params)
-        response.raise_for_status()
-        data = response.json()
+        # The mirror answers where it has hits or covers the jurisdiction; 'auto' asks the API otherwise
+        data = None
+        source = "opencorporates"
+        cache_status = None
+        if REGISTRY_LOOKUP_MODE in ("local", "auto"):
+            mirror = get_registry_mirror(REGISTRY_MIRROR_FILE)
+            if mirror:
+                data = search_registry_mirror(
+                    mirror, organization_name, params.get("jurisdiction_code"), params.get("country_code")
+                )
+            if data is not None or REGISTRY_LOOKUP_MODE == "local":
+                source = "registry_mirror"
+
+        if source == "opencorporates":
+            # The API token does not change the response, so it is not part of the cache key
+            cache = get_enrichment_cache()
+            cache_params = {key: value for key, value in params.items() if key not in ("q", "api_token")}
+            data = cache.get("opencorporates", organization_name, cache_params)
+            cache_status = "hit" if data is not None else "miss"
+            if data is None:
+                response = get_http_session("opencorporates").get(
+                    "https://api.opencorporates.com/v0.4/companies/search", params=params
+                )
+                response.raise_for_status()
+                data = response.json()
+                cache.set("opencorporates", organization_name, data, cache_params)
         
         # Get first result if available
         if (data 
@@ -94,10 +157,11 @@ def get_open_corporates_data(organization_info, **context):
                 subfolder="entity_data/organization_results/opencorporates"
             )
                 
-            return {"status": "success", "data": company}
+            return {"status": "success", "data": company, "source": source, "cache": cache_status}
         else:
             logger.warning(f"No results found for {organization_name}")
-            return {"status": "no_results", "reason": f"No results found for {organization_name}", "data": None}
+            return {"status": "no_results", "reason": f"No results found for {organization_name}", "data": None,
+                    "source": source, "cache": cache_status}
             
     except requests.exceptions.RequestException as e:
         logger.error(f"Error during OpenCorporates request: {str(e)}")
@@ -108,292 +172,806 @@ def get_open_corporates_data(organization_info, **context):
 
 def check_sanctions(entity_type, entity_name, **context):
     """
-    Check if an entity is on sanctions lists using OpenSanctions API.
+    Check if an entity is on sanctions lists using OpenSanctions API or the local exports.
     """
     try:
-        transaction_id = _get_transaction_id_from_context(context)
-        
         if not entity_name:
             return {"status": "failed", "reason": "No entity name provided", "data": []}
         
-        session = requests.Session()
-        session.headers["Authorization"] = f"ApiKey {OPENSANCTIONS_API_KEY}"
+        return check_sanctions_batch([(entity_type, entity_name)], **context)[entity_type][entity_name]
+        
+    except Exception as e:
+        logger.error(f"Error checking sanctions: {str(e)}")
+        return {"status": "failed", "reason": f"Unknown error: {str(e)}", "data": []}
+
+def _use_local_sanctions():
+    """
+    Decide whether sanctions are screened against the local exports instead of the API.
+    
+    Returns:
+        True if SANCTIONS_SCREENING_MODE is 'local', or 'auto' with exports in SANCTION_DATA_FOLDER
+    """
+    if SANCTIONS_SCREENING_MODE == "local":
+        return True
+    return SANCTIONS_SCREENING_MODE == "auto" and bool(sanctions_export_files(SANCTION_DATA_FOLDER))
+
+def _sanctions_result(transaction_id, entity_type, entity_name, matches, cache_status=None):
+    """
+    Keep the high confidence matches of an entity and save them to the transaction folder.
+    
+    Args:
+        transaction_id: The transaction ID
+        entity_type: The FollowTheMoney schema of the entity
+        entity_name: The name of the entity
+        matches: The OpenSanctions match results for the entity
+        cache_status: 'hit' or 'miss' if the matches went through the enrichment cache
+        
+    Returns:
+        The check_sanctions result for the entity
+    """
+    high_confidence_results = [res for res in matches if res.get("score", 0) > SANCTIONS_MATCH_THRESHOLD]
+    
+    # Save the sanctions check results to the transaction folder
+    subfolder = "entity_data/organization_results/sanctions" if entity_type == "Company" else "entity_data/people_results/sanctions"
+    save_transaction_data(
+        RESULTS_FOLDER, 
+        transaction_id, 
+        f"{entity_name.replace(' ', '_')}.json", 
+        high_confidence_results, 
+        subfolder=subfolder
+    )
+    
+    result = {"status": "success", "data": high_confidence_results}
+    if cache_status:
+        result["cache"] = cache_status
+    return result
+
+def check_sanctions_batch(entities, **context):
+    """
+    Check many entities against sanctions lists with multi-query OpenSanctions requests.
+    
+    All entities are sent as queries of a single /match request, split into
+    chunks of OPENSANCTIONS_MAX_BATCH queries, and the responses are fanned
+    back out per entity. A failed chunk only fails the entities it contained.
+    Entities screened recently are answered from the enrichment cache and not
+    sent at all.
+    
+    When local screening is enabled (see _use_local_sanctions), the entities
+    are matched against the exports in SANCTION_DATA_FOLDER instead, with
+    results of the same shape.
+    
+    Args:
+        entities: List of (entity_type, entity_name) pairs, the type being a
+            FollowTheMoney schema such as 'Company' or 'Person'
+        context: The task context dict
+        
+    Returns:
+        Dictionary mapping entity type and then entity name to the result
+        check_sanctions would return for it
+    """
+    results = {}
+    try:
+        transaction_id = _get_transaction_id_from_context(context)
         
-        query = {"schema": entity_type, "properties": {"name": [entity_name]}}
-        batch = {"queries": {"q1": query}}
+        # Drop duplicates while keeping the order of the entities
+        queries = []
+        for entity_type, entity_name in dict.fromkeys((entity_type, entity_name) for entity_type, entity_name in entities):
+            if entity_name:
+                queries.append((entity_type, entity_name))
+            else:
+                results.setdefault(entity_type, {})[entity_name] = {
+                    "status": "failed", "reason": "No entity name provided", "data": []
+                }
         
-        response = session.post("https://api.opensanctions.org/match/sanctions?algorithm=best", json=batch)
-        response.raise_for_status()
+        if _use_local_sanctions():
+            sanctions_index = get_sanctions_index(SANCTION_DATA_FOLDER, SANCTIONS_INDEX_FILE)
+            _record_screening_dataset(transaction_id, "sanctions", sanctions_index.version)
+            local_matches = match_sanctions(sanctions_index, queries, SANCTIONS_MATCH_THRESHOLD, SANCTIONS_MATCH_TOP_K)
+            for entity_type, entity_name in queries:
+                results.setdefault(entity_type, {})[entity_name] = _sanctions_result(
+                    transaction_id, entity_type, entity_name, local_matches[(entity_type, entity_name)]
+                )
+            
+            logger.info(f"Screened {len(queries)} entities against local sanctions dataset {sanctions_index.version}")
+            return results
         
-        data = response.json()
-        responses = data.get("responses", {})
-        results = responses.get("q1", {}).get("results", [])
+        cache = get_enrichment_cache()
+        uncached = []
+        for entity_type, entity_name in queries:
+            matches = cache.get("opensanctions", entity_name, {"schema": entity_type})
+            if matches is None:
+                uncached.append((entity_type, entity_name))
+            else:
+                results.setdefault(entity_type, {})[entity_name] = _sanctions_result(
+                    transaction_id, entity_type, entity_name, matches, cache_status="hit"
+                )
+        cache_hits = len(queries) - len(uncached)
+        queries = uncached
         
-        # Filter for high confidence matches
-        high_confidence_results = [res for res in results if res.get("score", 0) > 0.70]
+        session = get_http_session("opensanctions")
         
-        # Save the sanctions check results to the transaction folder
-        subfolder = "entity_data/organization_results/sanctions" if entity_type == "Company" else "entity_data/people_results/sanctions"
-        file_name = f"{entity_name.replace(' ', '_')}.json"
-        save_transaction_data(
-            RESULTS_FOLDER, 
-            transaction_id, 
-            file_name, 
-            high_confidence_results, 
-            subfolder=subfolder
-        )
+        for start in range(0, len(queries), OPENSANCTIONS_MAX_BATCH):
+            chunk = queries[start:start + OPENSANCTIONS_MAX_BATCH]
+            batch = {
+                "queries": {
+                    f"q{position}": {"schema": entity_type, "properties": {"name": [entity_name]}}
+                    for position, (entity_type, entity_name) in enumerate(chunk, 1)
+                }
+            }
             
-        return {"status": "success", "data": high_confidence_results}
+            try:
+                response = session.post(
+                    "https://api.opensanctions.org/match/sanctions?algorithm=best",
+                    json=batch,
+                    headers={"Authorization": f"ApiKey {OPENSANCTIONS_API_KEY}"},
+                )
+                response.raise_for_status()
+                responses = response.json().get("responses", {})
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error during OpenSanctions request: {str(e)}")
+                for entity_type, entity_name in chunk:
+                    results.setdefault(entity_type, {})[entity_name] = {
+                        "status": "failed", "reason": f"API request failed: {str(e)}", "data": []
+                    }
+                continue
+            
+            for position, (entity_type, entity_name) in enumerate(chunk, 1):
+                # A query missing from a partial response is not a clean screening
+                if f"q{position}" not in responses:
+                    logger.error(f"OpenSanctions response has no results for {entity_name}")
+                    results.setdefault(entity_type, {})[entity_name] = {
+                        "status": "failed", "reason": "Query missing from the OpenSanctions response", "data": []
+                    }
+                    continue
+                matches = responses[f"q{position}"].get("results", [])
+                cache.set("opensanctions", entity_name, matches, {"schema": entity_type})
+                results.setdefault(entity_type, {})[entity_name] = _sanctions_result(
+                    transaction_id, entity_type, entity_name, matches, cache_status="miss"
+                )
+        
+        logger.info(f"Screened {len(queries)} entities against sanctions lists "
+                    f"in {-(-len(queries) // OPENSANCTIONS_MAX_BATCH)} requests, {cache_hits} more from the cache")
+        return results
         
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error during OpenSanctions request: {str(e)}")
-        return {"status": "failed", "reason": f"API request failed: {str(e)}", "data": []}
     except Exception as e:
-        logger.error(f"Error checking sanctions: {str(e)}")
-        return {"status": "failed", "reason": f"Unknown error: {str(e)}", "data": []}
+        logger.error(f"Error checking sanctions batch: {str(e)}")
+        for entity_type, entity_name in entities:
+            results.setdefault(entity_type, {}).setdefault(
+                entity_name, {"status": "failed", "reason": f"Unknown error: {str(e)}", "data": []}
+            )
+        return results
 
-def query_wikidata(entity_name, **context):
+def _run_sparql(query):
     """
-    Query Wikidata for information about an organization using SPARQL.
-    Returns information and potentially new people associated with the entity.
+    Run a SPARQL query against the Wikidata query service.
+
+    Args:
+        query: The SPARQL query
+
+    Returns:
+        The decoded SPARQL JSON results
     """
-    try:
-        transaction_id = _get_transaction_id_from_context(context)
-            
-        sparql = SPARQLWrapper("https://query.wikidata.org/sparql")
+    response = get_http_session("wikidata").post(WIKIDATA_SPARQL_URL, data={"query": query})
+    response.raise_for_status()
+    return response.json()
+
+def _sparql_string(value):
+    """
+    Quote a value as a SPARQL string literal.
+    
+    Args:
+        value: The value
         
-        # First, find the entity ID in Wikidata
-        entity_query = f"""
-        SELECT ?company ?companyLabel WHERE {{
+    Returns:
+        The escaped, double-quoted literal
+    """
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ').replace('\r', ' ')
+    return f'"{escaped}"'
+
+# Pattern of the Wikidata detail queries: the properties and the associated
+# people of ?company as rows of a UNION, told apart by ?kind. It is optional,
+# so an entity without any of the properties still yields one row.
+_WIKIDATA_DETAILS_PATTERN = """
+      OPTIONAL {
+        {
+          # Country, legal form, founders, CEO, inception and website
+          VALUES ?prop { wd:P17 wd:P1454 wd:P112 wd:P169 wd:P571 wd:P856 }
+          ?prop wikibase:directClaim ?claim .
+          ?company ?claim ?value .
+          BIND("property" AS ?kind)
+        } UNION {
+          # Founders, CEOs and other key people who are humans
+          VALUES ?prop { wd:P169 wd:P112 wd:P3320 }
+          ?prop wikibase:directClaim ?claim .
+          ?company ?claim ?value .
+          ?value wdt:P31 wd:Q5 .
+          BIND("person" AS ?kind)
+        }
+      }
+      SERVICE wikibase:label { bd:serviceParam wikibase:language "en". }
+"""
+
+def _parse_wikidata_details(bindings):
+    """
+    Group the rows of a Wikidata detail query by entity.
+    
+    Args:
+        bindings: The result rows
+        
+    Returns:
+        Dictionary mapping entity IDs to their 'properties' and 'associated_people'
+    """
+    details = {}
+    for result in bindings:
+        entity_id = result["company"]["value"].split("/")[-1]
+        entity = details.setdefault(entity_id, {"properties": {}, "associated_people": []})
+        kind = result.get("kind", {}).get("value")
+        prop_label = result.get("propLabel", {}).get("value")
+        value_label = result.get("valueLabel", {}).get("value", "Unknown")
+        if kind == "property" and prop_label:
+            entity["properties"][prop_label] = value_label
+        elif kind == "person" and len(entity["associated_people"]) < 10:
+            person = {"name": value_label, "role": prop_label or "associated person", "source": "wikidata",
+                      "entity_id": result.get("value", {}).get("value", "").split("/")[-1]}
+            if person not in entity["associated_people"]:
+                entity["associated_people"].append(person)
+    return details
+
+def _wikidata_entity_result(entity_name, entity_id, details):
+    """
+    Build the result of a Wikidata lookup from the details of the entity found.
+    
+    Args:
+        entity_name: The queried name of the organization
+        entity_id: The ID of the entity found, or None
+        details: The entity's 'properties' and 'associated_people'
+        
+    Returns:
+        Dictionary with the 'entity_info' (None if no entity was found) and
+        the 'associated_people'
+    """
+    if entity_id is None:
+        return {"entity_info": None, "associated_people": []}
+    
+    return {
+        "entity_info": {
+            "entity_id": entity_id,
+            "entity_name": entity_name,
+            "properties": details.get("properties", {})
+        },
+        "associated_people": [
+            {**person, "entity_connection": entity_name} for person in details.get("associated_people", [])
+        ]
+    }
+
+def _fetch_wikidata_entity(entity_name):
+    """
+    Look up an organization and its associated people on Wikidata.
+    
+    The entity search, its properties and its associated people are fetched
+    with a single SPARQL query, in which the best search hit is selected by a
+    subquery.
+    
+    Args:
+        entity_name: The name of the organization
+        
+    Returns:
+        Dictionary with the 'entity_info' (None if no entity was found) and
+        the 'associated_people'
+    """
+    query = f"""
+    SELECT ?company ?kind ?propLabel ?value ?valueLabel WHERE {{
+      {{
+        SELECT ?company WHERE {{
           SERVICE wikibase:mwapi {{
             bd:serviceParam wikibase:endpoint "www.wikidata.org";
                             wikibase:api "EntitySearch";
-                            mwapi:search "{entity_name}";
+                            mwapi:search {_sparql_string(entity_name)};
                             mwapi:language "en".
             ?company wikibase:apiOutputItem mwapi:item.
+            ?ordinal wikibase:apiOrdinal true.
           }}
-          SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
         }}
+        ORDER BY ?ordinal
         LIMIT 1
+      }}
+      {_WIKIDATA_DETAILS_PATTERN}
+    }}
+    """
+    
+    details = _parse_wikidata_details(_run_sparql(query)["results"]["bindings"])
+    entity_id = next(iter(details), None)
+    return _wikidata_entity_result(entity_name, entity_id, details.get(entity_id, {}))
+
+def _fetch_wikidata_entities(entity_names):
+    """
+    Look up several organizations and their associated people on Wikidata.
+    
+    All names are resolved to entity IDs with one search query, whose
+    VALUES clause feeds every name to the entity search, and the properties
+    and people of all entities found are fetched with one detail query over
+    VALUES ?company, so a batch costs two requests regardless of its size.
+    
+    Args:
+        entity_names: The names of the organizations
+        
+    Returns:
+        Dictionary mapping each name to what _fetch_wikidata_entity returns for it
+    """
+    search_query = f"""
+    SELECT ?name ?company WHERE {{
+      VALUES ?name {{ {' '.join(_sparql_string(name) for name in entity_names)} }}
+      SERVICE wikibase:mwapi {{
+        bd:serviceParam wikibase:endpoint "www.wikidata.org";
+                        wikibase:api "EntitySearch";
+                        mwapi:search ?name;
+                        mwapi:language "en".
+        ?company wikibase:apiOutputItem mwapi:item.
+        ?ordinal wikibase:apiOrdinal true.
+      }}
+      FILTER(?ordinal = 0)
+    }}
+    """
+    
+    entity_ids = {}
+    for result in _run_sparql(search_query)["results"]["bindings"]:
+        entity_ids.setdefault(result["name"]["value"], result["company"]["value"].split("/")[-1])
+    
+    details = {}
+    if entity_ids:
+        details_query = f"""
+        SELECT ?company ?kind ?propLabel ?value ?valueLabel WHERE {{
+          VALUES ?company {{ {' '.join(f"wd:{entity_id}" for entity_id in dict.fromkeys(entity_ids.values()))} }}
+          {_WIKIDATA_DETAILS_PATTERN}
+        }}
         """
+        details = _parse_wikidata_details(_run_sparql(details_query)["results"]["bindings"])
+    
+    return {
+        name: _wikidata_entity_result(name, entity_ids.get(name), details.get(entity_ids.get(name), {}))
+        for name in entity_names
+    }
+
+def _lookup_wikidata_store(entity_names):
+    """
+    Look up organizations in the local Wikidata subset store.
+    
+    Args:
+        entity_names: The names of the organizations
         
-        sparql.setQuery(entity_query)
-        sparql.setReturnFormat(JSON)
-        results = sparql.query().convert()
+    Returns:
+        Dictionary mapping the names answered locally to what _fetch_wikidata_entity
+        would return for them: the names found, or all names in 'local' mode
+    """
+    if WIKIDATA_LOOKUP_MODE not in ("local", "auto"):
+        return {}
+    store = _use_wikidata_store()
+    
+    results = {}
+    for name in entity_names:
+        found = store.lookup(name) if store else None
+        if found or WIKIDATA_LOOKUP_MODE == "local":
+            results[name] = _wikidata_entity_result(name, found and found["entity_id"], found or {})
+    return results
+
+def _use_wikidata_store():
+    """
+    Get the local Wikidata store if lookups should use it.
+    
+    Returns:
+        The store, or None if WIKIDATA_LOOKUP_MODE is 'remote' or the store has not been built
+    """
+    if WIKIDATA_LOOKUP_MODE not in ("local", "auto"):
+        return None
+    return get_wikidata_store(WIKIDATA_STORE_FILE)
+
+def _remote_wikidata_ids(entity_ids, organization=False):
+    """
+    Get the Wikidata IDs to query with SPARQL rather than the local store.
+    
+    Args:
+        entity_ids: Wikidata IDs of the items
+        organization: Whether the items are organizations
         
-        if not results["results"]["bindings"]:
-            logger.warning(f"No Wikidata entity found for {entity_name}")
-            return {"status": "no_results", "reason": f"No Wikidata entity found for {entity_name}", "data": None, "associated_people": []}
+    Returns:
+        The IDs the store does not hold, none in 'local' mode and all without a store
+    """
+    if WIKIDATA_LOOKUP_MODE == "local":
+        return []
+    store = _use_wikidata_store()
+    if not store:
+        return list(entity_ids)
+    return [entity_id for entity_id in entity_ids if not store.has(int(entity_id[1:]), organization=organization)]
+
+def wikidata_organization_people(entity_ids):
+    """
+    Get the associated people of Wikidata organizations, with one query per chunk.
+    
+    Args:
+        entity_ids: Wikidata IDs of the organizations, e.g. 'Q205012'
         
-        # Get the entity ID
-        entity_id = results["results"]["bindings"][0]["company"]["value"].split("/")[-1]
+    Returns:
+        Dictionary mapping each organization ID to its associated people, each
+        with a 'name', 'role' and 'entity_id'
+    """
+    entity_ids = list(dict.fromkeys(entity_ids))
+    people = {entity_id: [] for entity_id in entity_ids}
+    remote_ids = _remote_wikidata_ids(entity_ids, organization=True)
+    store = _use_wikidata_store()
+    local_ids = [entity_id for entity_id in entity_ids if entity_id not in remote_ids]
+    if store:
+        for entity_id in local_ids:
+            people[entity_id] = store.details(int(entity_id[1:]))["associated_people"]
+    
+    for start in range(0, len(remote_ids), WIKIDATA_BATCH_SIZE):
+        chunk = remote_ids[start:start + WIKIDATA_BATCH_SIZE]
+        query = f"""
+        SELECT ?company ?kind ?propLabel ?value ?valueLabel WHERE {{
+          VALUES ?company {{ {' '.join(f"wd:{entity_id}" for entity_id in chunk)} }}
+          {_WIKIDATA_DETAILS_PATTERN}
+        }}
+        """
+        for entity_id, details in _parse_wikidata_details(_run_sparql(query)["results"]["bindings"]).items():
+            people[entity_id] = details["associated_people"]
+    return people
+
+def wikidata_person_organizations(entity_ids):
+    """
+    Get the organizations Wikidata people founded, lead or sit on the board of, with one query per chunk.
+    
+    Args:
+        entity_ids: Wikidata IDs of the people
         
-        # Get detailed information about the entity
-        info_query = f"""
-        SELECT ?prop ?propLabel ?value ?valueLabel WHERE {{
-          wd:{entity_id} ?p ?value .
-          ?prop wikibase:directClaim ?p .
+    Returns:
+        Dictionary mapping each person ID to the organizations, each with an
+        'entity_id', 'name' and the person's 'role'
+    """
+    entity_ids = list(dict.fromkeys(entity_ids))
+    organizations = {entity_id: [] for entity_id in entity_ids}
+    remote_ids = _remote_wikidata_ids(entity_ids)
+    store = _use_wikidata_store()
+    local_ids = [int(entity_id[1:]) for entity_id in entity_ids if entity_id not in remote_ids]
+    if store and local_ids:
+        for person_id, found in store.organizations_of_people(local_ids).items():
+            organizations[f"Q{person_id}"] = found
+    
+    for start in range(0, len(remote_ids), WIKIDATA_BATCH_SIZE):
+        chunk = remote_ids[start:start + WIKIDATA_BATCH_SIZE]
+        query = f"""
+        SELECT ?person ?company ?companyLabel ?propLabel WHERE {{
+          VALUES ?person {{ {' '.join(f"wd:{entity_id}" for entity_id in chunk)} }}
+          VALUES ?prop {{ wd:P169 wd:P112 wd:P3320 }}
+          ?prop wikibase:directClaim ?claim .
+          ?company ?claim ?person .
           SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
-          FILTER((?prop = wdt:P17) || (?prop = wdt:P1454) || (?prop = wdt:P112) || (?prop = wdt:P169) || (?prop = wdt:P571) || (?prop = wdt:P856))
         }}
         """
+        for result in _run_sparql(query)["results"]["bindings"]:
+            organizations[result["person"]["value"].split("/")[-1]].append({
+                "entity_id": result["company"]["value"].split("/")[-1],
+                "name": result.get("companyLabel", {}).get("value", ""),
+                "role": result.get("propLabel", {}).get("value", "associated person"),
+            })
+    return organizations
+
+def _wikidata_result(entity_name, full_result, cache_status, transaction_id):
+    """
+    Build the result of query_wikidata from a lookup and save it to the transaction folder.
+    
+    Args:
+        entity_name: The queried name of the organization
+        full_result: The lookup, possibly cached from another transaction
+        cache_status: 'hit' or 'miss'
+        transaction_id: The transaction ID
         
-        sparql.setQuery(info_query)
-        info_results = sparql.query().convert()
+    Returns:
+        The result of query_wikidata
+    """
+    if full_result["entity_info"] is None:
+        logger.warning(f"No Wikidata entity found for {entity_name}")
+        return {"status": "no_results", "reason": f"No Wikidata entity found for {entity_name}", "data": None,
+                "associated_people": [], "cache": cache_status}
+    
+    # The connection of the people is the name queried by this transaction
+    associated_people = [
+        {**person, "entity_connection": entity_name} for person in full_result["associated_people"]
+    ]
+    full_result = {**full_result, "entity_info": {**full_result["entity_info"], "entity_name": entity_name},
+                   "associated_people": associated_people}
+    entity_info = full_result["entity_info"]
         
-        # Process the results
-        entity_info = {
-            "entity_id": entity_id,
-            "entity_name": entity_name,
-            "properties": {}
-        }
+    # Save the Wikidata information to the transaction folder
+    save_transaction_data(
+        RESULTS_FOLDER, 
+        transaction_id, 
+        f"{entity_name.replace(' ', '_')}.json", 
+        full_result, 
+        subfolder="entity_data/organization_results/wikidata"
+    )
         
-        for result in info_results["results"]["bindings"]:
-            prop_label = result["propLabel"]["value"]
-            value_label = result.get("valueLabel", {}).get("value", "Unknown")
-            entity_info["properties"][prop_label] = value_label
-        
-        # Now look for associated people (founders, CEOs, key people)
-        people_query = f"""
-        SELECT DISTINCT ?person ?personLabel ?roleLabel WHERE {{
-          wd:{entity_id} ?rel ?person .
-          ?role wikibase:directClaim ?rel .
-          FILTER(?role IN (wdt:P169, wdt:P112, wdt:P3320))
-          ?person wdt:P31 wd:Q5 .  # Filter for humans
-          SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
-        }}
-        LIMIT 10
-        """
+    return {"status": "success", "data": entity_info, "associated_people": associated_people,
+            "cache": cache_status}
+
+def query_wikidata(entity_name, **context):
+    """
+    Query Wikidata for information about an organization using SPARQL.
+    Returns information and potentially new people associated with the entity.
+    """
+    try:
+        transaction_id = _get_transaction_id_from_context(context)
         
-        sparql.setQuery(people_query)
-        people_results = sparql.query().convert()
-        
-        # Extract associated people
-        associated_people = []
-        for result in people_results["results"]["bindings"]:
-            person_name = result.get("personLabel", {}).get("value")
-            role = result.get("roleLabel", {}).get("value", "associated person")
-            if person_name:
-                associated_people.append({
-                    "name": person_name,
-                    "role": role,
-                    "source": "wikidata",
-                    "entity_connection": entity_name
-                })
-            
-        # Save the Wikidata information to the transaction folder
-        full_result = {
-            "entity_info": entity_info,
-            "associated_people": associated_people
-        }
+        local_results = _lookup_wikidata_store([entity_name])
+        if entity_name in local_results:
+            return _wikidata_result(entity_name, local_results[entity_name], "local", transaction_id)
         
-        save_transaction_data(
-            RESULTS_FOLDER, 
-            transaction_id, 
-            f"{entity_name.replace(' ', '_')}.json", 
-            full_result, 
-            subfolder="entity_data/organization_results/wikidata"
-        )
-            
-        return {"status": "success", "data": entity_info, "associated_people": associated_people}
+        cache = get_enrichment_cache()
+        full_result = cache.get("wikidata", entity_name)
+        cache_status = "hit" if full_result is not None else "miss"
+        if full_result is None:
+            full_result = _fetch_wikidata_entity(entity_name)
+            cache.set("wikidata", entity_name, full_result)
+        
+        return _wikidata_result(entity_name, full_result, cache_status, transaction_id)
         
     except Exception as e:
         logger.error(f"Error querying Wikidata: {str(e)}")
         return {"status": "failed", "reason": f"Error querying Wikidata: {str(e)}", "data": None, "associated_people": []}
 
+def query_wikidata_batch(entity_names, **context):
+    """
+    Query Wikidata for a batch of organizations.
+    
+    Organizations found in the local Wikidata store or the enrichment cache
+    are answered from there; the others are looked up in chunks of WIKIDATA_BATCH_SIZE names, each with one
+    search and one detail SPARQL request, so a transaction or bulk chunk
+    stays well under the query service's concurrent query limit.
+    
+    Args:
+        entity_names: List of organization names
+        context: The task context dict
+        
+    Returns:
+        Dictionary mapping each organization name to the result query_wikidata would return for it
+    """
+    results = {}
+    transaction_id = _get_transaction_id_from_context(context)
+    names = list(dict.fromkeys(name for name in entity_names if name))
+    for name in entity_names:
+        if not name:
+            results[name] = {"status": "failed", "reason": "No organization name provided", "data": None,
+                             "associated_people": []}
+    
+    try:
+        lookups = {name: (full_result, "local") for name, full_result in _lookup_wikidata_store(names).items()}
+    except Exception as e:
+        logger.error(f"Error looking up organizations in the Wikidata store: {str(e)}")
+        lookups = {}
+    
+    cache = get_enrichment_cache()
+    for name in names:
+        if name in lookups:
+            continue
+        cached = cache.get("wikidata", name)
+        if cached is not None:
+            lookups[name] = (cached, "hit")
+    
+    misses = [name for name in names if name not in lookups]
+    for start in range(0, len(misses), WIKIDATA_BATCH_SIZE):
+        chunk = misses[start:start + WIKIDATA_BATCH_SIZE]
+        try:
+            for name, full_result in _fetch_wikidata_entities(chunk).items():
+                cache.set("wikidata", name, full_result)
+                lookups[name] = (full_result, "miss")
+        except Exception as e:
+            logger.error(f"Error querying Wikidata for {len(chunk)} organizations: {str(e)}")
+            for name in chunk:
+                results[name] = {"status": "failed", "reason": f"Error querying Wikidata: {str(e)}", "data": None,
+                                 "associated_people": []}
+    
+    for name, (full_result, cache_status) in lookups.items():
+        try:
+            results[name] = _wikidata_result(name, full_result, cache_status, transaction_id)
+        except Exception as e:
+            logger.error(f"Error querying Wikidata: {str(e)}")
+            results[name] = {"status": "failed", "reason": f"Error querying Wikidata: {str(e)}", "data": None,
+                             "associated_people": []}
+    
+    logger.info(f"Queried Wikidata for {len(names)} organizations: {len(names) - len(misses)} local or cached, "
+                f"{len(misses)} looked up")
+    return results
+
 def check_pep_list(person_name, **context):
     """
     Check if a person is on the PEP (Politically Exposed Persons) list.
     """
     try:
-        transaction_id = _get_transaction_id_from_context(context)
-        
         if not person_name:
             return {"status": "failed", "reason": "No person name provided", "data": None}
+        
+        return screen_pep_batch([person_name], **context)[person_name]
+        
+    except Exception as e:
+        logger.error(f"Error checking PEP list: {str(e)}")
+        return {"status": "failed", "reason": f"Error checking PEP list: {str(e)}", "data": None}
+
+def screen_pep_batch(person_names, **context):
+    """
+    Check a batch of people against the PEP (Politically Exposed Persons) list.
+    
+    All names are resolved in a single pass over the PEP index, so one task can
+    screen every person of a transaction (or of a whole bulk upload) at once.
+    Matches are ranked by name similarity and limited to PEP_MATCH_TOP_K rows
+    scoring at least PEP_MATCH_THRESHOLD.
+    
+    Args:
+        person_names: List of person names to screen
+        context: The task context dict
+        
+    Returns:
+        Dictionary mapping each person name to the result check_pep_list would return for it
+    """
+    results = {}
+    try:
+        transaction_id = _get_transaction_id_from_context(context)
+        
+        # Drop duplicates while keeping the order of the names
+        names = list(dict.fromkeys(name for name in person_names if name))
+        for name in person_names:
+            if not name:
+                results[name] = {"status": "failed", "reason": "No person name provided", "data": None}
+        
+        if not names:
+            return results
             
         if not os.path.exists(PEP_DATA_FILE):
             logger.warning(f"PEP data file {PEP_DATA_FILE} not found")
-            return {"status": "failed", "reason": f"PEP data file {PEP_DATA_FILE} not found", "data": None}
+            for name in names:
+                results[name] = {"status": "failed", "reason": f"PEP data file {PEP_DATA_FILE} not found", "data": None}
+            return results
         
-        # Create a simplified name for matching
-        simplified_name = re.sub(r'[^\w\s]', '', person_name.lower())
-        name_parts = simplified_name.split()
-        
-        # Read the PEP data
-        pep_matches = []
+        # Search all names in the compiled PEP index shared by all workers,
+        # using the vectorized engine for large batches such as bulk runs
         try:
-            with open(PEP_DATA_FILE, 'r', encoding='utf-8') as csv_file:
-                # Changed delimiter from tab to comma based on the sample data
-                csv_reader = csv.DictReader(csv_file)
-                
-                for row in csv_reader:
-                    # Check for missing keys and use empty string as default
-                    row_name = row.get('name', '')
-                    row_aliases = row.get('aliases', '').split(';') if row.get('aliases') else []
-                    
-                    # Simplify the row name and aliases for matching
-                    simplified_row_name = re.sub(r'[^\w\s]', '', row_name.lower())
-                    simplified_aliases = [re.sub(r'[^\w\s]', '', alias.lower()) for alias in row_aliases]
-                    
-                    # Improved name matching logic
-                    # Check if any part of the search name appears in the PEP name
-                    name_match = False
-                    for part in name_parts:
-                        if part and len(part) > 2:  # Only consider parts with more than 2 characters
-                            if part in simplified_row_name.split():
-                                name_match = True
-                                break
-                    
-                    # Check if any part of the search name appears in any alias
-                    alias_match = False
-                    for alias in simplified_aliases:
-                        for part in name_parts:
-                            if part and len(part) > 2:
-                                if part in alias.split():
-                                    alias_match = True
-                                    break
-                        if alias_match:
-                            break
-                    
-                    if name_match or alias_match:
-                        pep_matches.append(row)
-        
+            pep_index = get_pep_index(PEP_DATA_FILE, PEP_INDEX_FILE)
+            if len(names) >= PEP_VECTORIZED_MIN_BATCH:
+                batch_matches = search_batch_vectorized(
+                    pep_index, get_pep_similarity_engine(pep_index), names,
+                    PEP_MATCH_THRESHOLD, PEP_MATCH_TOP_K
+                )
+            else:
+                batch_matches = pep_index.search_batch(names, PEP_MATCH_THRESHOLD, PEP_MATCH_TOP_K)
         except Exception as e:
             logger.error(f"Error reading PEP data file: {str(e)}")
-            return {"status": "failed", "reason": f"Error reading PEP data: {str(e)}", "data": None}
+            for name in names:
+                results[name] = {"status": "failed", "reason": f"Error reading PEP data: {str(e)}", "data": None}
+            return results
         
-        # Save the PEP matches to the transaction folder
-        save_transaction_data(
-            RESULTS_FOLDER, 
-            transaction_id, 
-            f"{person_name.replace(' ', '_')}.json", 
-            pep_matches, 
-            subfolder="entity_data/people_results/pep"
-        )
+        logger.info(f"Screened {len(names)} people against PEP dataset version {pep_index.version}")
+        _record_screening_dataset(transaction_id, "pep", pep_index.version)
+        
+        for name in names:
+            pep_matches = batch_matches[name]
+            
+            # Save the PEP matches to the transaction folder
+            save_transaction_data(
+                RESULTS_FOLDER, 
+                transaction_id, 
+                f"{name.replace(' ', '_')}.json", 
+                pep_matches, 
+                subfolder="entity_data/people_results/pep"
+            )
+            
+            results[name] = {"status": "success", "data": pep_matches, "dataset_version": pep_index.version}
             
-        return {"status": "success", "data": pep_matches}
+        return results
         
     except Exception as e:
-        logger.error(f"Error checking PEP list: {str(e)}")
-        return {"status": "failed", "reason": f"Error checking PEP list: {str(e)}", "data": None}
+        logger.error(f"Error screening PEP batch: {str(e)}")
+        for name in person_names:
+            results.setdefault(name, {"status": "failed", "reason": f"Error checking PEP list: {str(e)}", "data": None})
+        return results
+
+def _fetch_adverse_news(entity_name, allow_fetch=True):
+    """
+    Get the articles GDELT found for an entity, fetching only the ones seen since its watermark.
+    
+    Args:
+        entity_name: Name of the entity
+        allow_fetch: Whether GDELT may be asked, or only the stored articles
+            of an entity checked within the refresh interval returned
+        
+    Returns:
+        Tuple of the entity's stored GDELT articles and the cache status:
+        'hit' if no request was needed, 'delta' or 'miss' for a full pull.
+        None if the entity needs a request that is not allowed.
+    """
+    # Format entity name for URL
+    formatted_name = entity_name.replace(' ', '+')
+    
+    # Build the query for fraud, scam, sanctions related news
+    query_terms = "fraud+scam+scandal+sanctions+corruption+lawsuit+investigation"
+    url = (f"https://api.gdeltproject.org/api/v2/doc/doc?query={formatted_name}+{query_terms}"
+           f"&mode=artlist&format=json&sort=datedesc&maxrecords={GDELT_MAX_RECORDS}")
+    
+    # Only the articles seen since the entity's watermark are fetched, and
+    # not at all if the entity was checked within the refresh interval
+    store = get_news_store(NEWS_STORE_FILE)
+    watermark = store.watermark(entity_name, query_terms)
+    if watermark and time.time() - watermark["checked_at"] < NEWS_REFRESH_INTERVAL:
+        return store.articles(entity_name), "hit"
+    if not allow_fetch:
+        return None
+    
+    full = watermark is None
+    if not full:
+        url += f"&startdatetime={store.delta_start(watermark)}"
+    print(f"Querying GDELT API with URL: {url}")
+    
+    response = get_http_session("gdelt").get(url)
+    response.raise_for_status()
+    data = response.json()
+    
+    fetched = data.get("articles", [])
+    new_articles = store.merge(entity_name, query_terms, fetched, full, retention_days=NEWS_RETENTION_DAYS)
+    logger.info(f"GDELT returned {len(fetched)} articles for {entity_name} "
+                f"({'full' if full else 'delta'} fetch, {new_articles} new)")
+    return store.articles(entity_name), "miss" if full else "delta"
+
+def _adverse_news_result(entity_name, adverse_articles, cache_status, transaction_id, is_person):
+    """
+    Build the result of check_adverse_news and save it to the transaction folder.
+    
+    Args:
+        entity_name: Name of the entity
+        adverse_articles: The entity's scored adverse articles
+        cache_status: The cache status of the fetch
+        transaction_id: The transaction ID
+        is_person: Whether the entity is a person
+        
+    Returns:
+        The result of check_adverse_news
+    """
+    subfolder = "entity_data/people_results/news" if is_person else "entity_data/organization_results/news"
+    
+    # Save the adverse news to the transaction folder
+    save_transaction_data(
+        RESULTS_FOLDER, 
+        transaction_id, 
+        f"{entity_name.replace(' ', '_')}.json", 
+        adverse_articles, 
+        subfolder=subfolder
+    )
+    
+    return {"status": "success", "data": adverse_articles, "cache": cache_status}
+
+def _score_adverse_news(articles_by_entity):
+    """Score the articles of many entities with the configured adverse media settings."""
+    return score_articles(
+        articles_by_entity, ADVERSE_MEDIA_TOP_K, ADVERSE_MEDIA_MIN_SCORE, ADVERSE_MEDIA_HALF_LIFE_DAYS
+    )
 
 def check_adverse_news(entity_name, **context):
     """
     Check for adverse news about an entity using the GDELT API.
+    
+    The entity's articles are scored locally (see dags.utils.adverse_media)
+    and only the most adverse ones are returned.
     """
     try:
         transaction_id = _get_transaction_id_from_context(context)
         
         if not entity_name:
             return {"status": "failed", "reason": "No entity name provided", "data": []}
-            
-        # Format entity name for URL
-        formatted_name = entity_name.replace(' ', '+')
-        
-        # Build the query for fraud, scam, sanctions related news
-        query_terms = "fraud+scam+scandal+sanctions+corruption+lawsuit+investigation"
-        url = f"https://api.gdeltproject.org/api/v2/doc/doc?query={formatted_name}+{query_terms}&mode=artlist&format=json"
-        
-        print(f"Querying GDELT API with URL: {url}")
         
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        articles = data.get("articles", [])
-        
-        # Process and filter articles
-        filtered_articles = []
-        for article in articles:
-            article_info = {
-                "title": article.get("title", ""),
-                "url": article.get("url", ""),
-                "source": article.get("domain", ""),
-                "date": article.get("seendate", ""),
-                "tone": article.get("tone", 0),  # GDELT sentiment score
-                "themes": article.get("themes", [])
-            }
-            
-            # Filter for negative sentiment and relevant themes
-            if article_info["tone"] < -2:  # Negative tone
-                filtered_articles.append(article_info)
+        articles, cache_status = _fetch_adverse_news(entity_name)
+        adverse_articles = _score_adverse_news({entity_name: articles})[entity_name]
         
         # Determine the correct subfolder based on the task ID or entity type
         task_instance = context.get('task_instance')
         task_id = task_instance.task_id if task_instance else ''
-        is_person = task_id and 'person' in task_id
-        subfolder = "entity_data/people_results/news" if is_person else "entity_data/organization_results/news"
+        is_person = bool(task_id and 'person' in task_id)
         
-        # Save the adverse news to the transaction folder
-        save_transaction_data(
-            RESULTS_FOLDER, 
-            transaction_id, 
-            f"{entity_name.replace(' ', '_')}.json", 
-            filtered_articles, 
-            subfolder=subfolder
-        )
-            
-        return {"status": "success", "data": filtered_articles}
+        return _adverse_news_result(entity_name, adverse_articles, cache_status, transaction_id, is_person)
         
     except requests.exceptions.RequestException as e:
         logger.error(f"Error during GDELT request: {str(e)}")
@@ -402,6 +980,123 @@ def check_adverse_news(entity_name, **context):
         logger.error(f"Error checking adverse news: {str(e)}")
         return {"status": "failed", "reason": f"Unknown error: {str(e)}", "data": []}
 
+def check_adverse_news_batch(entities, **context):
+    """
+    Check many entities for adverse news, scoring all their articles in one batch.
+    
+    The articles of every entity are fetched from GDELT (see
+    _fetch_adverse_news) and then scored together. A failed fetch only fails
+    its entity.
+    
+    The rate limit of GDELT serializes the fetches, so at most
+    ADVERSE_MEDIA_BATCH_MAX_FETCHES entities are fetched per batch (about
+    5 seconds each at the default 0.2 requests per second). Entities over the
+    limit are left out of the results, for the entity tasks to check them on
+    their own; entities checked within the refresh interval need no fetch and
+    are always included.
+    
+    Args:
+        entities: List of (entity_type, entity_name) pairs, the type being a
+            FollowTheMoney schema such as 'Company' or 'Person'
+        context: The task context dict
+        
+    Returns:
+        Dictionary mapping entity type and then entity name to the result
+        check_adverse_news would return for it
+    """
+    results = {}
+    try:
+        transaction_id = _get_transaction_id_from_context(context)
+        
+        started = time.monotonic()
+        fetched = {}
+        fetches_left = ADVERSE_MEDIA_BATCH_MAX_FETCHES
+        deferred = 0
+        for entity_type, entity_name in dict.fromkeys(entities):
+            if not entity_name:
+                results.setdefault(entity_type, {})[entity_name] = {
+                    "status": "failed", "reason": "No entity name provided", "data": []
+                }
+                continue
+            try:
+                found = _fetch_adverse_news(entity_name, allow_fetch=fetches_left > 0)
+                if found is None:
+                    deferred += 1
+                    continue
+                fetched[(entity_type, entity_name)] = found
+                if found[1] != "hit":
+                    fetches_left -= 1
+            except requests.exceptions.RequestException as e:
+                fetches_left -= 1
+                logger.error(f"Error during GDELT request for {entity_name}: {str(e)}")
+                results.setdefault(entity_type, {})[entity_name] = {
+                    "status": "failed", "reason": f"GDELT API request failed: {str(e)}", "data": []
+                }
+            except sqlite3.Error as e:
+                fetches_left -= 1
+                logger.error(f"Error storing the news articles of {entity_name}: {str(e)}")
+                results.setdefault(entity_type, {})[entity_name] = {
+                    "status": "failed", "reason": f"News store error: {str(e)}", "data": []
+                }
+        
+        # The same name may be both a company and a person, so articles are scored per name
+        scored = _score_adverse_news({entity_name: articles for (_, entity_name), (articles, _) in fetched.items()})
+        for (entity_type, entity_name), (_, cache_status) in fetched.items():
+            results.setdefault(entity_type, {})[entity_name] = _adverse_news_result(
+                entity_name, scored[entity_name], cache_status, transaction_id, entity_type == 'Person'
+            )
+        logger.info(f"Checked {len(fetched)} entities for adverse news in {time.monotonic() - started:.1f}s, "
+                    f"{ADVERSE_MEDIA_BATCH_MAX_FETCHES - fetches_left} GDELT fetches, "
+                    f"{deferred} entities left to their own tasks")
+        return results
+        
+    except Exception as e:
+        logger.error(f"Error checking adverse news: {str(e)}")
+        for entity_type, entity_name in entities:
+            results.setdefault(entity_type, {}).setdefault(
+                entity_name, {"status": "failed", "reason": f"Unknown error: {str(e)}", "data": []}
+            )
+        return results
+
+def collect_news_articles(transaction_id, entity_results):
+    """
+    Get the articles referenced by the news results of a transaction's entities, once each.
+    
+    Args:
+        transaction_id: The transaction ID
+        entity_results: The results of the entities, with the result of
+            check_adverse_news under 'news'
+        
+    Returns:
+        Dictionary mapping article ids to the article's 'title', 'url', 'source' and 'date'
+    """
+    try:
+        article_ids = [
+            item.get("article_id")
+            for results in entity_results
+            for item in ((results or {}).get("news") or {}).get("data") or []
+        ]
+        stored = get_news_store(NEWS_STORE_FILE).get_articles(filter(None, article_ids))
+        articles = {
+            article_id: {
+                "title": article.get("title", ""),
+                "url": article.get("url", ""),
+                "source": article.get("domain", ""),
+                "date": article.get("seendate", "")
+            }
+            for article_id, article in stored.items()
+        }
+        
+        # Save the articles to the transaction folder
+        save_transaction_data(RESULTS_FOLDER, transaction_id, "news_articles.json", articles)
+        
+        logger.info(f"Collected {len(articles)} distinct articles from {len(article_ids)} news references")
+        return articles
+    
+    except Exception as e:
+        logger.error(f"Error collecting news articles: {str(e)}")
+        return {}
+
 def process_wikidata_people(**context):
     """
     Process new people found via Wikidata queries and create tasks for them.
@@ -422,7 +1117,7 @@ def process_wikidata_people(**context):
         if original_entities and 'people' in original_entities:
             for person in original_entities['people']:
                 if 'name' in person:
-                    original_people.add(person['name'].lower())
+                    original_people.add(entity_name_key(person['name']))
     
         # Look for all wikidata results
         for task_id in ti.xcom_pull(dag_id=context.get('dag').dag_id, include_prior_dates=True) or []:
@@ -431,9 +1126,9 @@ def process_wikidata_people(**context):
                 if wikidata_result and 'status' in wikidata_result and wikidata_result['status'] == 'success':
                     if 'associated_people' in wikidata_result:
                         for person in wikidata_result['associated_people']:
-                            if person['name'].lower() not in original_people:
+                            if entity_name_key(person['name']) not in original_people:
                                 new_people.append(person)
-                                original_people.add(person['name'].lower())  # Mark as processed to avoid duplicates
+                                original_people.add(entity_name_key(person['name']))  # Mark as processed to avoid duplicates
         
         # Save the new people list to the transaction folder
         save_transaction_data(
@@ -0,0 +1,299 @@
+"""
+Cross-transaction cache of enrichment provider responses.
+
+The same counterparties recur across many transactions, so the raw responses
+of OpenCorporates, OpenSanctions and Wikidata are cached by provider,
+normalized entity name (see dags.utils.name_normalization.entity_name_key)
+and query parameters. Each provider has its own time to live, and the cache
+is bounded in size: once it holds more than the maximum number of entries,
+expired entries and then the oldest ones are evicted.
+
+GDELT articles are not cached here but kept by dags.utils.news_store.
+
+Two backends are available:
+    sqlite  a database file on the data volume shared by all workers (default)
+    redis   a Redis database, e.g. the one of the Celery broker (needs the redis package)
+
+Only successful responses are cached, and cache errors are logged and treated
+as misses, so a broken cache never fails an enrichment task.
+"""
+import abc
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from dags.config.settings import (
+    ENRICHMENT_CACHE_BACKEND, ENRICHMENT_CACHE_TTLS, ENRICHMENT_CACHE_MAX_ENTRIES,
+    ENRICHMENT_CACHE_FILE, ENRICHMENT_CACHE_REDIS_URL
+)
+from dags.utils.name_normalization import entity_name_key
+
+logger = logging.getLogger(__name__)
+
+# Time to live in seconds of the providers without a configured TTL
+DEFAULT_TTL = 86400
+
+# Number of writes between two eviction passes
+EVICTION_INTERVAL = 100
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def parse_ttls(ttls: str) -> Dict[str, int]:
+    """
+    Parse per-provider TTLs of the form "provider=seconds,provider=seconds".
+
+    Args:
+        ttls: The TTL specification
+
+    Returns:
+        Dictionary mapping provider names to TTLs in seconds
+    """
+    parsed = {}
+    for item in ttls.split(','):
+        provider, _, seconds = item.partition('=')
+        if provider.strip() and seconds.strip():
+            parsed[provider.strip()] = int(seconds)
+    return parsed
+
+
+def cache_key(provider: str, entity_name: str, params: Optional[Dict] = None) -> str:
+    """
+    Build the cache key of a provider query.
+
+    Args:
+        provider: Name of the provider, e.g. 'opencorporates'
+        entity_name: The queried entity name, normalized for the key
+        params: Other parameters of the query that change its response
+
+    Returns:
+        The cache key
+    """
+    encoded = json.dumps([entity_name_key(entity_name), params or {}], sort_keys=True)
+    return f"{provider}:{hashlib.sha1(encoded.encode('utf-8')).hexdigest()}"
+
+
+class EnrichmentCache(abc.ABC):
+    """
+    Base class of the cache backends.
+
+    Backends implement _get, _set and _evict; errors raised by them are
+    logged and turned into cache misses.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, int]] = None, max_entries: int = 100000):
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self._writes = 0
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        """Get the serialized value of a key, or None if it is missing or expired."""
+
+    @abc.abstractmethod
+    def _set(self, key: str, provider: str, value: str, ttl: int) -> None:
+        """Store the serialized value of a key for ttl seconds."""
+
+    @abc.abstractmethod
+    def _evict(self) -> None:
+        """Delete the expired entries, then the oldest ones over max_entries."""
+
+    def get(self, provider: str, entity_name: str, params: Optional[Dict] = None) -> Optional[Any]:
+        """
+        Get a cached provider response.
+
+        Args:
+            provider: Name of the provider
+            entity_name: The queried entity name
+            params: Other parameters of the query
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        try:
+            value = self._get(cache_key(provider, entity_name, params))
+            return None if value is None else json.loads(value)
+        except Exception as e:
+            logger.warning(f"Enrichment cache lookup failed for {provider}: {str(e)}")
+            return None
+
+    def set(self, provider: str, entity_name: str, value: Any, params: Optional[Dict] = None) -> None:
+        """
+        Cache a provider response for the provider's TTL.
+
+        Args:
+            provider: Name of the provider
+            entity_name: The queried entity name
+            value: The JSON-serializable response, must not be None
+            params: Other parameters of the query
+        """
+        ttl = self.ttls.get(provider, DEFAULT_TTL)
+        if value is None or ttl <= 0:
+            return
+        try:
+            self._set(cache_key(provider, entity_name, params), provider, json.dumps(value), ttl)
+            self._writes += 1
+            if self._writes % EVICTION_INTERVAL == 0:
+                self._evict()
+        except Exception as e:
+            logger.warning(f"Enrichment cache update failed for {provider}: {str(e)}")
+
+
+class NullEnrichmentCache(EnrichmentCache):
+    """Cache backend that stores nothing, used when caching is disabled."""
+
+    def _get(self, key: str) -> Optional[str]:
+        return None
+
+    def _set(self, key: str, provider: str, value: str, ttl: int) -> None:
+        pass
+
+    def _evict(self) -> None:
+        pass
+
+
+class SQLiteEnrichmentCache(EnrichmentCache):
+    """
+    Cache backend storing entries in a SQLite database file.
+
+    The database runs in WAL mode, so workers on the node can read while
+    another one writes. Connections are opened per process and thread.
+    """
+
+    def __init__(self, cache_file: str, ttls: Optional[Dict[str, int]] = None, max_entries: int = 100000):
+        super().__init__(ttls, max_entries)
+        self.cache_file = cache_file
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, provider TEXT NOT NULL, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_stored_at ON entries (stored_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the connection of the current process and thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.cache_file, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, provider: str, value: str, ttl: int) -> None:
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, provider, value, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, provider, value, now, now + ttl),
+            )
+
+    def _evict(self) -> None:
+        with self._connection() as connection:
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+            excess = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY stored_at LIMIT ?)",
+                    (excess,),
+                )
+
+
+class RedisEnrichmentCache(EnrichmentCache):
+    """
+    Cache backend storing entries in Redis.
+
+    Entries expire through Redis TTLs. A sorted set of the keys by write time
+    bounds the number of entries.
+    """
+
+    def __init__(self, redis_url: str, ttls: Optional[Dict[str, int]] = None, max_entries: int = 100000,
+                 prefix: str = 'enrichment'):
+        super().__init__(ttls, max_entries)
+        import redis
+
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+        self.prefix = prefix
+
+    def _get(self, key: str) -> Optional[str]:
+        value = self.client.get(f"{self.prefix}:{key}")
+        return value.decode('utf-8') if value is not None else None
+
+    def _set(self, key: str, provider: str, value: str, ttl: int) -> None:
+        pipeline = self.client.pipeline()
+        pipeline.set(f"{self.prefix}:{key}", value, ex=ttl)
+        pipeline.zadd(f"{self.prefix}:index", {key: time.time()})
+        pipeline.execute()
+
+    def _evict(self) -> None:
+        index = f"{self.prefix}:index"
+        # Keys older than the longest TTL have expired in Redis already
+        longest_ttl = max([DEFAULT_TTL, *self.ttls.values()])
+        self.client.zremrangebyscore(index, '-inf', time.time() - longest_ttl)
+        excess = self.client.zcard(index) - self.max_entries
+        if excess > 0:
+            oldest = self.client.zrange(index, 0, excess - 1)
+            pipeline = self.client.pipeline()
+            pipeline.delete(*[f"{self.prefix}:{key.decode('utf-8')}" for key in oldest])
+            pipeline.zrem(index, *oldest)
+            pipeline.execute()
+
+
+def create_enrichment_cache(backend: str, ttls: Dict[str, int], max_entries: int,
+                            cache_file: str, redis_url: str) -> EnrichmentCache:
+    """
+    Create a cache backend.
+
+    Args:
+        backend: 'sqlite', 'redis' or 'none'
+        ttls: TTLs in seconds per provider
+        max_entries: Maximum number of cached entries
+        cache_file: Database file of the sqlite backend
+        redis_url: Redis URL of the redis backend
+
+    Returns:
+        The cache, a NullEnrichmentCache if the backend is disabled or unavailable
+    """
+    try:
+        if backend == 'sqlite':
+            return SQLiteEnrichmentCache(cache_file, ttls, max_entries)
+        if backend == 'redis':
+            return RedisEnrichmentCache(redis_url, ttls, max_entries)
+    except Exception as e:
+        logger.warning(f"Enrichment cache backend {backend} is unavailable, caching disabled: {str(e)}")
+    return NullEnrichmentCache(ttls, max_entries)
+
+
+def get_enrichment_cache() -> EnrichmentCache:
+    """
+    Get the process-wide enrichment cache configured in the settings.
+
+    Returns:
+        The enrichment cache
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_enrichment_cache(
+                    ENRICHMENT_CACHE_BACKEND, parse_ttls(ENRICHMENT_CACHE_TTLS), ENRICHMENT_CACHE_MAX_ENTRIES,
+                    ENRICHMENT_CACHE_FILE, ENRICHMENT_CACHE_REDIS_URL,
+                )
+    return _cache
@@ -4,6 +4,7 @@ import logging
 import re
 import google.generativeai as genai
 from dags.utils.gemini_util import create_genai_model
+from dags.utils.jurisdiction import country_code
 
 from dags.config.settings import (
     RESULTS_FOLDER
@@ -112,6 +113,12 @@ def extract_entities_from_text(transaction_text, transaction_id, **context):
         # Ensure transaction_id is set correctly
         entities["transaction_id"] = transaction_id
         
+        # Add the ISO country codes of the free-text jurisdictions and countries
+        for org in entities.get("organizations") or []:
+            org["jurisdiction_code"] = country_code(org.get("jurisdiction"))
+        for person in entities.get("people") or []:
+            person["country_code"] = country_code(person.get("country"))
+        
         # Log the result
         logger.info(f"Extracted entities: {entities}")
         
@@ -0,0 +1,258 @@
+"""
+Token-budgeted compaction of the risk assessment evidence.
+
+The assessment data collected for a transaction holds full provider
+responses: OpenCorporates company objects, FollowTheMoney entities of every
+sanctions and PEP match, every news reference and the transaction text a
+second time. The evidence given to the model keeps only what the analysis
+framework of the prompt uses:
+
+    registry       name, number, jurisdiction, type, status, dates, address
+    sanctions/PEP  caption, schema, score, datasets, countries, topics
+    wikidata       the entity's properties and its people's names and roles
+    news           the kept articles' scores and themes, with the title,
+                   source and date of each referenced article once
+
+Lists longer than the top K are summarized as their count and top K items,
+long strings are shortened, and the evidence is serialized as minified JSON.
+If it exceeds the token budget, it is compacted again with fewer items and
+shorter strings, counting tokens with the model's token counter.
+"""
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dags.config.settings import RISK_ASSESSMENT_TOKEN_BUDGET, EVIDENCE_TOP_K
+
+logger = logging.getLogger(__name__)
+
+# Characters per token of the estimate used when the model cannot count tokens
+CHARS_PER_TOKEN = 4
+
+# Longest strings kept at the first compaction level
+MAX_STRING_CHARS = 400
+
+# Fields of a registry company used by the analysis
+COMPANY_FIELDS = (
+    'name', 'company_number', 'jurisdiction_code', 'company_type', 'current_status', 'inactive',
+    'incorporation_date', 'dissolution_date', 'registered_address_in_full', 'previous_names', 'branch',
+)
+
+# Fields of a sanctions or PEP match, and the FollowTheMoney properties kept of it
+MATCH_FIELDS = (
+    'caption', 'name', 'matched_name', 'schema', 'score', 'match_score', 'countries', 'birth_date',
+    'dataset', 'datasets', 'first_seen', 'last_seen',
+)
+MATCH_PROPERTIES = ('country', 'nationality', 'birthDate', 'position', 'topics', 'program')
+
+# Fields of a news reference and of a referenced article
+NEWS_FIELDS = ('article_id', 'score', 'sentiment', 'themes')
+ARTICLE_FIELDS = ('title', 'source', 'date')
+
+# Fields of an entity of the expanded officer network
+NETWORK_NODE_FIELDS = ('entity_id', 'name', 'type', 'hop', 'role', 'via')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text.
+
+    Args:
+        text: The text
+
+    Returns:
+        The estimated number of tokens
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def model_token_counter(model) -> Callable[[str], int]:
+    """
+    Get a token counter using a Gemini model, falling back to the estimate on errors.
+
+    Args:
+        model: The GenerativeModel the evidence is sent to
+
+    Returns:
+        Function returning the number of tokens of a text
+    """
+    def count_tokens(text: str) -> int:
+        try:
+            return model.count_tokens(text).total_tokens
+        except Exception as e:
+            logger.warning(f"Could not count tokens with the model, estimating: {str(e)}")
+            return estimate_tokens(text)
+    return count_tokens
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == '' or value == [] or value == {}
+
+
+def _compact(value: Any, top_k: int, max_chars: int) -> Any:
+    """Drop empty values, shorten long strings and summarize long lists, recursively."""
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else value[:max_chars - 1] + '…'
+    if isinstance(value, dict):
+        compacted = {key: _compact(item, top_k, max_chars) for key, item in value.items()}
+        return {key: item for key, item in compacted.items() if not _is_empty(item)}
+    if isinstance(value, (list, tuple)):
+        return _summarize([_compact(item, top_k, max_chars) for item in value], top_k)
+    return value
+
+
+def _summarize(items: List, top_k: int) -> Any:
+    """Keep a list of up to top_k items, or summarize it as its count and top_k items."""
+    if len(items) <= top_k:
+        return items
+    return {"count": len(items), "top": items[:top_k]}
+
+
+def _pick(item: Any, fields: Tuple[str, ...], properties: Tuple[str, ...] = ()) -> Any:
+    """Keep the given fields of an item, and of its FollowTheMoney properties."""
+    if not isinstance(item, dict):
+        return item
+    picked = {field: item[field] for field in fields if field in item}
+    item_properties = item.get('properties') if isinstance(item.get('properties'), dict) else {}
+    picked.update((prop, item_properties[prop]) for prop in properties if prop in item_properties)
+    return picked
+
+
+def _compact_check(result: Any, fields: Tuple[str, ...], top_k: int, max_chars: int,
+                   properties: Tuple[str, ...] = ()) -> Any:
+    """
+    Compact the result of a provider check, or its data as saved to the transaction folder.
+    """
+    if isinstance(result, dict) and 'status' in result:
+        if result['status'] != 'success':
+            return _compact({"status": result['status'], "reason": result.get('reason')}, top_k, max_chars)
+        data = result.get('data')
+    else:
+        data = result
+    if isinstance(data, list):
+        data = [_pick(item, fields, properties) for item in data]
+    elif isinstance(data, dict):
+        data = _pick(data, fields, properties)
+    compacted = _compact(data, top_k, max_chars)
+    return [] if compacted is None else compacted
+
+
+def _compact_wikidata(result: Any, top_k: int, max_chars: int) -> Any:
+    if not isinstance(result, dict):
+        return _compact(result, top_k, max_chars)
+    if result.get('status') not in (None, 'success'):
+        return _compact({"status": result['status'], "reason": result.get('reason')}, top_k, max_chars)
+    # Saved Wikidata files hold the 'entity_info', check results hold it as 'data'
+    entity = result.get('data') or result.get('entity_info') or {}
+    people = [_pick(person, ('name', 'role')) for person in result.get('associated_people') or []]
+    return _compact({
+        "entity_id": entity.get('entity_id'),
+        "properties": entity.get('properties'),
+        "people": people,
+    }, top_k, max_chars)
+
+
+def _compact_entity(results: Any, top_k: int, max_chars: int) -> Any:
+    """Compact the results of the checks of an organization or person."""
+    if not isinstance(results, dict):
+        return _compact(results, top_k, max_chars)
+    compacted = {}
+    for check, result in results.items():
+        if check == 'opencorporates':
+            compacted[check] = _compact_check(result, COMPANY_FIELDS, top_k, max_chars)
+        elif check in ('sanctions', 'pep'):
+            compacted[check] = _compact_check(result, MATCH_FIELDS, top_k, max_chars, MATCH_PROPERTIES)
+        elif check == 'news':
+            compacted[check] = _compact_check(result, NEWS_FIELDS, top_k, max_chars)
+        elif check == 'wikidata':
+            compacted[check] = _compact_wikidata(result, top_k, max_chars)
+        elif check == 'discovered_people':
+            # A copy of the Wikidata people
+            continue
+        else:
+            compacted[check] = _compact(result, top_k, max_chars)
+    return compacted
+
+
+def _referenced_articles(evidence: Dict) -> List[str]:
+    """Get the ids of the articles the compacted news results still refer to."""
+    article_ids = []
+    for section in ('organizations', 'people', 'wikidata_people'):
+        entities = evidence.get(section)
+        for results in (entities.values() if isinstance(entities, dict) else []):
+            news = results.get('news') if isinstance(results, dict) else None
+            items = news.get('top', []) if isinstance(news, dict) else news
+            article_ids += [item.get('article_id') for item in items or [] if isinstance(item, dict)]
+    return article_ids
+
+
+def _compact_assessment(assessment_data: Dict, top_k: int, max_chars: int) -> Dict:
+    """Compact the assessment data at one level of top K and string length."""
+    evidence = {
+        "transaction_id": assessment_data.get("transaction_id"),
+        # Every entity is listed, as the assessment has to name them all
+        "extracted_entities": _compact(assessment_data.get("extracted_entities"), 10 ** 6, max_chars),
+    }
+    for section in ('organizations', 'people', 'wikidata_people'):
+        entities = assessment_data.get(section)
+        if isinstance(entities, dict):
+            evidence[section] = {
+                name: _compact_entity(results, top_k, max_chars) for name, results in entities.items()
+            }
+        else:
+            evidence[section] = _compact(entities, top_k, max_chars)
+    evidence["jurisdictions"] = _compact(assessment_data.get("jurisdictions"), 10 ** 6, max_chars)
+
+    network = assessment_data.get("network_expansion")
+    if isinstance(network, dict):
+        evidence["network_expansion"] = _compact({
+            **{key: value for key, value in network.items() if key != 'hits'},
+            "hits": [
+                {**_pick(node, NETWORK_NODE_FIELDS),
+                 "sanctions": _compact_check(node.get('sanctions'), MATCH_FIELDS, top_k, max_chars, MATCH_PROPERTIES),
+                 "pep": _compact_check(node.get('pep'), MATCH_FIELDS, top_k, max_chars, MATCH_PROPERTIES)}
+                for node in network.get('hits') or []
+            ],
+        }, top_k, max_chars)
+
+    articles = assessment_data.get("news_articles") or {}
+    evidence["news_articles"] = {
+        article_id: _compact(_pick(articles[article_id], ARTICLE_FIELDS), top_k, max_chars)
+        for article_id in dict.fromkeys(_referenced_articles(evidence)) if article_id in articles
+    }
+    return {key: value for key, value in evidence.items() if not _is_empty(value)}
+
+
+def compact_evidence(assessment_data: Dict, token_budget: int = RISK_ASSESSMENT_TOKEN_BUDGET,
+                     count_tokens: Optional[Callable[[str], int]] = None,
+                     top_k: int = EVIDENCE_TOP_K) -> Tuple[str, int]:
+    """
+    Compact the assessment data of a transaction into evidence for the risk assessment prompt.
+
+    The evidence is compacted with top_k items per list first, then with
+    half as many items and half as long strings until it fits the budget.
+
+    Args:
+        assessment_data: The assessment data, as saved to raw_assessment_data.json
+        token_budget: Maximum number of tokens of the evidence
+        count_tokens: Function counting the tokens of a text, estimated by default
+        top_k: Items kept of each list at the first level
+
+    Returns:
+        Tuple of the evidence as minified JSON and its number of tokens
+    """
+    count_tokens = count_tokens or estimate_tokens
+    level_top_k, max_chars = max(1, top_k), MAX_STRING_CHARS
+    while True:
+        evidence = _compact_assessment(assessment_data, level_top_k, max_chars)
+        text = json.dumps(evidence, separators=(',', ':'), ensure_ascii=False, default=str)
+        tokens = count_tokens(text)
+        if tokens <= token_budget or level_top_k == 1:
+            break
+        level_top_k, max_chars = max(1, level_top_k // 2), max(80, max_chars // 2)
+
+    if tokens > token_budget:
+        logger.warning(f"Evidence of {tokens} tokens exceeds the budget of {token_budget} tokens at the most compact level")
+    else:
+        logger.info(f"Compacted the evidence to {tokens} tokens ({level_top_k} items per list)")
+    return text, tokens
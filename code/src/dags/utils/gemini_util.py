@@ -1,72 +1,136 @@
+"""
+Pooled Gemini models with API key rotation.
+
+Building a GenerativeModel and configuring its client is done once per
+process and (API key, model, generation config); later calls get the ready
+model from the pool. Each model has its own client for its API key instead of
+the process-wide genai.configure, so models of different keys can be used
+from several threads at once. The pool is rebuilt after a fork, as the gRPC
+channels of its clients cannot be shared with a child process.
+
+Binding a client to a model relies on private parts of the SDK. If a version
+of the SDK lacks them, models fall back to the process-wide client, with
+genai.configure for the key of the model built last.
+"""
+import os
+import json
 import logging
+import threading
 import google.generativeai as genai
+from google.generativeai import client as genai_client
 from config.settings import (
-    gemini_key_rotator, 
-    GEMINI_MODEL, 
-    GEMINI_TEMPERATURE, 
-    GEMINI_TOP_P, 
-    GEMINI_TOP_K, 
+    gemini_key_rotator,
+    GEMINI_MODEL,
+    GEMINI_TEMPERATURE,
+    GEMINI_TOP_P,
+    GEMINI_TOP_K,
     GEMINI_MAX_OUTPUT_TOKENS
 )
 
+logger = logging.getLogger(__name__)
+
+_models = {}
+_models_pid = None
+_models_lock = threading.Lock()
+_configure_lock = threading.Lock()
+
+
+def _safety_settings():
+    """Safety settings to reduce blocking."""
+    return {
+        genai.types.HarmCategory.HARM_CATEGORY_HARASSMENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
+        genai.types.HarmCategory.HARM_CATEGORY_HATE_SPEECH: genai.types.HarmBlockThreshold.BLOCK_NONE,
+        genai.types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: genai.types.HarmBlockThreshold.BLOCK_NONE,
+        genai.types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
+    }
+
+
+def _build_model(api_key, model_name, generation_config):
+    """Build a model bound to its own client for an API key."""
+    model = genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        safety_settings=_safety_settings()
+    )
+
+    # The SDK only configures API keys globally, so the model gets clients of
+    # its own, made like the default ones but for this key
+    try:
+        client_manager = genai_client._ClientManager()
+        client_manager.configure(api_key=api_key)
+        if not (hasattr(model, '_client') and hasattr(model, '_async_client')):
+            raise AttributeError("GenerativeModel has no _client or _async_client")
+        model._client = client_manager.make_client("generative")
+        model._async_client = client_manager.make_client("generative_async")
+    except (AttributeError, TypeError) as e:
+        logger.warning(f"Cannot bind a client to the Gemini model, using genai.configure instead: {str(e)}")
+        with _configure_lock:
+            genai.configure(api_key=api_key)
+    return model
+
+
+def get_genai_model(api_key, model_name=GEMINI_MODEL, generation_config=None):
+    """
+    Get the pooled model of an API key, model and generation config, building it on first use.
+
+    :param api_key: The Gemini API key
+    :param model_name: Name of the Gemini model
+    :param generation_config: The generation config, the configured one by default
+    :return: Configured GenerativeModel instance
+    """
+    global _models, _models_pid
+
+    if generation_config is None:
+        generation_config = {
+            "temperature": GEMINI_TEMPERATURE,
+            "top_p": GEMINI_TOP_P,
+            "top_k": GEMINI_TOP_K,
+            "max_output_tokens": GEMINI_MAX_OUTPUT_TOKENS,
+        }
+    key = (api_key, model_name, json.dumps(generation_config, sort_keys=True))
+
+    with _models_lock:
+        if _models_pid != os.getpid():
+            _models = {}
+            _models_pid = os.getpid()
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = _build_model(api_key, model_name, generation_config)
+            logger.info(f"Created Gemini model {model_name} for key ...{api_key[-4:]}")
+    return model
+
+
 def create_genai_model(max_retries=3):
     """
     Create a Generative AI model with key rotation and retry logic
-    
+
     :param max_retries: Maximum number of key rotation attempts
     :return: Configured GenerativeModel instance
     """
-    logger = logging.getLogger(__name__)
-    
-    # Safety settings to reduce blocking
-    safety_settings = {
-        genai.types.HarmCategory.HARM_CATEGORY_HARASSMENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-        genai.types.HarmCategory.HARM_CATEGORY_HATE_SPEECH: genai.types.HarmBlockThreshold.BLOCK_NONE,
-        genai.types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-        genai.types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: genai.types.HarmBlockThreshold.BLOCK_NONE,
-    }
-    
-    generation_config = {
-        "temperature": GEMINI_TEMPERATURE,
-        "top_p": GEMINI_TOP_P,
-        "top_k": GEMINI_TOP_K,
-        "max_output_tokens": GEMINI_MAX_OUTPUT_TOKENS,
-    }
-    
     # Track used keys to prevent repeated failures
     used_keys = set()
-    
+
     for attempt in range(max_retries):
         try:
             # Get a new key
             current_key = gemini_key_rotator.get_key()
-            
+
             # Skip keys we've already tried in this round
             if current_key in used_keys:
                 continue
-            
-            # Configure Gemini with the current key
-            genai.configure(api_key=current_key)
-            
-            # Create model
-            model = genai.GenerativeModel(
-                model_name=GEMINI_MODEL,
-                generation_config=generation_config,
-                safety_settings=safety_settings
-            )
-            
-            return model
-        
+
+            return get_genai_model(current_key)
+
         except Exception as e:
             logger.warning(f"Key rotation attempt {attempt + 1} failed: {e}")
-            
+
             # Mark the current key as failed
             gemini_key_rotator.mark_key_failed(current_key)
             used_keys.add(current_key)
-            
+
             # If we've exhausted all keys, raise the last exception
             if attempt == max_retries - 1 or gemini_key_rotator.get_key_count() <= len(used_keys):
                 logger.error("All Gemini API keys have failed.")
                 raise
-    
-    raise RuntimeError("Unable to create Generative AI model after multiple attempts")
\ No newline at end of file
+
+    raise RuntimeError("Unable to create Generative AI model after multiple attempts")
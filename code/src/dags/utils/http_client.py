@@ -0,0 +1,221 @@
+"""
+Process-wide HTTP client registry for the enrichment providers.
+
+Each provider (OpenCorporates, OpenSanctions, Wikidata, GDELT, ...) gets one
+shared requests session per worker process. The session keeps a pool of
+keep-alive connections per host, so repeated calls skip the TCP and TLS
+handshakes. Every request gets explicit (connect, read) timeouts, so a hung
+provider cannot block a worker slot, and failed connections, 429 responses and
+5xx responses are retried with exponential backoff, honouring Retry-After.
+Requests to providers with a configured rate limit, and each of their
+retries, first wait for the provider's shared token bucket, and 429 responses
+slow all workers down (see dags.utils.rate_limiter).
+
+Sessions are created lazily and recreated after a fork, since pooled
+sockets must not be shared between a parent process and its children.
+"""
+import os
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dags.config.settings import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_BACKOFF_FACTOR,
+    HTTP_POOL_MAXSIZE, HTTP_USER_AGENT
+)
+from dags.utils.rate_limiter import acquire, report_rate_limited
+
+logger = logging.getLogger(__name__)
+
+# Responses that are worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# The provider APIs only use POST for read-only queries (OpenSanctions /match,
+# Wikidata SPARQL), so it is retried like GET
+RETRY_METHODS = frozenset({'GET', 'HEAD', 'POST'})
+
+# Upper bound for a single Retry-After wait, so a provider cannot park a worker for hours
+MAX_RETRY_AFTER = 120
+
+DEFAULT_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# Per-provider overrides of the (connect, read) timeouts and the default headers
+PROVIDERS = {
+    'opencorporates': {},
+    'opensanctions': {'timeout': (HTTP_CONNECT_TIMEOUT, max(HTTP_READ_TIMEOUT, 60))},
+    'opensanctions_data': {'timeout': (HTTP_CONNECT_TIMEOUT, max(HTTP_READ_TIMEOUT, 300))},
+    'wikidata': {
+        'timeout': (HTTP_CONNECT_TIMEOUT, max(HTTP_READ_TIMEOUT, 60)),
+        'headers': {'Accept': 'application/sparql-results+json'},
+    },
+    'gdelt': {},
+}
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_pid = os.getpid()
+_sessions_lock = threading.Lock()
+
+
+class _CappedRetry(Retry):
+    """
+    Retry policy whose Retry-After waits are capped at MAX_RETRY_AFTER seconds.
+
+    With a provider name, every retry also waits for the provider's rate
+    limit, and a retried 429 response slows the provider down before the wait.
+    """
+
+    def __init__(self, *args, provider: Optional[str] = None, **kwargs):
+        self.provider = provider
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        # urllib3 makes a new policy for every attempt
+        retry = super().new(**kwargs)
+        retry.provider = self.provider
+        return retry
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+
+    def sleep(self, response=None):
+        if self.provider is not None and response is not None and response.status == 429:
+            report_rate_limited(self.provider, self.get_retry_after(response))
+        super().sleep(response)
+        if self.provider is not None:
+            acquire(self.provider)
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter that applies a default timeout to requests sent without one.
+
+    With a provider name, every request and every retry of it (see
+    _CappedRetry) waits for the provider's rate limit, and a 429 response,
+    whether retried or returned, slows the provider down for all workers.
+    """
+
+    def __init__(self, *args, timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+                 provider: Optional[str] = None, **kwargs):
+        self.timeout = timeout
+        self.provider = provider
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        if self.provider is None:
+            return super().send(request, **kwargs)
+
+        acquire(self.provider)
+        response = super().send(request, **kwargs)
+        # Retried 429 responses were reported by the retry policy
+        if response.status_code == 429:
+            report_rate_limited(self.provider, _CappedRetry().get_retry_after(response.raw))
+        return response
+
+
+def build_retry(max_retries: int = HTTP_MAX_RETRIES, backoff_factor: float = HTTP_BACKOFF_FACTOR,
+                provider: Optional[str] = None) -> Retry:
+    """
+    Build the retry policy used by the provider sessions.
+
+    Args:
+        max_retries: Maximum number of retries of a request
+        backoff_factor: Base of the exponential backoff in seconds
+        provider: Name of the provider whose rate limit applies to the retries, if any
+
+    Returns:
+        The urllib3 retry policy
+    """
+    return _CappedRetry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=RETRY_METHODS,
+        respect_retry_after_header=True,
+        # Hand the last response back to the caller, whose raise_for_status reports it
+        raise_on_status=False,
+        provider=provider,
+    )
+
+
+def create_http_session(timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+                        headers: Optional[Dict[str, str]] = None,
+                        max_retries: int = HTTP_MAX_RETRIES,
+                        backoff_factor: float = HTTP_BACKOFF_FACTOR,
+                        pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                        provider: Optional[str] = None) -> requests.Session:
+    """
+    Create a session with pooled keep-alive connections, timeouts and retries.
+
+    Args:
+        timeout: Default (connect, read) timeouts in seconds
+        headers: Headers sent with every request
+        max_retries: Maximum number of retries of a request
+        backoff_factor: Base of the exponential backoff in seconds
+        pool_maxsize: Maximum number of kept-alive connections per host
+        provider: Name of the provider whose rate limit applies, if any
+
+    Returns:
+        The configured session
+    """
+    session = requests.Session()
+    session.headers['User-Agent'] = HTTP_USER_AGENT
+    session.headers.update(headers or {})
+
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        max_retries=build_retry(max_retries, backoff_factor, provider),
+        pool_maxsize=pool_maxsize,
+        provider=provider,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_http_session(provider: str) -> requests.Session:
+    """
+    Get the shared session of a provider, creating it on first use.
+
+    Args:
+        provider: Name of the provider, one of PROVIDERS or any other name for the defaults
+
+    Returns:
+        The provider's session
+    """
+    global _sessions_pid
+
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            # Forked worker: the inherited pools belong to the parent
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+
+        session = _sessions.get(provider)
+        if session is None:
+            options = PROVIDERS.get(provider, {})
+            session = create_http_session(
+                timeout=options.get('timeout', DEFAULT_TIMEOUT),
+                headers=options.get('headers'),
+                provider=provider,
+            )
+            _sessions[provider] = session
+            logger.debug(f"Created HTTP session for {provider}")
+        return session
+
+
+def close_http_sessions() -> None:
+    """Close all sessions of the current process and release their connections."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,235 @@
+"""
+Resolution of free-text jurisdictions to ISO 3166 country codes.
+
+Extracted entities name their jurisdictions in many ways ("UK", "BVI",
+"Cayman Islands", "Moscow, Russia", "Delaware"), while pycountry only knows
+the official names. A table mapping every known alias to its country is
+built once from pycountry and a curated list of abbreviations, common names
+and offshore territories:
+
+    official, common and short names     "Russian Federation", "Russia"
+    ISO alpha-2 and alpha-3 codes        "GB", "GBR"
+    curated abbreviations and names      "UK", "USA", "BVI", "UAE", "Holland"
+    US states and Canadian provinces     "Delaware" -> US, subdivision US-DE
+
+Aliases are compared on their normalized form (see
+dags.utils.name_normalization), and a jurisdiction that is not an alias as a
+whole is resolved by the longest alias among its words, so "Road Town,
+British Virgin Islands" still resolves to VG. Results are cached with an LRU
+cache.
+"""
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import pycountry
+
+from dags.utils.name_normalization import normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Number of distinct jurisdiction strings whose resolution is kept in memory
+JURISDICTION_CACHE_SIZE = 4096
+
+# Longest alias in words, bounding the scan for aliases inside a longer text
+MAX_ALIAS_WORDS = 6
+
+# Curated aliases that pycountry does not know, by ISO alpha-2 code
+ALIASES = {
+    'GB': ['UK', 'U.K.', 'Great Britain', 'Britain', 'England', 'Scotland', 'Wales', 'Northern Ireland',
+           'United Kingdom of Great Britain and Northern Ireland'],
+    'US': ['USA', 'U.S.', 'U.S.A.', 'United States of America', 'America', 'the States'],
+    'VG': ['BVI', 'B.V.I.', 'British Virgin Islands', 'Tortola'],
+    'VI': ['USVI', 'US Virgin Islands', 'U.S. Virgin Islands'],
+    'KY': ['Cayman', 'Caymans', 'Cayman Islands', 'Grand Cayman'],
+    'AE': ['UAE', 'U.A.E.', 'Emirates', 'Dubai', 'Abu Dhabi'],
+    'RU': ['Russia'],
+    'KR': ['South Korea', 'Korea'],
+    'KP': ['North Korea', 'DPRK'],
+    'IR': ['Iran'],
+    'SY': ['Syria'],
+    'VE': ['Venezuela'],
+    'BO': ['Bolivia'],
+    'TZ': ['Tanzania'],
+    'VN': ['Vietnam', 'Viet Nam'],
+    'LA': ['Laos'],
+    'MD': ['Moldova'],
+    'MK': ['Macedonia', 'North Macedonia'],
+    'CZ': ['Czech Republic', 'Czech'],
+    'TR': ['Turkey', 'Turkiye'],
+    'CI': ["Ivory Coast", "Cote d'Ivoire"],
+    'CD': ['DRC', 'DR Congo', 'Democratic Republic of the Congo', 'Congo-Kinshasa'],
+    'CG': ['Republic of the Congo', 'Congo-Brazzaville'],
+    'NL': ['Holland', 'The Netherlands'],
+    'HK': ['Hong Kong SAR'],
+    'MO': ['Macau', 'Macao SAR'],
+    'TW': ['Taiwan', 'Republic of China'],
+    'CN': ['China', 'PRC', "People's Republic of China", 'Mainland China'],
+    'PS': ['Palestine'],
+    'VA': ['Vatican', 'Vatican City', 'Holy See'],
+    'BS': ['The Bahamas', 'Bahamas'],
+    'GM': ['The Gambia'],
+    'MH': ['Marshall Islands', 'Marshalls'],
+    'KN': ['St Kitts', 'St Kitts and Nevis', 'Saint Kitts', 'Nevis'],
+    'LC': ['St Lucia'],
+    'VC': ['St Vincent', 'St Vincent and the Grenadines'],
+    'TC': ['Turks and Caicos', 'TCI'],
+    'IM': ['Isle of Man', 'IoM'],
+    'JE': ['Jersey', 'Bailiwick of Jersey'],
+    'GG': ['Guernsey', 'Bailiwick of Guernsey'],
+    'CW': ['Curacao'],
+    'SX': ['Sint Maarten'],
+    'BQ': ['Bonaire'],
+    'MY': ['Labuan'],
+    'PA': ['Panama', 'Republic of Panama'],
+    'SC': ['Seychelles'],
+    'CY': ['Cyprus', 'Northern Cyprus'],
+    'CH': ['Swiss', 'Switzerland'],
+}
+
+# Offshore financial centres as listed by the IMF, a common jurisdictional risk indicator
+OFFSHORE_FINANCIAL_CENTRES = frozenset({
+    'AD', 'AG', 'AI', 'AW', 'BB', 'BH', 'BM', 'BQ', 'BS', 'BZ', 'CH', 'CK', 'CR', 'CW', 'CY', 'DM', 'GD',
+    'GG', 'GI', 'HK', 'IE', 'IM', 'JE', 'KN', 'KY', 'LB', 'LC', 'LI', 'LU', 'MC', 'MH', 'MO', 'MS', 'MT',
+    'MU', 'MY', 'NR', 'NU', 'PA', 'PW', 'SC', 'SG', 'SX', 'TC', 'VC', 'VG', 'VU', 'WS',
+})
+
+# Countries whose subdivisions are resolved, as OpenCorporates registers companies by them
+SUBDIVISION_COUNTRIES = ('US', 'CA')
+
+
+class Jurisdiction(NamedTuple):
+    """A resolved jurisdiction."""
+    country_code: str
+    country: str
+    subdivision_code: Optional[str] = None
+
+    @property
+    def offshore_financial_centre(self) -> bool:
+        return self.country_code in OFFSHORE_FINANCIAL_CENTRES
+
+    @property
+    def opencorporates_code(self) -> str:
+        """The OpenCorporates jurisdiction code, e.g. 'gb' or 'us_de'."""
+        return (self.subdivision_code or self.country_code).lower().replace('-', '_')
+
+
+def _alias_key(alias: str) -> str:
+    """Normalize an alias, ignoring a leading article."""
+    key = normalize_name(alias)
+    return key[4:] if key.startswith('the ') else key
+
+
+@lru_cache(maxsize=1)
+def _alias_tables() -> Tuple[Dict[str, Jurisdiction], Dict[str, Jurisdiction]]:
+    """Build the tables mapping normalized names and ISO codes to jurisdictions, once per process."""
+    countries = {country.alpha_2: country for country in pycountry.countries}
+
+    def jurisdiction(alpha_2: str, subdivision_code: Optional[str] = None) -> Jurisdiction:
+        country = countries[alpha_2]
+        return Jurisdiction(alpha_2, getattr(country, 'common_name', None) or country.name, subdivision_code)
+
+    table = {}
+    codes = {}
+    derived = {}
+    ambiguous = set()
+    for alpha_2, country in countries.items():
+        for name in (country.name, getattr(country, 'official_name', None), getattr(country, 'common_name', None)):
+            if not name:
+                continue
+            table.setdefault(_alias_key(name), jurisdiction(alpha_2))
+            if ',' in name:
+                # "Korea, Republic of" is also known as "Republic of Korea" and "Korea"
+                head, _, tail = name.partition(',')
+                for variant in (f"{tail} {head}", head):
+                    key = _alias_key(variant)
+                    if derived.setdefault(key, alpha_2) != alpha_2:
+                        ambiguous.add(key)
+        codes[_alias_key(country.alpha_3)] = jurisdiction(alpha_2)
+        codes[_alias_key(alpha_2)] = jurisdiction(alpha_2)
+
+    for key, alpha_2 in derived.items():
+        if key not in ambiguous:
+            table.setdefault(key, jurisdiction(alpha_2))
+
+    # Curated aliases take precedence over everything derived from pycountry
+    for alpha_2, aliases in ALIASES.items():
+        for alias in aliases:
+            table[_alias_key(alias)] = jurisdiction(alpha_2)
+
+    for alpha_2 in SUBDIVISION_COUNTRIES:
+        for subdivision in pycountry.subdivisions.get(country_code=alpha_2) or []:
+            table.setdefault(_alias_key(subdivision.name), jurisdiction(alpha_2, subdivision.code))
+
+    table.pop('', None)
+    logger.debug(f"Built jurisdiction alias table with {len(table)} aliases")
+    return table, codes
+
+
+@lru_cache(maxsize=JURISDICTION_CACHE_SIZE)
+def resolve_jurisdiction(text: Optional[str]) -> Optional[Jurisdiction]:
+    """
+    Resolve a free-text jurisdiction to its country.
+
+    Args:
+        text: The jurisdiction, e.g. "UK", "Cayman Islands" or "Moscow, Russia"
+
+    Returns:
+        The jurisdiction, or None if no country could be recognized
+    """
+    if not text:
+        return None
+    table, codes = _alias_tables()
+    key = _alias_key(text)
+    if key in table:
+        return table[key]
+    if key in codes:
+        return codes[key]
+
+    # Look for the longest name among the words, e.g. the country of "City, Country";
+    # ISO codes are left out, since words such as "and" or "can" are also codes
+    words = key.split()
+    for length in range(min(len(words), MAX_ALIAS_WORDS), 0, -1):
+        for start in range(len(words) - length + 1):
+            candidate = ' '.join(words[start:start + length])
+            if candidate in table:
+                return table[candidate]
+    return None
+
+
+def country_code(text: Optional[str]) -> Optional[str]:
+    """
+    Get the ISO alpha-2 country code of a free-text jurisdiction.
+
+    Args:
+        text: The jurisdiction
+
+    Returns:
+        The country code, or None if no country could be recognized
+    """
+    jurisdiction = resolve_jurisdiction(text)
+    return jurisdiction.country_code if jurisdiction else None
+
+
+def jurisdiction_risk_features(jurisdictions: Iterable[str]) -> List[Dict]:
+    """
+    Describe the jurisdictions mentioned in a transaction for the risk assessment.
+
+    Args:
+        jurisdictions: The jurisdictions as extracted
+
+    Returns:
+        List with the resolved country and the offshore financial centre flag
+        of every distinct jurisdiction
+    """
+    features = []
+    for text in dict.fromkeys(text for text in jurisdictions if text and isinstance(text, str)):
+        jurisdiction = resolve_jurisdiction(text)
+        features.append({
+            "jurisdiction": text,
+            "country_code": jurisdiction.country_code if jurisdiction else None,
+            "country": jurisdiction.country if jurisdiction else None,
+            "subdivision_code": jurisdiction.subdivision_code if jurisdiction else None,
+            "offshore_financial_centre": jurisdiction.offshore_financial_centre if jurisdiction else None,
+        })
+    return features
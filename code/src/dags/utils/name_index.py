@@ -0,0 +1,944 @@
+"""
+Inverted name index for screening names against reference lists.
+
+Names and aliases of every record are normalized and tokenized once when the
+index is built, so a lookup only touches the records that share a token with
+the queried name instead of re-parsing the whole list on every call.
+
+Names are normalized with dags.utils.name_normalization, and the
+sorted-token and phonetic keys of every name are computed when the index is
+built, so queries never re-normalize the reference list.
+
+Besides exact token lookups, the index supports ranked fuzzy search: records
+sharing the query's sorted-token key, its phonetic key or enough of its
+character trigrams form a small set of candidates, which are then scored with
+a token-set Jaro-Winkler similarity and cut at a threshold and a top-K limit.
+
+An index can also be compiled into a single binary file and opened with mmap,
+so every worker process on a node shares the same pages of the page cache
+instead of holding its own copy of the list. A compiled base can be layered
+with a small delta index and tombstones, so updates do not require
+recompiling the whole list.
+"""
+import abc
+import os
+import sys
+import json
+import heapq
+import mmap
+import fcntl
+import struct
+import logging
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from dags.utils.name_normalization import (
+    normalize_name, name_tokens, sorted_token_key, phonetic_key, phonetic_key_from_tokens
+)
+
+logger = logging.getLogger(__name__)
+
+# Tokens shorter than this are too unspecific to be matched on
+MIN_TOKEN_LENGTH = 3
+
+# Share of the query's trigrams a record must contain to be scored at all
+MIN_TRIGRAM_OVERLAP = 0.5
+
+# Upper bound on the number of candidates scored per query
+MAX_SCORED_CANDIDATES = 500
+
+
+def tokenize_name(name: str) -> List[str]:
+    """
+    Split a name into normalized tokens that are long enough to be matched on.
+
+    Args:
+        name: The raw name
+
+    Returns:
+        List of tokens in the order they appear in the name
+    """
+    return [token for token in name_tokens(name) if len(token) >= MIN_TOKEN_LENGTH]
+
+
+def name_trigrams(name: str) -> Set[str]:
+    """
+    Get the character trigrams of a normalized name, padded at both ends.
+
+    Args:
+        name: The raw name
+
+    Returns:
+        Set of trigrams
+    """
+    return _trigrams_of_normalized(normalize_name(name))
+
+
+def _trigrams_of_normalized(normalized: str) -> Set[str]:
+    """Get the padded trigrams of an already normalized name."""
+    if not normalized:
+        return set()
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def jaro_winkler(first: str, second: str, prefix_scale: float = 0.1) -> float:
+    """
+    Compute the Jaro-Winkler similarity of two strings.
+
+    Args:
+        first: The first string
+        second: The second string
+        prefix_scale: Weight of a common prefix, at most 0.25
+
+    Returns:
+        Similarity between 0 and 1
+    """
+    if first == second:
+        return 1.0
+    if not first or not second:
+        return 0.0
+
+    window = max(0, max(len(first), len(second)) // 2 - 1)
+    first_matched = [False] * len(first)
+    second_matched = [False] * len(second)
+
+    matches = 0
+    for i, char in enumerate(first):
+        for j in range(max(0, i - window), min(len(second), i + window + 1)):
+            if not second_matched[j] and second[j] == char:
+                first_matched[i] = second_matched[j] = True
+                matches += 1
+                break
+
+    if not matches:
+        return 0.0
+
+    transpositions = 0
+    j = 0
+    for i, char in enumerate(first):
+        if first_matched[i]:
+            while not second_matched[j]:
+                j += 1
+            if char != second[j]:
+                transpositions += 1
+            j += 1
+
+    jaro = (matches / len(first) + matches / len(second)
+            + (matches - transpositions / 2) / matches) / 3
+
+    prefix = 0
+    for first_char, second_char in zip(first[:4], second[:4]):
+        if first_char != second_char:
+            break
+        prefix += 1
+
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def _directed_token_similarity(tokens: Sequence[str], other_tokens: Sequence[str]) -> float:
+    """Length-weighted average of each token's best Jaro-Winkler match among the other tokens."""
+    total_length = sum(len(token) for token in tokens)
+    return sum(
+        len(token) * max(jaro_winkler(token, other) for other in other_tokens)
+        for token in tokens
+    ) / total_length
+
+
+def token_set_similarity(tokens: Sequence[str], other_tokens: Sequence[str]) -> float:
+    """
+    Score how similar two normalized token sequences are, independently of token order.
+
+    Every token is aligned with its most similar token in the other sequence
+    and the result is averaged in both directions, so extra or missing tokens
+    (middle names, initials) lower the score without dominating it.
+
+    Args:
+        tokens: The tokens of the first name
+        other_tokens: The tokens of the second name
+
+    Returns:
+        Similarity between 0 and 1
+    """
+    if not tokens or not other_tokens:
+        return 0.0
+    if sorted(tokens) == sorted(other_tokens):
+        return 1.0
+    return (_directed_token_similarity(tokens, other_tokens)
+            + _directed_token_similarity(other_tokens, tokens)) / 2
+
+
+def name_similarity(name: str, other_name: str) -> float:
+    """
+    Score how similar two names are, independently of token order.
+
+    Args:
+        name: The first name
+        other_name: The second name
+
+    Returns:
+        Similarity between 0 and 1
+    """
+    return token_set_similarity(name_tokens(name), name_tokens(other_name))
+
+
+class _BaseNameIndex(abc.ABC):
+    """
+    Lookup operations shared by the in-memory and compiled name indexes.
+
+    Subclasses provide the postings of a term in one of the term tables
+    (TERM_TABLES) and the decoding of a record, its names and their keys.
+    """
+
+    @abc.abstractmethod
+    def _postings(self, table: str, term: str) -> Sequence[int]:
+        """Get the ids of the records with a term in one of the TERM_TABLES."""
+
+    @abc.abstractmethod
+    def record(self, record_id: int) -> Dict:
+        """Get a record by its id."""
+
+    @abc.abstractmethod
+    def record_names(self, record_id: int) -> List[str]:
+        """Get the names (primary name and aliases) of a record."""
+
+    @abc.abstractmethod
+    def record_keys(self, record_id: int) -> List[str]:
+        """Get the sorted-token keys of a record's names, in the order of record_names."""
+
+    def candidate_ids(self, name: str) -> Set[int]:
+        """
+        Get the ids of all records sharing at least one token with a name.
+
+        Args:
+            name: The name to look up
+
+        Returns:
+            Set of matching record ids
+        """
+        record_ids = set()
+        for token in tokenize_name(name):
+            record_ids.update(self._postings('token', token))
+        return record_ids
+
+    def lookup(self, name: str) -> List[Dict]:
+        """
+        Get all records sharing at least one token with a name.
+
+        Args:
+            name: The name to look up
+
+        Returns:
+            List of matching records in their original order
+        """
+        return [self.record(record_id) for record_id in sorted(self.candidate_ids(name))]
+
+    def lookup_batch(self, names: Iterable[str]) -> Dict[str, List[Dict]]:
+        """
+        Look up many names in one pass over the index.
+
+        Each distinct token is resolved and each matching record decoded only
+        once, no matter how many of the names share them.
+
+        Args:
+            names: The names to look up
+
+        Returns:
+            Dictionary mapping every name to its matching records in their original order
+        """
+        tokens_by_name = {name: tokenize_name(name) for name in names}
+
+        postings = {}
+        for tokens in tokens_by_name.values():
+            for token in tokens:
+                if token not in postings:
+                    postings[token] = self._postings('token', token)
+
+        records = {}
+        results = {}
+        for name, tokens in tokens_by_name.items():
+            record_ids = set()
+            for token in tokens:
+                record_ids.update(postings[token])
+
+            matches = []
+            for record_id in sorted(record_ids):
+                if record_id not in records:
+                    records[record_id] = self.record(record_id)
+                matches.append(records[record_id])
+            results[name] = matches
+
+        return results
+
+    def trigram_candidate_ids(self, name: str, postings_cache: Optional[Dict] = None) -> List[int]:
+        """
+        Get the records sharing enough character trigrams with a name to be worth scoring.
+
+        Args:
+            name: The name to look up
+            postings_cache: Optional dict reused across calls to resolve each trigram only once
+
+        Returns:
+            List of candidate record ids, most overlapping first, at most MAX_SCORED_CANDIDATES
+        """
+        trigrams = name_trigrams(name)
+        if not trigrams:
+            return []
+
+        if postings_cache is None:
+            postings_cache = {}
+        for trigram in trigrams:
+            if trigram not in postings_cache:
+                postings_cache[trigram] = self._postings('trigram', trigram)
+
+        required = max(1, int(len(trigrams) * MIN_TRIGRAM_OVERLAP))
+
+        # A record reaching the required overlap must contain at least one of
+        # the rarest (n - required + 1) trigrams, so only those seed candidates
+        ordered = sorted(trigrams, key=lambda trigram: len(postings_cache[trigram]))
+        seeds = len(ordered) - required + 1
+
+        overlap = defaultdict(int)
+        for trigram in ordered[:seeds]:
+            for record_id in postings_cache[trigram]:
+                overlap[record_id] += 1
+        for trigram in ordered[seeds:]:
+            for record_id in postings_cache[trigram]:
+                if record_id in overlap:
+                    overlap[record_id] += 1
+
+        candidates = [record_id for record_id, count in overlap.items() if count >= required]
+        return heapq.nlargest(MAX_SCORED_CANDIDATES, candidates,
+                              key=lambda record_id: (overlap[record_id], -record_id))
+
+    def key_candidate_ids(self, name: str) -> List[int]:
+        """
+        Get the records with a name sharing the sorted-token key or the phonetic key of a name.
+
+        Args:
+            name: The name to look up
+
+        Returns:
+            List of distinct record ids, exact key matches first
+        """
+        candidates = dict.fromkeys(self._postings('key', sorted_token_key(name)))
+        candidates.update(dict.fromkeys(self._postings('phonetic', phonetic_key(name))[:MAX_SCORED_CANDIDATES]))
+        return list(candidates)
+
+    def search_candidate_ids(self, name: str, postings_cache: Optional[Dict] = None) -> List[int]:
+        """
+        Get the records worth scoring for a name.
+
+        Records sharing the name's sorted-token key or phonetic key come first,
+        followed by the records sharing enough character trigrams.
+
+        Args:
+            name: The name to look up
+            postings_cache: Optional dict reused across calls to resolve each trigram only once
+
+        Returns:
+            List of distinct candidate record ids
+        """
+        candidates = dict.fromkeys(self.key_candidate_ids(name))
+        candidates.update(dict.fromkeys(self.trigram_candidate_ids(name, postings_cache)))
+        return list(candidates)
+
+    def _score_candidates(self, name: str, candidate_ids: Iterable[int],
+                          threshold: float, top_k: int) -> List[Tuple[float, int, str]]:
+        """Score candidates by their best matching name and keep the top K above the threshold."""
+        tokens = name_tokens(name)
+        scored = []
+        for record_id in candidate_ids:
+            best_score, best_name = 0.0, ''
+            for record_name, record_key in zip(self.record_names(record_id), self.record_keys(record_id)):
+                score = token_set_similarity(tokens, record_key.split())
+                if score > best_score:
+                    best_score, best_name = score, record_name
+            if best_score >= threshold:
+                scored.append((best_score, record_id, best_name))
+        return heapq.nlargest(top_k, scored, key=lambda match: (match[0], -match[1]))
+
+    def search(self, name: str, threshold: float, top_k: int) -> List[Dict]:
+        """
+        Find the records whose names are most similar to a name.
+
+        Args:
+            name: The name to search for
+            threshold: Minimum similarity score between 0 and 1
+            top_k: Maximum number of records to return
+
+        Returns:
+            List of matching records, best first, each with added 'match_score'
+            and 'matched_name' fields
+        """
+        return self.search_batch([name], threshold, top_k)[name]
+
+    def search_batch(self, names: Iterable[str], threshold: float, top_k: int,
+                     candidates: Optional[Dict[str, Iterable[int]]] = None) -> Dict[str, List[Dict]]:
+        """
+        Find the most similar records for many names in one pass over the index.
+
+        Args:
+            names: The names to search for
+            threshold: Minimum similarity score between 0 and 1
+            top_k: Maximum number of records to return per name
+            candidates: Optional precomputed candidate record ids per name,
+                used instead of the key and trigram postings
+
+        Returns:
+            Dictionary mapping every name to its matching records, best first,
+            each with added 'match_score' and 'matched_name' fields
+        """
+        postings_cache = {}
+        records = {}
+        results = {}
+        for name in names:
+            if candidates is not None:
+                candidate_ids = candidates.get(name, ())
+            else:
+                candidate_ids = self.search_candidate_ids(name, postings_cache)
+            matches = []
+            for score, record_id, matched_name in self._score_candidates(name, candidate_ids, threshold, top_k):
+                if record_id not in records:
+                    records[record_id] = self.record(record_id)
+                match = dict(records[record_id])
+                match['match_score'] = round(score, 4)
+                match['matched_name'] = matched_name
+                matches.append(match)
+            results[name] = matches
+        return results
+
+
+# Term tables of an index: name tokens, character trigrams, sorted-token keys and phonetic keys
+TERM_TABLES = ('token', 'trigram', 'key', 'phonetic')
+
+
+def _build_postings(names_by_record: List[List[str]]) -> Tuple[Dict[str, Dict[str, List[int]]], List[List[str]]]:
+    """
+    Build the postings of every term table for the names of every record.
+
+    Every name is normalized only once, without going through the query
+    caches, which would only be thrashed by a whole reference list.
+
+    Returns:
+        The postings by term table, and the sorted-token keys of every record's names
+    """
+    postings = {table: defaultdict(list) for table in TERM_TABLES}
+
+    def add(table: str, term: str, record_id: int) -> None:
+        # Records are visited in id order, so postings stay sorted without duplicates
+        record_ids = postings[table][term]
+        if not record_ids or record_ids[-1] != record_id:
+            record_ids.append(record_id)
+
+    keys_by_record = []
+    for record_id, names in enumerate(names_by_record):
+        keys = []
+        for name in names:
+            normalized = normalize_name.__wrapped__(name)
+            tokens = normalized.split()
+            for token in tokens:
+                if len(token) >= MIN_TOKEN_LENGTH:
+                    add('token', token, record_id)
+            for trigram in _trigrams_of_normalized(normalized):
+                add('trigram', trigram, record_id)
+            key = ' '.join(sorted(tokens))
+            if key:
+                add('key', key, record_id)
+                add('phonetic', phonetic_key_from_tokens(tokens), record_id)
+            keys.append(key)
+        keys_by_record.append(keys)
+    postings = {table: dict(table_postings) for table, table_postings in postings.items()}
+    return postings, keys_by_record
+
+
+class NameIndex(_BaseNameIndex):
+    """
+    In-memory inverted index mapping name tokens and trigrams to record ids.
+    """
+
+    def __init__(self, records: List[Dict], names_getter: Callable[[Dict], Iterable[str]]):
+        """
+        Build the index over a list of records.
+
+        Args:
+            records: The records to index, a record id is its position in this list
+            names_getter: Callable returning all names (primary name and aliases) of a record
+        """
+        self.records = records
+        self.names = [[name for name in names_getter(record) if name] for record in records]
+        self.postings, self.keys = _build_postings(self.names)
+
+        logger.info(f"Built name index with {len(records)} records and {len(self.postings['token'])} tokens")
+
+    def _postings(self, table: str, term: str) -> Sequence[int]:
+        return self.postings[table].get(term, ())
+
+    def record(self, record_id: int) -> Dict:
+        """
+        Get a single record.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            The record as a dictionary
+        """
+        return self.records[record_id]
+
+    def record_names(self, record_id: int) -> List[str]:
+        """
+        Get the names (primary name and aliases) of a single record.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            List of names
+        """
+        return self.names[record_id]
+
+    def record_keys(self, record_id: int) -> List[str]:
+        """
+        Get the sorted-token keys of a record's names, in the order of record_names.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            List of keys
+        """
+        return self.keys[record_id]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+# ========== COMPILED INDEX ==========
+#
+# File layout:
+#   magic (8 bytes) | metadata length (uint64) | metadata (JSON) | sections
+#
+# The metadata holds the source fingerprint, the record columns and the
+# offset/length of every section. Sections are 8-byte aligned:
+#   record_offsets (uint64): start of each record in record_data, plus end
+#   record_data: every record as a JSON list of values, in column order
+#   name_offsets (uint64): start of each record's names in name_data, plus end
+#   name_data: the names of every record as a JSON list
+#   key_offsets (uint64), key_data: the sorted-token keys of those names, likewise
+# and, for each of the TERM_TABLES:
+#   <table>_term_offsets (uint64): start of each term in term_data, plus end
+#   <table>_term_data: all distinct terms, utf-8 encoded and sorted bytewise
+#   <table>_posting_offsets (uint64): start of each term's postings, plus end
+#   <table>_postings (uint32): record ids of every term, sorted
+
+COMPILED_INDEX_MAGIC = b'NAMEIDX\0'
+COMPILED_INDEX_VERSION = 3
+
+_LENGTH_STRUCT = struct.Struct('<Q')
+
+_TERM_TABLE_SECTIONS = ('term_offsets', 'term_data', 'posting_offsets', 'postings')
+
+
+def _align(offset: int, alignment: int = 8) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _encode_json_list(values: List) -> Tuple[bytes, bytes]:
+    """Encode a list of JSON values as an offsets array and a data blob."""
+    offsets = array('Q', [0])
+    chunks = []
+    for value in values:
+        chunk = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        chunks.append(chunk)
+        offsets.append(offsets[-1] + len(chunk))
+    return offsets.tobytes(), b''.join(chunks)
+
+
+def _encode_term_table(postings: Dict[str, List[int]]) -> List[bytes]:
+    """Encode a term -> record ids mapping as sorted, array-backed sections."""
+    terms = sorted(postings, key=lambda term: term.encode('utf-8'))
+    term_offsets = array('Q', [0])
+    term_chunks = []
+    posting_offsets = array('Q', [0])
+    all_postings = array('I')
+    for term in terms:
+        encoded = term.encode('utf-8')
+        term_chunks.append(encoded)
+        term_offsets.append(term_offsets[-1] + len(encoded))
+        all_postings.extend(postings[term])
+        posting_offsets.append(len(all_postings))
+    return [term_offsets.tobytes(), b''.join(term_chunks), posting_offsets.tobytes(), all_postings.tobytes()]
+
+
+def write_compiled_index(index_file: str, records: List[Dict],
+                         names_getter: Callable[[Dict], Iterable[str]],
+                         fingerprint: str) -> None:
+    """
+    Compile records into a binary name index file.
+
+    The file is written to a temporary path and moved into place, so readers
+    never see a partially written index.
+
+    Args:
+        index_file: Path of the compiled index file
+        records: The records to index
+        names_getter: Callable returning all names (primary name and aliases) of a record
+        fingerprint: Identifier of the source data, stored for staleness checks
+    """
+    names_by_record = [[name for name in names_getter(record) if name] for record in records]
+    postings_by_table, keys_by_record = _build_postings(names_by_record)
+
+    columns = []
+    for record in records:
+        for column in record:
+            if column not in columns:
+                columns.append(column)
+
+    record_offsets, record_data = _encode_json_list(
+        [[record.get(column) for column in columns] for record in records]
+    )
+    name_offsets, name_data = _encode_json_list(names_by_record)
+    key_offsets, key_data = _encode_json_list(keys_by_record)
+
+    sections = [
+        ('record_offsets', record_offsets),
+        ('record_data', record_data),
+        ('name_offsets', name_offsets),
+        ('name_data', name_data),
+        ('key_offsets', key_offsets),
+        ('key_data', key_data),
+    ]
+    for table in TERM_TABLES:
+        encoded_table = _encode_term_table(postings_by_table[table])
+        for suffix, data in zip(_TERM_TABLE_SECTIONS, encoded_table):
+            sections.append((f"{table}_{suffix}", data))
+
+    metadata = {
+        'version': COMPILED_INDEX_VERSION,
+        'fingerprint': fingerprint,
+        'byteorder': sys.byteorder,
+        'record_count': len(records),
+        'term_counts': {table: len(postings_by_table[table]) for table in TERM_TABLES},
+        'columns': columns,
+        'sections': {},
+    }
+
+    # Section offsets depend on the metadata length, so lay them out with a
+    # placeholder first and fix the size of the metadata block afterwards
+    metadata_size = 0
+    while True:
+        offset = _align(len(COMPILED_INDEX_MAGIC) + _LENGTH_STRUCT.size + metadata_size)
+        for name, data in sections:
+            metadata['sections'][name] = [offset, len(data)]
+            offset = _align(offset + len(data))
+        encoded_metadata = json.dumps(metadata).encode('utf-8')
+        if len(encoded_metadata) <= metadata_size:
+            break
+        metadata_size = len(encoded_metadata) + 64
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(COMPILED_INDEX_MAGIC)
+        f.write(_LENGTH_STRUCT.pack(metadata_size))
+        f.write(encoded_metadata.ljust(metadata_size, b' '))
+        for name, data in sections:
+            f.seek(metadata['sections'][name][0])
+            f.write(data)
+        f.truncate(_align(f.tell()))
+    os.replace(temp_file, index_file)
+
+    logger.info(f"Compiled name index {index_file} with {len(records)} records "
+                f"and {metadata['term_counts']['token']} tokens")
+
+
+@contextmanager
+def index_lock(index_file: str) -> Iterator[None]:
+    """
+    Hold the node-wide lock guarding changes to a compiled index.
+
+    Args:
+        index_file: Path of the compiled index file
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+    with open(f"{index_file}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_compiled_index_fingerprint(index_file: str) -> Optional[str]:
+    """
+    Read the source fingerprint of a compiled index without mapping it.
+
+    Args:
+        index_file: Path of the compiled index file
+
+    Returns:
+        The fingerprint, or None if the file is missing, unreadable or of another version
+    """
+    try:
+        with open(index_file, 'rb') as f:
+            metadata = _read_metadata(f.read(len(COMPILED_INDEX_MAGIC) + _LENGTH_STRUCT.size), f)
+    except (OSError, ValueError) as e:
+        logger.info(f"Compiled index {index_file} is not usable: {str(e)}")
+        return None
+    return metadata['fingerprint']
+
+
+def _read_metadata(prefix: bytes, f) -> Dict:
+    """Validate the file prefix and parse the metadata block that follows it."""
+    if prefix[:len(COMPILED_INDEX_MAGIC)] != COMPILED_INDEX_MAGIC:
+        raise ValueError("not a compiled name index")
+    (metadata_size,) = _LENGTH_STRUCT.unpack(prefix[len(COMPILED_INDEX_MAGIC):])
+    metadata = json.loads(f.read(metadata_size))
+    if metadata.get('version') != COMPILED_INDEX_VERSION:
+        raise ValueError(f"unsupported index version {metadata.get('version')}")
+    if metadata.get('byteorder') != sys.byteorder:
+        raise ValueError(f"index was compiled with {metadata.get('byteorder')} byte order")
+    return metadata
+
+
+class _CompiledTermTable:
+    """
+    Sorted term table of a compiled index, searched in place in the mapped file.
+    """
+
+    def __init__(self, term_offsets: memoryview, term_data: memoryview,
+                 posting_offsets: memoryview, postings: memoryview, term_count: int):
+        self._term_offsets = term_offsets
+        self._term_data = term_data
+        self._posting_offsets = posting_offsets
+        self._postings = postings
+        self._term_count = term_count
+
+    def _term(self, term_id: int) -> bytes:
+        return self._term_data[self._term_offsets[term_id]:self._term_offsets[term_id + 1]].tobytes()
+
+    def postings(self, term: str) -> memoryview:
+        """Binary search the sorted terms and return the postings of a term."""
+        encoded = term.encode('utf-8')
+        low, high = 0, self._term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._term_count and self._term(low) == encoded:
+            return self._postings[self._posting_offsets[low]:self._posting_offsets[low + 1]]
+        return self._postings[0:0]
+
+
+class CompiledNameIndex(_BaseNameIndex):
+    """
+    Read-only name index backed by a memory-mapped compiled index file.
+
+    Offers the same lookup interface as NameIndex. Records are decoded lazily,
+    only when they are returned from a lookup.
+    """
+
+    def __init__(self, index_file: str):
+        """
+        Open a compiled index file.
+
+        Args:
+            index_file: Path of the compiled index file
+        """
+        self.index_file = index_file
+
+        with open(index_file, 'rb') as f:
+            self.metadata = _read_metadata(f.read(len(COMPILED_INDEX_MAGIC) + _LENGTH_STRUCT.size), f)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.fingerprint = self.metadata['fingerprint']
+        self.columns = self.metadata['columns']
+        self._buffer = memoryview(self._mmap)
+
+        self._record_offsets = self._section('record_offsets').cast('Q')
+        self._record_data = self._section('record_data')
+        self._name_offsets = self._section('name_offsets').cast('Q')
+        self._name_data = self._section('name_data')
+        self._key_offsets = self._section('key_offsets').cast('Q')
+        self._key_data = self._section('key_data')
+        self._term_tables = {
+            table: _CompiledTermTable(
+                self._section(f"{table}_term_offsets").cast('Q'),
+                self._section(f"{table}_term_data"),
+                self._section(f"{table}_posting_offsets").cast('Q'),
+                self._section(f"{table}_postings").cast('I'),
+                self.metadata['term_counts'][table],
+            )
+            for table in TERM_TABLES
+        }
+
+    def _section(self, name: str) -> memoryview:
+        offset, length = self.metadata['sections'][name]
+        return self._buffer[offset:offset + length]
+
+    def _postings(self, table: str, term: str) -> memoryview:
+        return self._term_tables[table].postings(term)
+
+    def record(self, record_id: int) -> Dict:
+        """
+        Decode a single record.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            The record as a dictionary
+        """
+        start, end = self._record_offsets[record_id], self._record_offsets[record_id + 1]
+        values = json.loads(self._record_data[start:end].tobytes())
+        return dict(zip(self.columns, values))
+
+    def record_names(self, record_id: int) -> List[str]:
+        """
+        Decode the names (primary name and aliases) of a single record.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            List of names
+        """
+        start, end = self._name_offsets[record_id], self._name_offsets[record_id + 1]
+        return json.loads(self._name_data[start:end].tobytes())
+
+    def record_keys(self, record_id: int) -> List[str]:
+        """
+        Decode the sorted-token keys of a record's names, in the order of record_names.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            List of keys
+        """
+        start, end = self._key_offsets[record_id], self._key_offsets[record_id + 1]
+        return json.loads(self._key_data[start:end].tobytes())
+
+    def __len__(self) -> int:
+        return self.metadata['record_count']
+
+
+class LayeredNameIndex(_BaseNameIndex):
+    """
+    Name index over a base index updated by a smaller delta index.
+
+    Records removed from the base or replaced by a newer version in the delta
+    are hidden by tombstones, and delta records are numbered after the base
+    records. This lets a large compiled list be updated by compiling only the
+    records that changed.
+    """
+
+    def __init__(self, base: _BaseNameIndex, delta: Optional[_BaseNameIndex] = None,
+                 removed_ids: Iterable[int] = (), fingerprint: str = '', version: str = ''):
+        """
+        Combine a base index with an optional delta.
+
+        Args:
+            base: The base index
+            delta: Optional index of records added or changed since the base was built
+            removed_ids: Ids of base records that are no longer part of the list
+            fingerprint: Identifier of the source data, used for staleness checks
+            version: Version of the dataset the layers represent
+        """
+        self.base = base
+        self.delta = delta
+        self.removed_ids = frozenset(removed_ids)
+        self.fingerprint = fingerprint
+        self.version = version
+        self._delta_offset = len(base)
+
+    def _merged_postings(self, base_postings: Iterable[int], delta_postings: Iterable[int]) -> List[int]:
+        postings = [record_id for record_id in base_postings if record_id not in self.removed_ids]
+        postings.extend(self._delta_offset + record_id for record_id in delta_postings)
+        return postings
+
+    def _postings(self, table: str, term: str) -> List[int]:
+        delta_postings = self.delta._postings(table, term) if self.delta is not None else ()
+        return self._merged_postings(self.base._postings(table, term), delta_postings)
+
+    def trigram_candidate_ids(self, name: str, postings_cache: Optional[Dict] = None) -> List[int]:
+        """
+        Get the records sharing enough character trigrams with a name to be worth scoring.
+
+        Candidates are generated in every layer separately, which avoids
+        merging the long postings of common trigrams.
+
+        Args:
+            name: The name to look up
+            postings_cache: Optional dict reused across calls to resolve each trigram only once
+
+        Returns:
+            List of candidate record ids
+        """
+        if postings_cache is None:
+            postings_cache = {}
+        candidates = [
+            record_id
+            for record_id in self.base.trigram_candidate_ids(name, postings_cache.setdefault('base', {}))
+            if record_id not in self.removed_ids
+        ]
+        if self.delta is not None:
+            candidates.extend(
+                self._delta_offset + record_id
+                for record_id in self.delta.trigram_candidate_ids(name, postings_cache.setdefault('delta', {}))
+            )
+        return candidates
+
+    def record(self, record_id: int) -> Dict:
+        """
+        Get a single record from the layer holding it.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            The record as a dictionary
+        """
+        if record_id >= self._delta_offset:
+            return self.delta.record(record_id - self._delta_offset)
+        return self.base.record(record_id)
+
+    def record_names(self, record_id: int) -> List[str]:
+        """
+        Get the names of a single record. Removed records have no names.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            List of names
+        """
+        if record_id >= self._delta_offset:
+            return self.delta.record_names(record_id - self._delta_offset)
+        if record_id in self.removed_ids:
+            return []
+        return self.base.record_names(record_id)
+
+    def record_keys(self, record_id: int) -> List[str]:
+        """
+        Get the sorted-token keys of a record's names, in the order of record_names.
+
+        Args:
+            record_id: The id of the record
+
+        Returns:
+            List of keys
+        """
+        if record_id >= self._delta_offset:
+            return self.delta.record_keys(record_id - self._delta_offset)
+        if record_id in self.removed_ids:
+            return []
+        return self.base.record_keys(record_id)
+
+    def __len__(self) -> int:
+        return self._delta_offset + (len(self.delta) if self.delta is not None else 0)
@@ -0,0 +1,184 @@
+"""
+Shared name normalization for screening and entity keys.
+
+Names are casefolded, German umlauts are expanded (Müller -> mueller),
+Cyrillic, Greek and Arabic letters are transliterated to Latin, and the rest
+is decomposed with NFKD so accents can be dropped. Punctuation is removed and
+whitespace collapsed, so every matcher and the Neo4j entity keys agree on
+what counts as the same name.
+
+Two keys are derived from the normalized name:
+    sorted-token key: the tokens in alphabetical order ("Müller, Hans" and
+        "Hans Mueller" both give "hans mueller")
+    phonetic key: the sorted Soundex codes of the tokens, so spelling variants
+        such as "Mohammed" and "Muhammad" share a key
+
+Results are cached with an LRU cache, since the same query names recur across
+the checks of a transaction and across bulk runs.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Iterable, Tuple
+
+# Number of distinct names whose normalized form and keys are kept in memory
+NAME_CACHE_SIZE = 65536
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+# Letters replaced before decomposition: expansions that NFKD would lose
+# (ü would become u) and letters that have no decomposition at all
+_LATIN = {
+    'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss',
+    'æ': 'ae', 'œ': 'oe', 'ø': 'o', 'å': 'aa',
+    'đ': 'd', 'ð': 'd', 'ł': 'l', 'ı': 'i', 'þ': 'th', 'ħ': 'h',
+}
+
+_CYRILLIC = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'ґ': 'g', 'д': 'd', 'е': 'e', 'ё': 'e',
+    'є': 'ye', 'ж': 'zh', 'з': 'z', 'и': 'i', 'і': 'i', 'ї': 'yi', 'й': 'y', 'ј': 'j',
+    'к': 'k', 'л': 'l', 'љ': 'lj', 'м': 'm', 'н': 'n', 'њ': 'nj', 'о': 'o', 'п': 'p',
+    'р': 'r', 'с': 's', 'т': 't', 'ћ': 'c', 'ђ': 'dj', 'у': 'u', 'ў': 'u', 'ф': 'f',
+    'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'џ': 'dz', 'ш': 'sh', 'щ': 'shch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+_GREEK = {
+    'α': 'a', 'β': 'v', 'γ': 'g', 'δ': 'd', 'ε': 'e', 'ζ': 'z', 'η': 'i', 'θ': 'th',
+    'ι': 'i', 'κ': 'k', 'λ': 'l', 'μ': 'm', 'ν': 'n', 'ξ': 'x', 'ο': 'o', 'π': 'p',
+    'ρ': 'r', 'σ': 's', 'ς': 's', 'τ': 't', 'υ': 'y', 'φ': 'f', 'χ': 'ch', 'ψ': 'ps',
+    'ω': 'o',
+}
+
+# Arabic and Persian letters; short vowels are diacritics and dropped with the other marks
+_ARABIC = {
+    'ا': 'a', 'أ': 'a', 'إ': 'i', 'آ': 'a', 'ٱ': 'a', 'ب': 'b', 'پ': 'p', 'ت': 't',
+    'ث': 'th', 'ج': 'j', 'چ': 'ch', 'ح': 'h', 'خ': 'kh', 'د': 'd', 'ذ': 'dh', 'ر': 'r',
+    'ز': 'z', 'ژ': 'zh', 'س': 's', 'ش': 'sh', 'ص': 's', 'ض': 'd', 'ط': 't', 'ظ': 'z',
+    'ع': '', 'غ': 'gh', 'ف': 'f', 'ق': 'q', 'ك': 'k', 'ک': 'k', 'گ': 'g', 'ل': 'l',
+    'م': 'm', 'ن': 'n', 'ه': 'h', 'ة': 'a', 'و': 'w', 'ؤ': '', 'ي': 'y', 'ی': 'y',
+    'ى': 'a', 'ئ': '', 'ء': '',
+}
+
+_TRANSLITERATION = str.maketrans({**_LATIN, **_CYRILLIC, **_GREEK, **_ARABIC})
+
+_SOUNDEX_CODES = {
+    letter: code
+    for letters, code in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6'))
+    for letter in letters
+}
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def normalize_name(name: str) -> str:
+    """
+    Normalize a name to lowercase ASCII-like Latin tokens separated by single spaces.
+
+    Args:
+        name: The raw name
+
+    Returns:
+        The normalized name
+    """
+    text = (name or '').casefold().translate(_TRANSLITERATION)
+    text = ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+    # Letters that only lost their accents now (e.g. Greek with tonos) are transliterated in a second pass
+    text = _PUNCTUATION_RE.sub('', text.translate(_TRANSLITERATION))
+    return ' '.join(text.split())
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def name_tokens(name: str) -> Tuple[str, ...]:
+    """
+    Split a name into its normalized tokens.
+
+    Args:
+        name: The raw name
+
+    Returns:
+        Tuple of tokens in the order they appear in the name
+    """
+    return tuple(normalize_name(name).split())
+
+
+def sorted_token_key(name: str) -> str:
+    """
+    Get the order-independent key of a name.
+
+    Args:
+        name: The raw name
+
+    Returns:
+        The normalized tokens in alphabetical order, separated by spaces
+    """
+    return ' '.join(sorted(name_tokens(name)))
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def soundex(token: str) -> str:
+    """
+    Get the Soundex code of a normalized token.
+
+    Tokens that do not start with a letter are returned unchanged.
+
+    Args:
+        token: A normalized token
+
+    Returns:
+        The four character Soundex code
+    """
+    if not token or not token[0].isalpha():
+        return token
+
+    codes = []
+    previous = _SOUNDEX_CODES.get(token[0])
+    for letter in token[1:]:
+        code = _SOUNDEX_CODES.get(letter)
+        if code and code != previous:
+            codes.append(code)
+        # h and w do not separate letters with the same code, vowels do
+        if letter not in 'hw':
+            previous = code
+    return (token[0] + ''.join(codes) + '000')[:4]
+
+
+def phonetic_key_from_tokens(tokens: Iterable[str]) -> str:
+    """
+    Get the phonetic key of already normalized tokens.
+
+    Args:
+        tokens: The normalized tokens of a name
+
+    Returns:
+        The Soundex codes of the tokens in alphabetical order, separated by spaces
+    """
+    return ' '.join(sorted(soundex(token) for token in tokens))
+
+
+def phonetic_key(name: str) -> str:
+    """
+    Get the phonetic key of a name.
+
+    Args:
+        name: The raw name
+
+    Returns:
+        The Soundex codes of the name's tokens in alphabetical order, separated by spaces
+    """
+    return phonetic_key_from_tokens(name_tokens(name))
+
+
+def entity_name_key(name: str) -> str:
+    """
+    Get the key identifying an entity by its name, e.g. for Neo4j nodes.
+
+    Names without any letters or digits fall back to their casefolded form,
+    so they still get a non-empty key.
+
+    Args:
+        name: The raw name
+
+    Returns:
+        The entity key
+    """
+    return sorted_token_key(name) or (name or '').strip().casefold()
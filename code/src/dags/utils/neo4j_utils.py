@@ -17,6 +17,7 @@ load_dotenv()
 from dags.utils.transaction_folder import (
     get_transaction_folder, save_transaction_data, load_transaction_data
 )
+from dags.utils.name_normalization import entity_name_key
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -27,10 +28,16 @@ NEO4J_USER = os.environ.get('NEO4J_USER', 'neo4j')
 NEO4J_PASSWORD = os.environ.get('NEO4J_PASSWORD', 'password')
 NEO4J_DATABASE = os.environ.get('NEO4J_DATABASE', 'neo4j')
 
+# Name of the full-text index over the name keys of Organization and Person nodes
+ENTITY_NAME_KEY_INDEX = 'entity_name_keys'
+
 class Neo4jManager:
     """
     Manager class for Neo4j database operations.
     """
+    # Name key indexes and backfill only need to be checked once per process
+    _name_keys_ensured = False
+    
     def __init__(self, uri=NEO4J_URI, user=NEO4J_USER, password=NEO4J_PASSWORD, database=NEO4J_DATABASE):
         """
         Initialize the Neo4j connection.
@@ -64,6 +71,7 @@ class Neo4jManager:
                 result = session.run("RETURN 1 AS test").single()
                 if result and result.get("test") == 1:
                     logger.info("Successfully connected to Neo4j database")
+                    self.ensure_name_keys(session)
                     return True
                 else:
                     logger.error("Neo4j connection test failed")
@@ -72,6 +80,44 @@ class Neo4jManager:
             logger.error(f"Error connecting to Neo4j: {str(e)}")
             return False
             
+    def ensure_name_keys(self, session) -> None:
+        """
+        Index entity nodes by their normalized name key and backfill the key on older nodes.
+        
+        Entities are merged on name_key (see name_normalization.entity_name_key),
+        so spelling variants such as "Müller, Hans" and "Hans Mueller" resolve
+        to the same node.
+        
+        Args:
+            session: An open Neo4j session
+        """
+        if Neo4jManager._name_keys_ensured:
+            return
+            
+        # Full-text index over the normalized names, used to find entities similar to a name
+        session.run(f"""
+            CREATE FULLTEXT INDEX {ENTITY_NAME_KEY_INDEX} IF NOT EXISTS
+            FOR (n:Organization|Person) ON EACH [n.name_key]
+        """)
+        
+        for label in ("Organization", "Person"):
+            session.run(f"CREATE INDEX {label.lower()}_name_key IF NOT EXISTS FOR (n:{label}) ON (n.name_key)")
+            
+            missing = session.run(f"""
+                MATCH (n:{label}) WHERE n.name_key IS NULL
+                RETURN elementId(n) AS id, n.name AS name
+            """)
+            rows = [{"id": record["id"], "name_key": entity_name_key(record["name"] or "")} for record in missing]
+            if rows:
+                session.run(f"""
+                    UNWIND $rows AS row
+                    MATCH (n:{label}) WHERE elementId(n) = row.id
+                    SET n.name_key = row.name_key
+                """, {"rows": rows})
+                logger.info(f"Backfilled name keys of {len(rows)} {label} nodes")
+        
+        Neo4jManager._name_keys_ensured = True
+            
     def close(self):
         """Close the Neo4j connection."""
         if self.driver:
@@ -137,8 +183,9 @@ class Neo4jManager:
                     
                     # Merge the organization node (create if not exists, update if exists)
                     session.run("""
-                        MERGE (o:Organization {name: $name})
+                        MERGE (o:Organization {name_key: $name_key})
                         ON CREATE SET 
+                            o.name = $name,
                             o.type = $type,
                             o.jurisdiction = $jurisdiction,
                             o.first_seen = $timestamp
@@ -153,6 +200,7 @@ class Neo4jManager:
                         MERGE (o)-[r:INVOLVED_IN {role: $role}]->(t)
                     """, {
                         "name": org_name,
+                        "name_key": entity_name_key(org_name),
                         "type": org_type,
                         "jurisdiction": jurisdiction,
                         "timestamp": datetime.now().isoformat(),
@@ -171,8 +219,9 @@ class Neo4jManager:
                     
                     # Merge the person node
                     session.run("""
-                        MERGE (p:Person {name: $name})
+                        MERGE (p:Person {name_key: $name_key})
                         ON CREATE SET 
+                            p.name = $name,
                             p.country = $country,
                             p.first_seen = $timestamp
                         ON MATCH SET 
@@ -186,6 +235,7 @@ class Neo4jManager:
                         MERGE (p)-[r:INVOLVED_IN {role: $role}]->(t)
                     """, {
                         "name": person_name,
+                        "name_key": entity_name_key(person_name),
                         "country": country,
                         "timestamp": datetime.now().isoformat(),
                         "transaction_id": transaction_id,
@@ -210,13 +260,13 @@ class Neo4jManager:
                             if person_name:
                                 # Create relationship between person and organization
                                 session.run("""
-                                    MATCH (p:Person {name: $person_name})
-                                    MATCH (o:Organization {name: $org_name})
+                                    MATCH (p:Person {name_key: $person_key})
+                                    MATCH (o:Organization {name_key: $org_key})
                                     MERGE (p)-[r:ASSOCIATED_WITH {role: $role}]->(o)
                                     ON CREATE SET r.since = $timestamp
                                 """, {
-                                    "person_name": person_name,
-                                    "org_name": org_name,
+                                    "person_key": entity_name_key(person_name),
+                                    "org_key": entity_name_key(org_name),
                                     "role": person_role,
                                     "timestamp": datetime.now().isoformat()
                                 })
@@ -244,13 +294,15 @@ class Neo4jManager:
                 if not self.connect():
                     return {"status": "error", "message": "Could not connect to Neo4j", "data": None}
                     
+            name_key = entity_name_key(entity_name)
+            
             with self.driver.session(database=self.database) as session:
                 history = {}
                 
                 if entity_type == "Organization" or entity_type is None:
                     # Get organization history
                     org_result = session.run("""
-                        MATCH (o:Organization {name: $name})
+                        MATCH (o:Organization {name_key: $name_key})
                         OPTIONAL MATCH (o)-[r:INVOLVED_IN]->(t:Transaction)
                         RETURN o, 
                                collect(DISTINCT t.id) as transactions,
@@ -260,7 +312,7 @@ class Neo4jManager:
                                min(case when t.risk_score > 0 then t.risk_score else null end) as min_risk_score,
                                o.first_seen as first_seen,
                                o.last_seen as last_seen
-                    """, {"name": entity_name})
+                    """, {"name_key": name_key})
                     
                     org_record = org_result.single()
                     if org_record and org_record.get("o"):
@@ -278,9 +330,9 @@ class Neo4jManager:
                         
                         # Get related people
                         related_people_result = session.run("""
-                            MATCH (p:Person)-[r:ASSOCIATED_WITH]->(o:Organization {name: $name})
+                            MATCH (p:Person)-[r:ASSOCIATED_WITH]->(o:Organization {name_key: $name_key})
                             RETURN p.name as name, r.role as role, r.since as since
-                        """, {"name": entity_name})
+                        """, {"name_key": name_key})
                         
                         history["organization"]["related_people"] = [
                             {"name": record["name"], "role": record["role"], "since": record["since"]}
@@ -290,7 +342,7 @@ class Neo4jManager:
                 if entity_type == "Person" or entity_type is None:
                     # Get person history
                     person_result = session.run("""
-                        MATCH (p:Person {name: $name})
+                        MATCH (p:Person {name_key: $name_key})
                         OPTIONAL MATCH (p)-[r:INVOLVED_IN]->(t:Transaction)
                         RETURN p, 
                                collect(DISTINCT t.id) as transactions,
@@ -300,7 +352,7 @@ class Neo4jManager:
                                min(case when t.risk_score > 0 then t.risk_score else null end) as min_risk_score,
                                p.first_seen as first_seen,
                                p.last_seen as last_seen
-                    """, {"name": entity_name})
+                    """, {"name_key": name_key})
                     
                     person_record = person_result.single()
                     if person_record and person_record.get("p"):
@@ -318,9 +370,9 @@ class Neo4jManager:
                         
                         # Get related organizations
                         related_orgs_result = session.run("""
-                            MATCH (p:Person {name: $name})-[r:ASSOCIATED_WITH]->(o:Organization)
+                            MATCH (p:Person {name_key: $name_key})-[r:ASSOCIATED_WITH]->(o:Organization)
                             RETURN o.name as name, r.role as role, r.since as since
-                        """, {"name": entity_name})
+                        """, {"name_key": name_key})
                         
                         history["person"]["related_organizations"] = [
                             {"name": record["name"], "role": record["role"], "since": record["since"]}
@@ -384,6 +436,71 @@ class Neo4jManager:
             logger.error(f"Error retrieving entities history from Neo4j: {str(e)}")
             return {}
 
+    def search_entities_by_name(self, queries: List[str], limit: int = 25) -> List[Dict]:
+        """
+        Find Organization and Person nodes with names similar to the given ones.
+        
+        Uses the full-text index over the name keys, so the cost depends on the
+        number of queries and not on the number of stored entities.
+        
+        Args:
+            queries: Lucene queries over normalized name tokens
+            limit: Maximum number of nodes returned per query
+            
+        Returns:
+            List of distinct nodes with their element id, label and name
+        """
+        if not self.driver:
+            if not self.connect():
+                raise ConnectionError("Could not connect to Neo4j")
+                
+        with self.driver.session(database=self.database) as session:
+            result = session.run("""
+                UNWIND $queries AS query
+                CALL db.index.fulltext.queryNodes($index, query, {limit: $limit}) YIELD node
+                RETURN DISTINCT elementId(node) AS id, labels(node)[0] AS label, node.name AS name
+            """, {"queries": queries, "index": ENTITY_NAME_KEY_INDEX, "limit": limit})
+            return [record.data() for record in result]
+
+    def flag_sanctions_matches(self, matches: List[Dict], dataset_version: str) -> List[str]:
+        """
+        Link entities to newly listed sanctions entries and flag their past transactions.
+        
+        Args:
+            matches: Dicts with the entity's element 'id' and the sanctions
+                'entity_id', 'caption', 'schema', 'datasets' and 'score'
+            dataset_version: Version of the sanctions list the entries come from
+            
+        Returns:
+            IDs of the transactions the matched entities were involved in
+        """
+        if not matches:
+            return []
+        if not self.driver:
+            if not self.connect():
+                raise ConnectionError("Could not connect to Neo4j")
+                
+        with self.driver.session(database=self.database) as session:
+            result = session.run("""
+                UNWIND $matches AS match
+                MATCH (n) WHERE elementId(n) = match.id
+                MERGE (s:SanctionedEntity {id: match.entity_id})
+                SET s.caption = match.caption,
+                    s.schema = match.schema,
+                    s.datasets = match.datasets
+                MERGE (n)-[r:POTENTIAL_SANCTIONS_MATCH]->(s)
+                SET r.score = match.score,
+                    r.dataset_version = $version,
+                    r.flagged_at = $timestamp
+                WITH n
+                MATCH (n)-[:INVOLVED_IN]->(t:Transaction)
+                SET t.sanctions_rescreen_flag = true,
+                    t.sanctions_rescreen_version = $version,
+                    t.sanctions_rescreen_flagged_at = $timestamp
+                RETURN DISTINCT t.id AS transaction_id
+            """, {"matches": matches, "version": dataset_version, "timestamp": datetime.now().isoformat()})
+            return [record["transaction_id"] for record in result]
+
 # Standalone functions for simpler usage
 def store_transaction_in_neo4j(transaction_id: str, risk_assessment: Dict, entities_data: Dict) -> bool:
     """
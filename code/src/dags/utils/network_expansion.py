@@ -0,0 +1,164 @@
+"""
+Bounded multi-hop expansion of the ownership and officer network.
+
+Starting from the Wikidata entities of a transaction's organizations, the
+network of organizations and the people who found, lead or sit on the board
+of them is explored breadth first, one hop at a time:
+
+    hop 1   officers of the transaction's organizations
+    hop 2   other organizations of those officers
+    hop 3   officers of those organizations, and so on
+
+The graph alternates between organizations and people, so each hop's
+frontier is of one kind and its neighbours are fetched with one batched
+lookup (see data_enrichment.wikidata_organization_people and
+wikidata_person_organizations). The new entities of a hop are screened
+against the sanctions and PEP lists with one batched call each.
+
+The expansion is bounded by a maximum number of hops, a fan-out cap per
+entity and a global node budget. Entities are visited once, and names
+already screened by the transaction, such as its own parties and the people
+discovered on Wikidata, are not screened again.
+"""
+import logging
+from typing import Dict, Iterable, List
+
+from dags.config.settings import (
+    RESULTS_FOLDER, NETWORK_EXPANSION_MAX_HOPS, NETWORK_EXPANSION_MAX_FANOUT, NETWORK_EXPANSION_MAX_NODES
+)
+from dags.utils.data_enrichment import (
+    check_sanctions_batch, screen_pep_batch, wikidata_organization_people, wikidata_person_organizations
+)
+from dags.utils.name_normalization import entity_name_key
+from dags.utils.transaction_folder import save_transaction_data
+
+logger = logging.getLogger(__name__)
+
+
+def _screen_frontier(nodes: List[Dict], screened_keys: set, **context) -> None:
+    """Screen the not yet screened entities of a hop with one sanctions and one PEP batch."""
+    to_screen = []
+    for node in nodes:
+        key = entity_name_key(node['name'])
+        if key and key not in screened_keys:
+            screened_keys.add(key)
+            to_screen.append(node)
+    if not to_screen:
+        return
+
+    sanctions = check_sanctions_batch(
+        [('Person' if node['type'] == 'person' else 'Company', node['name']) for node in to_screen], **context
+    )
+    people = [node['name'] for node in to_screen if node['type'] == 'person']
+    pep = screen_pep_batch(people, **context) if people else {}
+
+    for node in to_screen:
+        schema = 'Person' if node['type'] == 'person' else 'Company'
+        node['sanctions'] = sanctions.get(schema, {}).get(node['name'])
+        if node['type'] == 'person':
+            node['pep'] = pep.get(node['name'])
+
+
+def _is_hit(node: Dict) -> bool:
+    return any(
+        (node.get(check) or {}).get('status') == 'success' and (node.get(check) or {}).get('data')
+        for check in ('sanctions', 'pep')
+    )
+
+
+def expand_network(transaction_id: str, seed_organizations: Iterable[Dict], screened_names: Iterable[str] = (),
+                   max_hops: int = NETWORK_EXPANSION_MAX_HOPS, max_fanout: int = NETWORK_EXPANSION_MAX_FANOUT,
+                   max_nodes: int = NETWORK_EXPANSION_MAX_NODES, **context) -> Dict:
+    """
+    Expand the network around the transaction's organizations and screen the entities found.
+
+    Args:
+        transaction_id: The transaction ID
+        seed_organizations: Organizations with their 'name' and Wikidata 'entity_id'
+        screened_names: Names already screened by the transaction
+        max_hops: Maximum distance from the seed organizations
+        max_fanout: Maximum number of neighbours followed per entity
+        max_nodes: Maximum number of entities added to the network
+        context: The task context dict
+
+    Returns:
+        Dictionary with the status and the network: its 'nodes' (with their
+        hop, kind and screening results), 'edges', the 'hits' on the sanctions
+        or PEP lists and whether a budget 'truncated' the expansion
+    """
+    try:
+        screened_keys = {entity_name_key(name) for name in screened_names if name}
+
+        frontier = []
+        visited = set()
+        for organization in seed_organizations:
+            if organization.get('entity_id') and organization['entity_id'] not in visited:
+                visited.add(organization['entity_id'])
+                frontier.append({'entity_id': organization['entity_id'], 'name': organization.get('name', ''),
+                                 'type': 'organization', 'hop': 0})
+        nodes = list(frontier)
+        edges = []
+        edge_keys = set()
+        truncated = False
+
+        for hop in range(1, max_hops + 1):
+            if not frontier:
+                break
+            ids = [node['entity_id'] for node in frontier]
+            if frontier[0]['type'] == 'organization':
+                neighbours, neighbour_type = wikidata_organization_people(ids), 'person'
+            else:
+                neighbours, neighbour_type = wikidata_person_organizations(ids), 'organization'
+
+            next_frontier = []
+            for node in frontier:
+                added = 0
+                for neighbour in neighbours.get(node['entity_id'], []):
+                    neighbour_id = neighbour.get('entity_id')
+                    if not neighbour_id:
+                        continue
+                    if neighbour_id not in visited:
+                        if added >= max_fanout:
+                            continue
+                        if len(nodes) >= max_nodes:
+                            truncated = True
+                            continue
+                        visited.add(neighbour_id)
+                        added += 1
+                        new_node = {'entity_id': neighbour_id, 'name': neighbour.get('name', ''),
+                                    'type': neighbour_type, 'hop': hop, 'via': node['entity_id'],
+                                    'role': neighbour.get('role')}
+                        nodes.append(new_node)
+                        next_frontier.append(new_node)
+
+                    # Relationships point from the person to the organization; links between
+                    # entities already in the network are kept, as shared officers are telling
+                    person_id, organization_id = (
+                        (neighbour_id, node['entity_id']) if neighbour_type == 'person' else (node['entity_id'], neighbour_id)
+                    )
+                    edge = (person_id, organization_id, neighbour.get('role'))
+                    if edge not in edge_keys:
+                        edge_keys.add(edge)
+                        edges.append({'source': person_id, 'target': organization_id, 'role': neighbour.get('role')})
+
+            _screen_frontier(next_frontier, screened_keys, **context)
+            logger.info(f"Network expansion hop {hop}: {len(next_frontier)} new {neighbour_type} entities")
+            frontier = next_frontier
+
+        hits = [node for node in nodes if _is_hit(node)]
+        network = {
+            "nodes": nodes,
+            "edges": edges,
+            "hits": hits,
+            "hops": max((node['hop'] for node in nodes), default=0),
+            "truncated": truncated,
+        }
+        save_transaction_data(RESULTS_FOLDER, transaction_id, "network_expansion.json", network)
+
+        logger.info(f"Expanded network to {len(nodes)} entities and {len(edges)} relationships, "
+                    f"{len(hits)} sanctions or PEP hits{' (truncated)' if truncated else ''}")
+        return {"status": "success", "data": network}
+
+    except Exception as e:
+        logger.error(f"Error expanding network: {str(e)}")
+        return {"status": "failed", "reason": f"Error expanding network: {str(e)}", "data": None}
@@ -0,0 +1,383 @@
+"""
+Cross-transaction store of the news articles found for each entity.
+
+GDELT is asked for an entity's full article list only once. The store keeps
+the articles and a watermark per entity (by normalized name, see
+dags.utils.name_normalization.entity_name_key): the newest GDELT 'seendate'
+seen so far. Later checks only request the articles seen since the watermark
+(GDELT's startdatetime) and merge them into the stored set, so a recurring
+counterparty costs a small delta query instead of a full historical pull.
+
+Articles are stored once, however many entities and transactions they turn
+up for, and entities only reference them by id. The id is the hash of the
+article's canonical URL (lowercase host without 'www.', no tracking
+parameters, fragment or trailing slash, see canonical_url). Syndicated copies
+of an article under other URLs are recognized by the simhash of their title
+(see title_simhash) and share the id of the first copy stored.
+
+The delta window starts WATERMARK_OVERLAP seconds before the watermark, as
+GDELT indexes articles in batches; the overlap is merged without duplicates.
+An entity's references older than the retention period are dropped, as are
+articles no entity references anymore, and a watermark is only valid for the
+query it was recorded for, so changing the query terms triggers a full pull
+again.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from dags.utils.name_normalization import entity_name_key
+
+logger = logging.getLogger(__name__)
+
+# Seconds the delta window reaches back before the watermark
+WATERMARK_OVERLAP = 3600
+
+# Format of GDELT's seendate and of its startdatetime/enddatetime parameters
+SEENDATE_FORMAT = '%Y%m%dT%H%M%SZ'
+GDELT_DATETIME_FORMAT = '%Y%m%d%H%M%S'
+
+# Query parameters that only track the reader and are left out of canonical URLs
+TRACKING_PARAMETERS = frozenset({'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ocid', 'cmpid', 'ref', 'src', 'smid'})
+TRACKING_PARAMETER_PREFIXES = ('utm_',)
+
+# Host prefixes of mobile and accelerated pages
+HOST_PREFIXES = ('www.', 'm.', 'amp.', 'mobile.')
+
+# Titles differing in at most this many of the 64 simhash bits are the same article.
+# The simhash is split into SIMHASH_BANDS bands, one of which must then be equal.
+SIMHASH_MAX_DISTANCE = 3
+SIMHASH_BANDS = 4
+
+# Titles with fewer words are too generic to be matched by their simhash
+SIMHASH_MIN_WORDS = 5
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+# Source suffix that syndicating sites append to a title, e.g. " - Reuters"
+_TITLE_SOURCE_SUFFIX = re.compile(r"\s+[-|\u2013\u2014]\s+[^-|\u2013\u2014]{1,40}$")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS watermarks ("
+    "entity_key TEXT PRIMARY KEY, query TEXT NOT NULL, seen_until TEXT, checked_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS articles ("
+    "article_id TEXT PRIMARY KEY, canonical_url TEXT NOT NULL UNIQUE, simhash INTEGER, article TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS article_bands ("
+    "band INTEGER NOT NULL, value INTEGER NOT NULL, article_id TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS article_bands_value ON article_bands (band, value)",
+    "CREATE INDEX IF NOT EXISTS article_bands_article ON article_bands (article_id)",
+    "CREATE TABLE IF NOT EXISTS entity_articles ("
+    "entity_key TEXT NOT NULL, article_id TEXT NOT NULL, seendate TEXT NOT NULL, "
+    "PRIMARY KEY (entity_key, article_id))",
+    "CREATE INDEX IF NOT EXISTS entity_articles_article ON entity_articles (article_id)",
+)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def parse_seendate(seendate: Optional[str]) -> Optional[datetime]:
+    """
+    Parse a GDELT seendate such as '20240115T103000Z'.
+
+    Args:
+        seendate: The seendate of an article
+
+    Returns:
+        The UTC datetime, or None if the seendate is missing or malformed
+    """
+    try:
+        return datetime.strptime(seendate, SEENDATE_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def canonical_url(url: str) -> str:
+    """
+    Get the canonical form of an article URL.
+
+    Args:
+        url: The URL of the article
+
+    Returns:
+        The URL over https, with a lowercase host without 'www.' or mobile
+        prefixes, without tracking parameters, fragment or trailing slash
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = re.sub(r'/amp/?$', '', parts.path).rstrip('/')
+    query = urlencode(sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in TRACKING_PARAMETERS and not name.lower().startswith(TRACKING_PARAMETER_PREFIXES)
+    ))
+    scheme = 'https' if parts.scheme in ('http', 'https', '') else parts.scheme
+    return urlunsplit((scheme, host, path, query, ''))
+
+
+def title_simhash(title: Optional[str]) -> Optional[int]:
+    """
+    Get the 64-bit simhash of an article title over its words and word pairs.
+
+    Titles are compared without case, punctuation and source suffix. On
+    titles this short, every changed word flips about ten bits, so only
+    copies with such formatting differences fall within SIMHASH_MAX_DISTANCE.
+
+    Args:
+        title: The title of the article
+
+    Returns:
+        The simhash as a signed 64-bit integer (as SQLite stores it), or None
+        for titles shorter than SIMHASH_MIN_WORDS words
+    """
+    words = _WORD_PATTERN.findall(_TITLE_SOURCE_SUFFIX.sub('', title or '').lower())
+    if len(words) < SIMHASH_MIN_WORDS:
+        return None
+    weights = [0] * 64
+    for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+        feature_hash = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if feature_hash >> bit & 1 else -1
+    simhash = sum(1 << bit for bit in range(64) if weights[bit] > 0)
+    return simhash - (1 << 64) if simhash >= 1 << 63 else simhash
+
+
+def _simhash_bands(simhash: int) -> List[int]:
+    width = 64 // SIMHASH_BANDS
+    return [(simhash >> (band * width)) & ((1 << width) - 1) for band in range(SIMHASH_BANDS)]
+
+
+def _simhash_distance(first: int, second: int) -> int:
+    return bin((first ^ second) & ((1 << 64) - 1)).count('1')
+
+
+class NewsStore:
+    """SQLite store of the articles, the articles of each entity and their watermarks."""
+
+    def __init__(self, store_file: str):
+        self.store_file = store_file
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(store_file)), exist_ok=True)
+        with self._connection() as connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the connection of the current process and thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.store_file, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def watermark(self, entity_name: str, query: str) -> Optional[Dict]:
+        """
+        Get the watermark of an entity.
+
+        Args:
+            entity_name: Name of the entity
+            query: The query terms the articles are fetched with
+
+        Returns:
+            Dictionary with 'seen_until' (the newest seendate, None if no
+            article was found yet) and 'checked_at' (the time of the last
+            fetch), or None if the entity was never fetched with this query
+        """
+        row = self._connection().execute(
+            "SELECT query, seen_until, checked_at FROM watermarks WHERE entity_key = ?",
+            (entity_name_key(entity_name),)
+        ).fetchone()
+        if row is None or row['query'] != query:
+            return None
+        return {"seen_until": row['seen_until'], "checked_at": row['checked_at']}
+
+    def delta_start(self, watermark: Dict) -> str:
+        """
+        Get the GDELT startdatetime of the articles not yet fetched.
+
+        Args:
+            watermark: The watermark of the entity
+
+        Returns:
+            The start of the delta window in GDELT's YYYYMMDDHHMMSS format
+        """
+        start = parse_seendate(watermark.get('seen_until'))
+        if start is None:
+            # Nothing was found so far: everything since the last fetch is new
+            start = datetime.fromtimestamp(watermark['checked_at'], tz=timezone.utc)
+        return (start - timedelta(seconds=WATERMARK_OVERLAP)).strftime(GDELT_DATETIME_FORMAT)
+
+    def _article_id(self, connection: sqlite3.Connection, article: Dict) -> str:
+        """Get the id of a stored copy of an article, storing the article if it is new."""
+        url = canonical_url(article['url'])
+        row = connection.execute("SELECT article_id FROM articles WHERE canonical_url = ?", (url,)).fetchone()
+        if row is not None:
+            return row['article_id']
+
+        simhash = title_simhash(article.get('title'))
+        if simhash is not None:
+            bands = _simhash_bands(simhash)
+            candidates = connection.execute(
+                "SELECT DISTINCT a.article_id, a.simhash FROM article_bands b JOIN articles a USING (article_id) "
+                "WHERE " + " OR ".join("(b.band = ? AND b.value = ?)" for _ in bands),
+                [value for band in enumerate(bands) for value in band]
+            ).fetchall()
+            for candidate in candidates:
+                if _simhash_distance(simhash, candidate['simhash']) <= SIMHASH_MAX_DISTANCE:
+                    return candidate['article_id']
+
+        article_id = hashlib.sha256(url.encode('utf-8')).hexdigest()[:20]
+        connection.execute(
+            "INSERT INTO articles (article_id, canonical_url, simhash, article) VALUES (?, ?, ?, ?)",
+            (article_id, url, simhash, json.dumps(article))
+        )
+        if simhash is not None:
+            connection.executemany(
+                "INSERT INTO article_bands (band, value, article_id) VALUES (?, ?, ?)",
+                [(band, value, article_id) for band, value in enumerate(_simhash_bands(simhash))]
+            )
+        return article_id
+
+    @staticmethod
+    def _release(connection: sqlite3.Connection, article_ids: Iterable[str]) -> None:
+        """Delete the articles no entity references anymore."""
+        for article_id in set(article_ids):
+            if connection.execute("SELECT 1 FROM entity_articles WHERE article_id = ? LIMIT 1",
+                                  (article_id,)).fetchone() is None:
+                connection.execute("DELETE FROM article_bands WHERE article_id = ?", (article_id,))
+                connection.execute("DELETE FROM articles WHERE article_id = ?", (article_id,))
+
+    def merge(self, entity_name: str, query: str, articles: Iterable[Dict], full: bool,
+              retention_days: Optional[int] = None, checked_at: Optional[float] = None) -> int:
+        """
+        Merge fetched articles into the entity's articles and advance its watermark.
+
+        Args:
+            entity_name: Name of the entity
+            query: The query terms the articles were fetched with
+            articles: The GDELT articles fetched
+            full: Whether the articles are a full pull, which replaces the stored ones
+            retention_days: Days after which articles are dropped, None to keep them
+            checked_at: Time of the fetch, now by default
+
+        Returns:
+            The number of articles not stored for the entity before
+        """
+        key = entity_name_key(entity_name)
+        checked_at = time.time() if checked_at is None else checked_at
+
+        with self._connection() as connection:
+            # Taking the write lock first makes the lookups of stored copies and
+            # the inserts of new articles atomic across workers
+            connection.execute("BEGIN IMMEDIATE")
+            released = []
+            if full:
+                released += [row['article_id'] for row in connection.execute(
+                    "SELECT article_id FROM entity_articles WHERE entity_key = ?", (key,))]
+                connection.execute("DELETE FROM entity_articles WHERE entity_key = ?", (key,))
+            before = connection.execute(
+                "SELECT COUNT(*) FROM entity_articles WHERE entity_key = ?", (key,)
+            ).fetchone()[0]
+            for article in articles:
+                if article.get('url'):
+                    # Copies seen at different times keep the earliest date
+                    connection.execute(
+                        "INSERT INTO entity_articles (entity_key, article_id, seendate) VALUES (?, ?, ?) "
+                        "ON CONFLICT (entity_key, article_id) DO UPDATE SET seendate = MIN(seendate, excluded.seendate)",
+                        (key, self._article_id(connection, article), article.get('seendate', ''))
+                    )
+            after = connection.execute(
+                "SELECT COUNT(*) FROM entity_articles WHERE entity_key = ?", (key,)
+            ).fetchone()[0]
+            if retention_days is not None:
+                cutoff = datetime.fromtimestamp(checked_at, tz=timezone.utc) - timedelta(days=retention_days)
+                expired = (key, cutoff.strftime(SEENDATE_FORMAT))
+                released += [row['article_id'] for row in connection.execute(
+                    "SELECT article_id FROM entity_articles WHERE entity_key = ? AND seendate < ?", expired)]
+                connection.execute("DELETE FROM entity_articles WHERE entity_key = ? AND seendate < ?", expired)
+            self._release(connection, released)
+
+            # Seendates of the same format sort chronologically as strings
+            seen_until = connection.execute(
+                "SELECT MAX(seendate) FROM entity_articles WHERE entity_key = ?", (key,)
+            ).fetchone()[0]
+            previous = self.watermark(entity_name, query) if not full else None
+            if previous and previous['seen_until'] and (not seen_until or previous['seen_until'] > seen_until):
+                seen_until = previous['seen_until']
+            connection.execute(
+                "INSERT OR REPLACE INTO watermarks (entity_key, query, seen_until, checked_at) VALUES (?, ?, ?, ?)",
+                (key, query, seen_until or None, checked_at)
+            )
+        return max(0, after - before)
+
+    def articles(self, entity_name: str) -> List[Dict]:
+        """
+        Get the stored articles of an entity.
+
+        Args:
+            entity_name: Name of the entity
+
+        Returns:
+            The GDELT articles with their 'article_id', newest first
+        """
+        rows = self._connection().execute(
+            "SELECT a.article_id, a.article FROM entity_articles e JOIN articles a USING (article_id) "
+            "WHERE e.entity_key = ? ORDER BY e.seendate DESC",
+            (entity_name_key(entity_name),)
+        ).fetchall()
+        return [{**json.loads(row['article']), "article_id": row['article_id']} for row in rows]
+
+    def get_articles(self, article_ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Get stored articles by id.
+
+        Args:
+            article_ids: Ids of the articles
+
+        Returns:
+            Dictionary mapping the ids of the stored articles to the GDELT articles
+        """
+        article_ids = list(dict.fromkeys(article_ids))
+        found = {}
+        # SQLite limits the number of parameters of a statement
+        for start in range(0, len(article_ids), 500):
+            chunk = article_ids[start:start + 500]
+            rows = self._connection().execute(
+                f"SELECT article_id, article FROM articles WHERE article_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((row['article_id'], json.loads(row['article'])) for row in rows)
+        return found
+
+
+def get_news_store(store_file: str) -> NewsStore:
+    """
+    Get the process-wide news store.
+
+    Args:
+        store_file: Path of the store database
+
+    Returns:
+        The news store, created if needed
+    """
+    global _store
+
+    if _store is None or _store.store_file != store_file:
+        with _store_lock:
+            if _store is None or _store.store_file != store_file:
+                _store = NewsStore(store_file)
+    return _store
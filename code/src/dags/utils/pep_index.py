@@ -0,0 +1,383 @@
+"""
+PEP (Politically Exposed Persons) index management.
+
+The PEP dataset is compiled once into a binary index file next to the CSV and
+memory-mapped by every worker process, so all workers on a node share the same
+page cache.
+
+A small JSON manifest next to the index describes which files make up the
+current dataset: the compiled base, an optional delta of records added or
+changed by later refreshes (see dags.utils.pep_refresh), the base records they
+removed and the dataset version. The manifest is keyed by the CSV's size and
+modification time, and the index is rebuilt automatically whenever the CSV is
+replaced by anything other than a refresh.
+
+The index can also be built ahead of time:
+
+    python -m dags.utils.pep_index [pep_data_file] [pep_index_file]
+"""
+import os
+import sys
+import csv
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dags.utils.name_index import (
+    CompiledNameIndex, LayeredNameIndex, write_compiled_index, read_compiled_index_fingerprint, index_lock
+)
+from dags.utils.similarity_engine import CharNgramSimilarityEngine
+
+logger = logging.getLogger(__name__)
+
+# Process-wide cache of opened PEP indexes and the mtime of the manifest they were
+# opened with, keyed by the data file they were built from
+_index_cache: Dict[str, Tuple[LayeredNameIndex, Optional[int]]] = {}
+_index_lock = threading.Lock()
+
+# Process-wide cache of similarity engines, keyed by the base index file they were built from
+_engine_cache: Dict[str, Tuple[LayeredNameIndex, CharNgramSimilarityEngine]] = {}
+_engine_lock = threading.Lock()
+
+
+def pep_record_names(record: Dict) -> Iterable[str]:
+    """
+    Get the primary name and all aliases of a PEP record.
+
+    Args:
+        record: A row of the PEP data file
+
+    Returns:
+        List of names for the record
+    """
+    names = [record.get('name') or '']
+    aliases = record.get('aliases') or ''
+    names.extend(alias for alias in aliases.split(';') if alias)
+    return names
+
+
+def load_pep_records(pep_data_file: str) -> List[Dict]:
+    """
+    Read all rows of the PEP data file.
+
+    Args:
+        pep_data_file: Path to the OpenSanctions PEP CSV file
+
+    Returns:
+        List of rows as dictionaries
+    """
+    with open(pep_data_file, 'r', encoding='utf-8') as csv_file:
+        return list(csv.DictReader(csv_file))
+
+
+def default_pep_index_file(pep_data_file: str) -> str:
+    """
+    Get the default location of the compiled index for a PEP data file.
+
+    Args:
+        pep_data_file: Path to the OpenSanctions PEP CSV file
+
+    Returns:
+        Path of the compiled index file
+    """
+    return f"{os.path.splitext(pep_data_file)[0]}.idx"
+
+
+def pep_data_fingerprint(pep_data_file: str) -> str:
+    """
+    Get a cheap fingerprint that changes whenever the data file is replaced or modified.
+
+    Args:
+        pep_data_file: Path to the OpenSanctions PEP CSV file
+
+    Returns:
+        Fingerprint of the data file
+    """
+    stat = os.stat(pep_data_file)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def pep_manifest_file(pep_index_file: str) -> str:
+    """
+    Get the location of the manifest describing a compiled PEP index.
+
+    Args:
+        pep_index_file: Path of the compiled base index
+
+    Returns:
+        Path of the manifest file
+    """
+    return f"{os.path.splitext(pep_index_file)[0]}.manifest.json"
+
+
+def read_pep_manifest(pep_index_file: str) -> Optional[Dict]:
+    """
+    Read the manifest of a compiled PEP index.
+
+    Args:
+        pep_index_file: Path of the compiled base index
+
+    Returns:
+        The manifest, or None if it is missing or unreadable
+    """
+    try:
+        with open(pep_manifest_file(pep_index_file), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_pep_manifest(pep_index_file: str, manifest: Dict) -> None:
+    """
+    Atomically replace the manifest of a compiled PEP index.
+
+    Args:
+        pep_index_file: Path of the compiled base index
+        manifest: The new manifest
+    """
+    manifest_file = pep_manifest_file(pep_index_file)
+    temp_file = f"{manifest_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_file, manifest_file)
+
+
+def pep_layer_path(pep_index_file: str, file_name: str) -> str:
+    """
+    Resolve a layer file name of the manifest relative to the index directory.
+
+    Args:
+        pep_index_file: Path of the compiled base index
+        file_name: File name of the layer as stored in the manifest
+
+    Returns:
+        Path of the layer file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(pep_index_file)), file_name)
+
+
+def build_pep_index(pep_data_file: str, pep_index_file: Optional[str] = None,
+                    version: Optional[str] = None) -> str:
+    """
+    Compile the whole PEP data file into a base index without a delta.
+
+    Callers that may race with other workers should hold the index_lock of the index file.
+
+    Args:
+        pep_data_file: Path to the OpenSanctions PEP CSV file
+        pep_index_file: Path of the compiled index, defaults to the CSV path with an .idx extension
+        version: Version of the dataset, defaults to one derived from the file's modification time
+
+    Returns:
+        Path of the compiled index file
+    """
+    pep_index_file = pep_index_file or default_pep_index_file(pep_data_file)
+    fingerprint = pep_data_fingerprint(pep_data_file)
+    if not version:
+        modified = datetime.fromtimestamp(os.stat(pep_data_file).st_mtime, tz=timezone.utc)
+        version = f"local-{modified.strftime('%Y%m%d%H%M%S')}"
+
+    logger.info(f"Compiling PEP index {pep_index_file} from {pep_data_file}")
+    write_compiled_index(pep_index_file, load_pep_records(pep_data_file), pep_record_names, fingerprint)
+
+    previous = read_pep_manifest(pep_index_file) or {}
+    write_pep_manifest(pep_index_file, {
+        "version": version,
+        "data_fingerprint": fingerprint,
+        "base_file": os.path.basename(pep_index_file),
+        "base_fingerprint": fingerprint,
+        "delta_file": None,
+        "delta_fingerprint": None,
+        "removed_record_ids": [],
+        "sequence": previous.get("sequence", 0) + 1,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    })
+    remove_stale_pep_delta(pep_index_file, previous, None)
+    return pep_index_file
+
+
+def remove_stale_pep_delta(pep_index_file: str, previous: Dict, current_delta_file: Optional[str]) -> None:
+    """
+    Delete the delta file of a previous manifest once it is no longer referenced.
+
+    Args:
+        pep_index_file: Path of the compiled base index
+        previous: The manifest that was replaced
+        current_delta_file: File name of the delta referenced by the new manifest
+    """
+    stale = previous.get("delta_file")
+    if stale and stale != current_delta_file:
+        try:
+            # Workers still mapping the old delta keep reading it until they reopen the index
+            os.remove(pep_layer_path(pep_index_file, stale))
+        except OSError:
+            pass
+
+
+def pep_manifest_is_current(pep_index_file: str, manifest: Optional[Dict], fingerprint: str) -> bool:
+    """
+    Check whether a manifest describes the current data file and all its layers are in place.
+
+    Args:
+        pep_index_file: Path of the compiled base index
+        manifest: The manifest to check
+        fingerprint: Fingerprint of the current data file
+
+    Returns:
+        True if the layers of the manifest can be opened as they are
+    """
+    if not manifest or manifest.get("data_fingerprint") != fingerprint:
+        return False
+    if read_compiled_index_fingerprint(pep_layer_path(pep_index_file, manifest["base_file"])) != manifest["base_fingerprint"]:
+        return False
+    if manifest.get("delta_file"):
+        delta_fingerprint = read_compiled_index_fingerprint(pep_layer_path(pep_index_file, manifest["delta_file"]))
+        if delta_fingerprint != manifest["delta_fingerprint"]:
+            return False
+    return True
+
+
+def _ensure_pep_index_file(pep_data_file: str, pep_index_file: str, fingerprint: str) -> Dict:
+    """
+    Make sure the compiled index on disk matches the data file, rebuilding it if needed.
+
+    A file lock ensures only one worker on the node compiles the index while
+    the others wait and then reuse the result.
+
+    Returns:
+        The manifest of the up-to-date index
+    """
+    manifest = read_pep_manifest(pep_index_file)
+    if pep_manifest_is_current(pep_index_file, manifest, fingerprint):
+        return manifest
+
+    with index_lock(pep_index_file):
+        manifest = read_pep_manifest(pep_index_file)
+        if not pep_manifest_is_current(pep_index_file, manifest, fingerprint):
+            build_pep_index(pep_data_file, pep_index_file)
+            manifest = read_pep_manifest(pep_index_file)
+    return manifest
+
+
+def open_pep_index(pep_index_file: str, manifest: Dict) -> LayeredNameIndex:
+    """
+    Open the layers described by a manifest.
+
+    Args:
+        pep_index_file: Path of the compiled base index
+        manifest: The manifest of the index
+
+    Returns:
+        The name index over all current PEP records
+    """
+    base = CompiledNameIndex(pep_layer_path(pep_index_file, manifest["base_file"]))
+    delta = None
+    if manifest.get("delta_file"):
+        delta = CompiledNameIndex(pep_layer_path(pep_index_file, manifest["delta_file"]))
+    return LayeredNameIndex(
+        base, delta, manifest.get("removed_record_ids", ()),
+        fingerprint=manifest["data_fingerprint"], version=manifest["version"],
+    )
+
+
+def _manifest_mtime(pep_index_file: str) -> Optional[int]:
+    try:
+        return os.stat(pep_manifest_file(pep_index_file)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _cached_pep_index(pep_data_file: str, pep_index_file: str, fingerprint: str) -> Optional[LayeredNameIndex]:
+    """
+    Get the cached index of a data file if it is still current.
+
+    A refresh finding the data unchanged only rewrites the version in the
+    manifest, so the cached index takes the new version without reopening it.
+    """
+    cached = _index_cache.get(pep_data_file)
+    if cached is None or cached[0].fingerprint != fingerprint:
+        return None
+    index, manifest_mtime = cached
+    current_mtime = _manifest_mtime(pep_index_file)
+    if current_mtime != manifest_mtime:
+        manifest = read_pep_manifest(pep_index_file)
+        if not manifest or manifest.get("data_fingerprint") != fingerprint:
+            return None
+        index.version = manifest["version"]
+        _index_cache[pep_data_file] = (index, current_mtime)
+    return index
+
+
+def get_pep_index(pep_data_file: str, pep_index_file: Optional[str] = None) -> LayeredNameIndex:
+    """
+    Get the memory-mapped PEP index for a data file, compiling it if needed.
+
+    The index is reopened when the data file changes on disk, either to pick
+    up the layers written by a refresh or to recompile it.
+
+    Args:
+        pep_data_file: Path to the OpenSanctions PEP CSV file
+        pep_index_file: Path of the compiled index, defaults to the CSV path with an .idx extension
+
+    Returns:
+        The name index over all PEP records, with the dataset version in its 'version' attribute
+    """
+    pep_index_file = pep_index_file or default_pep_index_file(pep_data_file)
+    fingerprint = pep_data_fingerprint(pep_data_file)
+
+    index = _cached_pep_index(pep_data_file, pep_index_file, fingerprint)
+    if index is not None:
+        return index
+
+    with _index_lock:
+        # Another thread may have opened the index while we were waiting
+        index = _cached_pep_index(pep_data_file, pep_index_file, fingerprint)
+        if index is not None:
+            return index
+
+        manifest = _ensure_pep_index_file(pep_data_file, pep_index_file, fingerprint)
+        index = open_pep_index(pep_index_file, manifest)
+        _index_cache[pep_data_file] = (index, _manifest_mtime(pep_index_file))
+        return index
+
+
+def get_pep_similarity_engine(index: LayeredNameIndex) -> CharNgramSimilarityEngine:
+    """
+    Get the vectorized similarity engine over all names of a PEP index.
+
+    The engine is built on first use for bulk screening and reused until the
+    index is reopened after a refresh or recompilation.
+
+    Args:
+        index: The PEP index returned by get_pep_index
+
+    Returns:
+        The similarity engine
+    """
+    index_file = index.base.index_file
+    cached = _engine_cache.get(index_file)
+    if cached and cached[0] is index:
+        return cached[1]
+
+    with _engine_lock:
+        cached = _engine_cache.get(index_file)
+        if cached and cached[0] is index:
+            return cached[1]
+
+        logger.info(f"Building PEP similarity engine for dataset {index.version}")
+        engine = CharNgramSimilarityEngine.from_name_index(index)
+        _engine_cache[index_file] = (index, engine)
+        return engine
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        data_file = sys.argv[1]
+        index_file = sys.argv[2] if len(sys.argv) > 2 else None
+    else:
+        from dags.config.settings import PEP_DATA_FILE, PEP_INDEX_FILE
+        data_file, index_file = PEP_DATA_FILE, PEP_INDEX_FILE
+    print(build_pep_index(data_file, index_file))
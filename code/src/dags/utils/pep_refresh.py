@@ -0,0 +1,238 @@
+"""
+Incremental refresh of the PEP (Politically Exposed Persons) dataset.
+
+A new snapshot of the OpenSanctions PEP list is downloaded (or handed over as
+a file) and diffed against the current data file by entity id. Instead of
+recompiling the whole index, only the records that differ from the compiled
+base are compiled into a small delta index, and the base records they replace
+or remove are recorded as tombstones in the index manifest. Once the delta
+grows beyond a share of the base, the next refresh compacts everything into
+a new base.
+"""
+import os
+import shutil
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import requests
+
+from dags.utils.http_client import get_http_session
+from dags.utils.name_index import CompiledNameIndex, write_compiled_index, index_lock
+from dags.utils.pep_index import (
+    pep_record_names, load_pep_records, default_pep_index_file, pep_data_fingerprint,
+    build_pep_index, read_pep_manifest, write_pep_manifest,
+    pep_manifest_is_current, pep_layer_path, remove_stale_pep_delta
+)
+
+logger = logging.getLogger(__name__)
+
+# Share of the base records the delta may reach before the index is compacted
+DEFAULT_COMPACTION_RATIO = 0.2
+
+
+def _comparable(record: Dict) -> Dict:
+    """Drop empty values so records compare equal regardless of missing columns."""
+    return {column: value for column, value in record.items() if value not in (None, '')}
+
+
+def diff_pep_records(current_records: List[Dict], new_records: List[Dict]) -> Dict[str, List[str]]:
+    """
+    Compare two versions of the PEP list by entity id.
+
+    Args:
+        current_records: The records of the current snapshot
+        new_records: The records of the new snapshot
+
+    Returns:
+        Dictionary with the 'added', 'changed' and 'removed' entity ids
+    """
+    current_by_id = {record.get('id'): _comparable(record) for record in current_records}
+    new_by_id = {record.get('id'): _comparable(record) for record in new_records}
+
+    return {
+        "added": [entity_id for entity_id in new_by_id if entity_id not in current_by_id],
+        "changed": [
+            entity_id for entity_id, record in new_by_id.items()
+            if entity_id in current_by_id and current_by_id[entity_id] != record
+        ],
+        "removed": [entity_id for entity_id in current_by_id if entity_id not in new_by_id],
+    }
+
+
+def fetch_pep_dataset_version(metadata_url: str) -> Optional[str]:
+    """
+    Get the version of the latest published PEP dataset.
+
+    Args:
+        metadata_url: URL of the dataset's index.json on data.opensanctions.org
+
+    Returns:
+        The dataset version, or None if it could not be determined
+    """
+    try:
+        response = get_http_session('opensanctions_data').get(metadata_url)
+        response.raise_for_status()
+        return response.json().get('version')
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning(f"Could not fetch PEP dataset version from {metadata_url}: {str(e)}")
+        return None
+
+
+def download_pep_snapshot(url: str, target_file: str) -> str:
+    """
+    Stream a PEP snapshot to a local file.
+
+    Args:
+        url: URL of the targets.simple.csv export
+        target_file: Path to write the snapshot to
+
+    Returns:
+        Path of the downloaded snapshot
+    """
+    logger.info(f"Downloading PEP snapshot from {url}")
+    with get_http_session('opensanctions_data').get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(target_file, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+    return target_file
+
+
+def _install_snapshot(snapshot_file: str, pep_data_file: str) -> None:
+    """Atomically move a snapshot into place as the current data file."""
+    temp_file = f"{pep_data_file}.{os.getpid()}.tmp"
+    shutil.copyfile(snapshot_file, temp_file)
+    os.replace(temp_file, pep_data_file)
+
+
+def _apply_snapshot(pep_data_file: str, pep_index_file: str, snapshot_file: str,
+                    version: str, compaction_ratio: float) -> Dict:
+    """Diff a snapshot against the index and write a delta or a compacted base. Requires the index lock."""
+    new_records = load_pep_records(snapshot_file)
+    if any(not record.get('id') for record in new_records):
+        raise ValueError(f"PEP snapshot {snapshot_file} has records without an id")
+
+    manifest = read_pep_manifest(pep_index_file)
+    current_records = load_pep_records(pep_data_file) if os.path.exists(pep_data_file) else []
+    changes = diff_pep_records(current_records, new_records)
+    summary = {
+        "version": version,
+        "records": len(new_records),
+        "added": len(changes["added"]),
+        "changed": len(changes["changed"]),
+        "removed": len(changes["removed"]),
+    }
+
+    if manifest and current_records and not any(changes.values()):
+        if manifest.get("version") != version:
+            manifest["version"] = version
+            manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+            write_pep_manifest(pep_index_file, manifest)
+        return {**summary, "mode": "unchanged"}
+
+    # The delta is always relative to the base, so records changed back and
+    # forth across several refreshes do not pile up in it
+    base = CompiledNameIndex(pep_layer_path(pep_index_file, manifest["base_file"])) if manifest else None
+    base_by_id = {}
+    if base is not None:
+        for record_id in range(len(base)):
+            record = base.record(record_id)
+            base_by_id[record.get('id')] = (record_id, _comparable(record))
+
+    delta_records = []
+    delta_ids = set()
+    for record in new_records:
+        base_entry = base_by_id.get(record['id'])
+        if base_entry is None or base_entry[1] != _comparable(record):
+            delta_records.append(record)
+            delta_ids.add(record['id'])
+    new_ids = {record['id'] for record in new_records}
+    removed_record_ids = sorted(
+        record_id for entity_id, (record_id, _) in base_by_id.items()
+        if entity_id not in new_ids or entity_id in delta_ids
+    )
+
+    _install_snapshot(snapshot_file, pep_data_file)
+
+    if base is None or len(delta_records) + len(removed_record_ids) > compaction_ratio * len(base):
+        logger.info(f"Compacting PEP index with {len(new_records)} records for version {version}")
+        build_pep_index(pep_data_file, pep_index_file, version)
+        return {**summary, "mode": "compacted"}
+
+    fingerprint = pep_data_fingerprint(pep_data_file)
+    sequence = manifest.get("sequence", 0) + 1
+    delta_file = f"{os.path.splitext(os.path.basename(pep_index_file))[0]}.delta-{sequence}.idx"
+    write_compiled_index(pep_layer_path(pep_index_file, delta_file), delta_records, pep_record_names, fingerprint)
+
+    write_pep_manifest(pep_index_file, {
+        **manifest,
+        "version": version,
+        "data_fingerprint": fingerprint,
+        "delta_file": delta_file,
+        "delta_fingerprint": fingerprint,
+        "removed_record_ids": removed_record_ids,
+        "sequence": sequence,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    })
+    remove_stale_pep_delta(pep_index_file, manifest, delta_file)
+
+    logger.info(f"Applied PEP delta with {len(delta_records)} records and "
+                f"{len(removed_record_ids)} tombstones for version {version}")
+    return {**summary, "mode": "delta", "delta_records": len(delta_records),
+            "tombstones": len(removed_record_ids)}
+
+
+def refresh_pep_dataset(pep_data_file: str, pep_index_file: Optional[str] = None,
+                        snapshot_file: Optional[str] = None, source_url: Optional[str] = None,
+                        metadata_url: Optional[str] = None, version: Optional[str] = None,
+                        compaction_ratio: float = DEFAULT_COMPACTION_RATIO) -> Dict:
+    """
+    Bring the PEP data file and its compiled index up to date with a new snapshot.
+
+    Workers pick up the new layers the next time they screen a name, without
+    an image rebuild or a restart.
+
+    Args:
+        pep_data_file: Path to the OpenSanctions PEP CSV file
+        pep_index_file: Path of the compiled index, defaults to the CSV path with an .idx extension
+        snapshot_file: Local snapshot to apply, downloaded from source_url if not given
+        source_url: URL of the targets.simple.csv export to download
+        metadata_url: URL of the dataset's index.json, used to determine the version
+        version: Version of the snapshot, overrides the one from metadata_url
+        compaction_ratio: Share of the base records the delta may reach before compacting
+
+    Returns:
+        Dictionary with the status, the applied version and the number of changed records
+    """
+    try:
+        pep_index_file = pep_index_file or default_pep_index_file(pep_data_file)
+        os.makedirs(os.path.dirname(os.path.abspath(pep_data_file)), exist_ok=True)
+
+        downloaded_file = None
+        if not snapshot_file:
+            if not source_url:
+                return {"status": "failed", "reason": "No PEP snapshot file or source URL provided", "data": None}
+            if not version and metadata_url:
+                version = fetch_pep_dataset_version(metadata_url)
+            downloaded_file = snapshot_file = download_pep_snapshot(source_url, f"{pep_data_file}.download")
+
+        version = version or f"snapshot-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}"
+
+        try:
+            with index_lock(pep_index_file):
+                # Start from an index matching the current data file, so the diff has a valid base
+                if os.path.exists(pep_data_file) and not pep_manifest_is_current(
+                        pep_index_file, read_pep_manifest(pep_index_file), pep_data_fingerprint(pep_data_file)):
+                    build_pep_index(pep_data_file, pep_index_file)
+                summary = _apply_snapshot(pep_data_file, pep_index_file, snapshot_file, version, compaction_ratio)
+        finally:
+            if downloaded_file and os.path.exists(downloaded_file):
+                os.remove(downloaded_file)
+
+        logger.info(f"Refreshed PEP dataset to version {version}: {summary}")
+        return {"status": "success", "data": summary}
+
+    except Exception as e:
+        logger.error(f"Error refreshing PEP dataset: {str(e)}")
+        return {"status": "failed", "reason": f"Error refreshing PEP dataset: {str(e)}", "data": None}
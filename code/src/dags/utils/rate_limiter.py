@@ -0,0 +1,294 @@
+"""
+Per-provider rate limiting shared by all workers.
+
+Every request to an enrichment provider first takes a token from the
+provider's token bucket, which refills at the configured requests per second
+up to the configured burst. The buckets live in Redis, so all Celery workers
+and mapped tasks share one budget per provider, and a bucket is updated by a
+single Lua script so concurrent workers never overdraw it.
+
+When a provider still answers with 429 Too Many Requests, its rate is halved
+(down to MIN_RATE_FACTOR of the configured rate) and all workers pause for
+the Retry-After period; the rate then recovers linearly over
+RECOVERY_SECONDS. If Redis is unreachable, each process falls back to a local
+bucket with the same behaviour.
+
+A thread running a check with a deadline (see
+dags.utils.concurrent_checks) never waits past it: acquire raises
+DeadlineExceeded instead, so the check stops rather than taking tokens after
+its result was given up on.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from dags.config.settings import RATE_LIMITS, RATE_LIMIT_REDIS_URL, RATE_LIMIT_MAX_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Lowest share of the configured rate an adaptive slowdown can reach
+MIN_RATE_FACTOR = 0.1
+
+# Seconds after which a slowed-down rate is back at the configured rate
+RECOVERY_SECONDS = 300
+
+# Pause of all workers after a 429 without a Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+# Seconds an idle bucket is kept in Redis
+BUCKET_TTL = 3600
+
+# Seconds the local buckets are used after Redis failed, before Redis is tried again
+REDIS_RETRY_INTERVAL = 30
+
+# Takes a token if one is available. Returns the seconds to wait otherwise.
+# KEYS[1]: bucket; ARGV: rate, burst, recovery per second, TTL
+_ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'factor', 'blocked_until')
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+local factor = tonumber(bucket[3]) or 1
+local blocked_until = tonumber(bucket[4]) or 0
+factor = math.min(1, factor + math.max(0, now - updated) * tonumber(ARGV[3]))
+-- No tokens accrue while the provider asked to pause
+local refill = math.max(0, now - math.max(updated, blocked_until))
+tokens = math.min(burst, tokens + refill * rate * factor)
+local wait = 0
+if blocked_until > now then
+    wait = blocked_until - now
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / (rate * factor)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now, 'factor', factor)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+# Halves the rate, empties the bucket and pauses it for the Retry-After period.
+# KEYS[1]: bucket; ARGV: minimum factor, retry after, TTL
+_PENALIZE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'factor', 'blocked_until')
+local factor = math.max(tonumber(ARGV[1]), (tonumber(bucket[1]) or 1) / 2)
+local blocked_until = math.max(tonumber(bucket[2]) or 0, now + tonumber(ARGV[2]))
+redis.call('HSET', KEYS[1], 'tokens', 0, 'updated', now, 'factor', factor, 'blocked_until', blocked_until)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return tostring(factor)
+"""
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+_deadline = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """The deadline of the current thread's check passed while waiting for a rate limit."""
+
+
+def set_deadline(deadline: Optional[float]) -> None:
+    """
+    Set the deadline of the requests of the current thread.
+
+    Args:
+        deadline: time.monotonic() time the requests must be sent by, or None for no deadline
+    """
+    _deadline.at = deadline
+
+
+def parse_rate_limits(limits: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Parse per-provider limits of the form "provider=rate:burst,provider=rate:burst".
+
+    Args:
+        limits: The limit specification, rates in requests per second
+
+    Returns:
+        Dictionary mapping provider names to (rate, burst)
+    """
+    parsed = {}
+    for item in limits.split(','):
+        provider, _, limit = item.partition('=')
+        if provider.strip() and limit.strip():
+            rate, _, burst = limit.partition(':')
+            parsed[provider.strip()] = (float(rate), float(burst or 1))
+    return parsed
+
+
+class LocalRateLimiter:
+    """Token buckets of the current process, used when Redis is unavailable."""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]]):
+        self.limits = limits
+        self._buckets: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, provider: str, now: float) -> Dict[str, float]:
+        rate, burst = self.limits[provider]
+        return self._buckets.setdefault(
+            provider, {'tokens': burst, 'updated': now, 'factor': 1.0, 'blocked_until': 0.0}
+        )
+
+    def try_acquire(self, provider: str) -> float:
+        """
+        Take a token of a provider's bucket if one is available.
+
+        Args:
+            provider: Name of the provider
+
+        Returns:
+            0 if a token was taken, otherwise the seconds to wait before trying again
+        """
+        rate, burst = self.limits[provider]
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(provider, now)
+            bucket['factor'] = min(1.0, bucket['factor'] + max(0.0, now - bucket['updated']) / RECOVERY_SECONDS)
+            refill = max(0.0, now - max(bucket['updated'], bucket['blocked_until']))
+            bucket['tokens'] = min(burst, bucket['tokens'] + refill * rate * bucket['factor'])
+            bucket['updated'] = now
+            if bucket['blocked_until'] > now:
+                return bucket['blocked_until'] - now
+            if bucket['tokens'] >= 1:
+                bucket['tokens'] -= 1
+                return 0.0
+            return (1 - bucket['tokens']) / (rate * bucket['factor'])
+
+    def penalize(self, provider: str, retry_after: float) -> float:
+        """
+        Slow a provider down after a 429 response.
+
+        Args:
+            provider: Name of the provider
+            retry_after: Seconds to pause all requests to the provider
+
+        Returns:
+            The new share of the configured rate
+        """
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(provider, now)
+            bucket['factor'] = max(MIN_RATE_FACTOR, bucket['factor'] / 2)
+            bucket['blocked_until'] = max(bucket['blocked_until'], now + retry_after)
+            bucket['tokens'] = 0.0
+            bucket['updated'] = now
+            return bucket['factor']
+
+
+class RedisRateLimiter:
+    """Token buckets in Redis shared by all workers, falling back to local buckets on errors."""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], redis_url: str, prefix: str = 'ratelimit'):
+        import redis
+
+        self.limits = limits
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=1, socket_connect_timeout=1)
+        self._acquire = self.client.register_script(_ACQUIRE_SCRIPT)
+        self._penalize = self.client.register_script(_PENALIZE_SCRIPT)
+        self.fallback = LocalRateLimiter(limits)
+        self._unavailable_until = 0.0
+
+    def _run(self, script, provider: str, args: list) -> Optional[float]:
+        """Run a bucket script, returning None while Redis is unavailable."""
+        if time.monotonic() < self._unavailable_until:
+            return None
+        try:
+            return float(script(keys=[f"{self.prefix}:{provider}"], args=args))
+        except Exception as e:
+            logger.warning(f"Shared rate limiter unavailable, limiting per process for "
+                           f"{REDIS_RETRY_INTERVAL}s: {str(e)}")
+            self._unavailable_until = time.monotonic() + REDIS_RETRY_INTERVAL
+            return None
+
+    def try_acquire(self, provider: str) -> float:
+        rate, burst = self.limits[provider]
+        wait = self._run(self._acquire, provider, [rate, burst, 1 / RECOVERY_SECONDS, BUCKET_TTL])
+        return self.fallback.try_acquire(provider) if wait is None else wait
+
+    def penalize(self, provider: str, retry_after: float) -> float:
+        factor = self._run(self._penalize, provider, [MIN_RATE_FACTOR, retry_after, BUCKET_TTL])
+        return self.fallback.penalize(provider, retry_after) if factor is None else factor
+
+
+def acquire(provider: str, limiter=None, max_wait: float = RATE_LIMIT_MAX_WAIT) -> float:
+    """
+    Wait until a request to a provider is within its rate limit.
+
+    Providers without a configured limit are not limited. After max_wait
+    seconds the request is let through anyway, so a stuck bucket cannot
+    block a task forever.
+
+    Args:
+        provider: Name of the provider
+        limiter: The limiter to use, the process-wide one by default
+        max_wait: Maximum number of seconds to wait
+
+    Returns:
+        The number of seconds waited
+
+    Raises:
+        DeadlineExceeded: If the wait would pass the deadline of the current thread
+    """
+    limiter = limiter or get_rate_limiter()
+    if provider not in limiter.limits:
+        return 0.0
+
+    deadline = getattr(_deadline, 'at', None)
+    waited = 0.0
+    while True:
+        wait = limiter.try_acquire(provider)
+        if wait <= 0:
+            return waited
+        if deadline is not None and time.monotonic() + wait > deadline:
+            raise DeadlineExceeded(f"The {provider} rate limit wait would pass the check's deadline")
+        if waited + wait > max_wait:
+            logger.warning(f"Waited {waited:.1f}s for the {provider} rate limit, sending the request anyway")
+            return waited
+        time.sleep(wait)
+        waited += wait
+
+
+def report_rate_limited(provider: str, retry_after: Optional[float] = None, limiter=None) -> None:
+    """
+    Slow down all requests to a provider after it answered with 429 Too Many Requests.
+
+    Args:
+        provider: Name of the provider
+        retry_after: Seconds from the response's Retry-After header, if any
+        limiter: The limiter to use, the process-wide one by default
+    """
+    limiter = limiter or get_rate_limiter()
+    if provider not in limiter.limits:
+        return
+    factor = limiter.penalize(provider, retry_after if retry_after is not None else DEFAULT_RETRY_AFTER)
+    logger.warning(f"{provider} is rate limiting requests, slowing down to {factor:.0%} of its configured rate")
+
+
+def get_rate_limiter():
+    """
+    Get the process-wide rate limiter configured in the settings.
+
+    Returns:
+        The Redis rate limiter, or a local one if the redis package is missing
+    """
+    global _limiter
+
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                limits = parse_rate_limits(RATE_LIMITS)
+                try:
+                    _limiter = RedisRateLimiter(limits, RATE_LIMIT_REDIS_URL)
+                except ImportError:
+                    logger.warning("The redis package is not installed, rate limits apply per process")
+                    _limiter = LocalRateLimiter(limits)
+    return _limiter
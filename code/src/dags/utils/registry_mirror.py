@@ -0,0 +1,458 @@
+"""
+Local mirror of company registries for corporate registry lookups.
+
+Bulk company files dropped into the registry data folder are imported into a
+SQLite database with an FTS5 full-text index over the companies' normalized
+current and previous names (see dags.utils.name_normalization). Two CSV
+layouts are understood, plain or gzipped:
+
+    OpenCorporates bulk data     company_number, jurisdiction_code, name,
+                                 current_status, registered_address.in_full, ...
+    UK Companies House           CompanyName, CompanyNumber, CompanyStatus,
+    (BasicCompanyData)           RegAddress.*, PreviousName_N.CompanyName, ...
+
+Searches return the shape of the OpenCorporates companies/search API, so
+get_open_corporates_data treats mirror and API results alike. A search is
+authoritative for the jurisdictions the mirror covers; elsewhere only its hits
+are, and a caller may fall back to the API.
+
+Files are imported once and again whenever they are replaced:
+
+    python -m dags.utils.registry_mirror [registry_data_folder] [registry_mirror_file]
+"""
+import os
+import sys
+import csv
+import gzip
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from dags.utils.jurisdiction import resolve_jurisdiction
+from dags.utils.name_normalization import entity_name_key, name_tokens, normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Rows written per transaction during an import
+IMPORT_BATCH_SIZE = 10000
+
+# Full-text hits re-ranked per search
+SEARCH_CANDIDATES = 50
+
+# Legal form tokens left out of the full-text query, since registries spell them
+# differently ("Ltd" and "Limited"); they still count for the ranking
+LEGAL_FORM_TOKENS = frozenset({
+    'ltd', 'limited', 'llc', 'llp', 'lp', 'inc', 'incorporated', 'corp', 'corporation', 'co', 'company',
+    'plc', 'gmbh', 'ag', 'sa', 'sarl', 'srl', 'spa', 'bv', 'nv', 'ab', 'as', 'oy', 'kg', 'pte',
+    'pty', 'ooo', 'oao', 'zao', 'pao', 'jsc', 'ojsc', 'pjsc', 'cjsc',
+})
+
+# Status words of companies that no longer trade
+INACTIVE_STATUS_WORDS = ('dissolved', 'inactive', 'struck', 'liquidat', 'closed', 'removed', 'cancel', 'revoked')
+
+# Alternative column names of every stored field, OpenCorporates first
+COLUMNS = {
+    'company_number': ('company_number', 'CompanyNumber'),
+    'name': ('name', 'CompanyName'),
+    'jurisdiction_code': ('jurisdiction_code',),
+    'company_type': ('company_type', 'CompanyCategory'),
+    'current_status': ('current_status', 'CompanyStatus'),
+    'incorporation_date': ('incorporation_date', 'IncorporationDate'),
+    'dissolution_date': ('dissolution_date', 'DissolutionDate'),
+    'registered_address': ('registered_address.in_full', 'registered_address_in_full'),
+    'registry_url': ('registry_url', 'URI'),
+    'country': ('home_jurisdiction_text', 'CountryOfOrigin', 'RegAddress.Country'),
+}
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS companies ("
+    "jurisdiction_code TEXT NOT NULL, company_number TEXT NOT NULL, name TEXT NOT NULL, "
+    "name_key TEXT NOT NULL, search_names TEXT NOT NULL, company_type TEXT, current_status TEXT, "
+    "inactive INTEGER NOT NULL DEFAULT 0, incorporation_date TEXT, dissolution_date TEXT, "
+    "registered_address TEXT, previous_names TEXT, registry_url TEXT, source_file TEXT, "
+    "UNIQUE (jurisdiction_code, company_number))",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS companies_fts USING fts5("
+    "search_names, content='companies', content_rowid='rowid')",
+    "CREATE TRIGGER IF NOT EXISTS companies_ai AFTER INSERT ON companies BEGIN "
+    "INSERT INTO companies_fts (rowid, search_names) VALUES (new.rowid, new.search_names); END",
+    "CREATE TRIGGER IF NOT EXISTS companies_ad AFTER DELETE ON companies BEGIN "
+    "INSERT INTO companies_fts (companies_fts, rowid, search_names) VALUES ('delete', old.rowid, old.search_names); END",
+    "CREATE TRIGGER IF NOT EXISTS companies_au AFTER UPDATE ON companies BEGIN "
+    "INSERT INTO companies_fts (companies_fts, rowid, search_names) VALUES ('delete', old.rowid, old.search_names); "
+    "INSERT INTO companies_fts (rowid, search_names) VALUES (new.rowid, new.search_names); END",
+    "CREATE TABLE IF NOT EXISTS jurisdictions ("
+    "jurisdiction_code TEXT PRIMARY KEY, companies INTEGER NOT NULL, imported_at TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS imported_files ("
+    "file_name TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, companies INTEGER NOT NULL, imported_at TEXT NOT NULL)",
+)
+
+_UPSERT = (
+    "INSERT INTO companies (jurisdiction_code, company_number, name, name_key, search_names, company_type, "
+    "current_status, inactive, incorporation_date, dissolution_date, registered_address, previous_names, "
+    "registry_url, source_file) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (jurisdiction_code, company_number) DO UPDATE SET name = excluded.name, "
+    "name_key = excluded.name_key, search_names = excluded.search_names, company_type = excluded.company_type, "
+    "current_status = excluded.current_status, inactive = excluded.inactive, "
+    "incorporation_date = excluded.incorporation_date, dissolution_date = excluded.dissolution_date, "
+    "registered_address = excluded.registered_address, previous_names = excluded.previous_names, "
+    "registry_url = excluded.registry_url, source_file = excluded.source_file"
+)
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def registry_files(registry_data_folder: str) -> List[str]:
+    """
+    List the bulk company files in the registry data folder.
+
+    Args:
+        registry_data_folder: Folder holding the bulk files
+
+    Returns:
+        Sorted paths of the CSV files, plain or gzipped
+    """
+    if not os.path.isdir(registry_data_folder):
+        return []
+    return sorted(
+        os.path.join(registry_data_folder, file_name)
+        for file_name in os.listdir(registry_data_folder)
+        if file_name.endswith(('.csv', '.csv.gz'))
+        and os.path.isfile(os.path.join(registry_data_folder, file_name))
+    )
+
+
+def _file_fingerprint(path: str) -> str:
+    stat = os.stat(path)
+    return hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')).hexdigest()[:16]
+
+
+def _iso_date(value: Optional[str]) -> Optional[str]:
+    """Convert the dd/mm/yyyy dates of Companies House to ISO dates."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%d/%m/%Y').date().isoformat()
+    except ValueError:
+        return value
+
+
+def _field(row: Dict, field: str) -> Optional[str]:
+    for column in COLUMNS[field]:
+        value = (row.get(column) or '').strip()
+        if value:
+            return value
+    return None
+
+
+def company_from_row(row: Dict, default_jurisdiction: Optional[str] = None) -> Optional[Dict]:
+    """
+    Read a company from a row of a bulk file.
+
+    The jurisdiction is taken from the row's jurisdiction_code column, else
+    from default_jurisdiction, else resolved from the row's country.
+
+    Args:
+        row: The row, with stripped column names
+        default_jurisdiction: OpenCorporates jurisdiction code of files without one
+
+    Returns:
+        The company, or None if the row lacks a name, number or jurisdiction
+    """
+    name = _field(row, 'name')
+    company_number = _field(row, 'company_number')
+    jurisdiction_code = _field(row, 'jurisdiction_code') or default_jurisdiction
+    if not jurisdiction_code:
+        jurisdiction = resolve_jurisdiction(_field(row, 'country'))
+        jurisdiction_code = jurisdiction.opencorporates_code if jurisdiction else None
+    if not (name and company_number and jurisdiction_code):
+        return None
+
+    previous_names = [value for value in (row.get('previous_names') or '').split('|') if value.strip()]
+    previous_names += [
+        value.strip() for column, value in sorted(row.items())
+        if column.startswith('PreviousName_') and column.endswith('.CompanyName') and value and value.strip()
+    ]
+    address = _field(row, 'registered_address') or ', '.join(
+        value.strip() for column, value in row.items()
+        if column.startswith(('RegAddress.', 'registered_address.')) and value and value.strip()
+    )
+    status = _field(row, 'current_status')
+    dissolution_date = _iso_date(_field(row, 'dissolution_date'))
+    inactive = bool(dissolution_date) or any(word in (status or '').lower() for word in INACTIVE_STATUS_WORDS)
+
+    return {
+        'jurisdiction_code': jurisdiction_code.lower(),
+        'company_number': company_number,
+        'name': name,
+        'company_type': _field(row, 'company_type'),
+        'current_status': status,
+        'inactive': inactive,
+        'incorporation_date': _iso_date(_field(row, 'incorporation_date')),
+        'dissolution_date': dissolution_date,
+        'registered_address': address or None,
+        'previous_names': previous_names,
+        'registry_url': _field(row, 'registry_url'),
+    }
+
+
+def _read_registry_file(path: str, default_jurisdiction: Optional[str] = None) -> Iterator[Dict]:
+    """Read the companies of one bulk file."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8-sig', newline='') as csv_file:
+        reader = csv.DictReader(csv_file)
+        # Companies House pads its column names with spaces
+        reader.fieldnames = [column.strip() for column in reader.fieldnames or []]
+        for row in reader:
+            company = company_from_row(row, default_jurisdiction)
+            if company:
+                yield company
+
+
+def _search_query(name: str) -> Optional[str]:
+    """Build the FTS5 query matching all distinctive tokens of a name."""
+    tokens = list(dict.fromkeys(name_tokens(name)))
+    distinctive = [token for token in tokens if token not in LEGAL_FORM_TOKENS] or tokens
+    return ' '.join(f'"{token}"' for token in distinctive) or None
+
+
+class RegistryMirror:
+    """
+    Company registry mirror in a SQLite database file.
+
+    Connections are opened per process and thread, so the mirror can be
+    shared by the tasks of a worker.
+    """
+
+    def __init__(self, mirror_file: str):
+        self.mirror_file = mirror_file
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(mirror_file)), exist_ok=True)
+        with self._connection() as connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the connection of the current process and thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.mirror_file, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def import_file(self, path: str, default_jurisdiction: Optional[str] = None) -> int:
+        """
+        Import or update the companies of a bulk file.
+
+        Args:
+            path: Path of the bulk file
+            default_jurisdiction: OpenCorporates jurisdiction code of files without one
+
+        Returns:
+            Number of companies imported
+        """
+        connection = self._connection()
+        source_file = os.path.basename(path)
+        imported_at = datetime.now(timezone.utc).isoformat()
+        counts: Dict[str, int] = {}
+        batch = []
+
+        def flush():
+            with connection:
+                connection.executemany(_UPSERT, batch)
+            batch.clear()
+
+        for company in _read_registry_file(path, default_jurisdiction):
+            names = [company['name'], *company['previous_names']]
+            batch.append((
+                company['jurisdiction_code'], company['company_number'], company['name'],
+                entity_name_key(company['name']), ' '.join(normalize_name(name) for name in names),
+                company['company_type'], company['current_status'], int(company['inactive']),
+                company['incorporation_date'], company['dissolution_date'], company['registered_address'],
+                json.dumps(company['previous_names'], ensure_ascii=False), company['registry_url'], source_file,
+            ))
+            counts[company['jurisdiction_code']] = counts.get(company['jurisdiction_code'], 0) + 1
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+
+        with connection:
+            for jurisdiction_code in counts:
+                total = connection.execute(
+                    "SELECT COUNT(*) FROM companies WHERE jurisdiction_code = ?", (jurisdiction_code,)
+                ).fetchone()[0]
+                connection.execute(
+                    "INSERT OR REPLACE INTO jurisdictions (jurisdiction_code, companies, imported_at) VALUES (?, ?, ?)",
+                    (jurisdiction_code, total, imported_at),
+                )
+            connection.execute(
+                "INSERT OR REPLACE INTO imported_files (file_name, fingerprint, companies, imported_at) "
+                "VALUES (?, ?, ?, ?)",
+                (source_file, _file_fingerprint(path), sum(counts.values()), imported_at),
+            )
+
+        logger.info(f"Imported {sum(counts.values())} companies of {len(counts)} jurisdictions from {source_file}")
+        return sum(counts.values())
+
+    def import_folder(self, registry_data_folder: str) -> Dict[str, int]:
+        """
+        Import the bulk files of a folder that are new or were replaced since their last import.
+
+        Args:
+            registry_data_folder: Folder holding the bulk files
+
+        Returns:
+            Dictionary mapping the imported file names to their number of companies
+        """
+        imported = {}
+        for path in registry_files(registry_data_folder):
+            row = self._connection().execute(
+                "SELECT fingerprint FROM imported_files WHERE file_name = ?", (os.path.basename(path),)
+            ).fetchone()
+            if row and row['fingerprint'] == _file_fingerprint(path):
+                continue
+            imported[os.path.basename(path)] = self.import_file(path)
+        return imported
+
+    def covers(self, jurisdiction_code: Optional[str] = None, country_code: Optional[str] = None) -> bool:
+        """
+        Check whether the mirror holds a registry of a jurisdiction.
+
+        Args:
+            jurisdiction_code: OpenCorporates jurisdiction code, e.g. 'gb' or 'us_de'
+            country_code: ISO alpha-2 code, covered if any of its registries is
+
+        Returns:
+            True if the mirror holds companies of the jurisdiction
+        """
+        if jurisdiction_code:
+            row = self._connection().execute(
+                "SELECT 1 FROM jurisdictions WHERE jurisdiction_code = ?", (jurisdiction_code.lower(),)
+            ).fetchone()
+        elif country_code:
+            row = self._connection().execute(
+                "SELECT 1 FROM jurisdictions WHERE jurisdiction_code = ? OR jurisdiction_code LIKE ? ESCAPE '\\' LIMIT 1",
+                (country_code.lower(), f"{country_code.lower()}\\_%"),
+            ).fetchone()
+        else:
+            return False
+        return row is not None
+
+    def search(self, name: str, jurisdiction_code: Optional[str] = None, country_code: Optional[str] = None,
+               limit: int = 10) -> List[Dict]:
+        """
+        Search companies by name.
+
+        Companies whose name has the same sorted-token key as the query come
+        first, then active before inactive companies, then by full-text rank.
+
+        Args:
+            name: The company name
+            jurisdiction_code: OpenCorporates jurisdiction code to search in
+            country_code: ISO alpha-2 code to search in, including its subdivisions
+            limit: Maximum number of companies
+
+        Returns:
+            List of companies in the shape of the OpenCorporates API
+        """
+        query = _search_query(name)
+        if not query:
+            return []
+        sql = ("SELECT c.*, bm25(companies_fts) AS rank FROM companies_fts "
+               "JOIN companies c ON c.rowid = companies_fts.rowid WHERE companies_fts MATCH ?")
+        args: list = [query]
+        if jurisdiction_code:
+            sql += " AND c.jurisdiction_code = ?"
+            args.append(jurisdiction_code.lower())
+        elif country_code:
+            sql += " AND (c.jurisdiction_code = ? OR c.jurisdiction_code LIKE ? ESCAPE '\\')"
+            args += [country_code.lower(), f"{country_code.lower()}\\_%"]
+        sql += " ORDER BY rank LIMIT ?"
+        args.append(SEARCH_CANDIDATES)
+
+        rows = self._connection().execute(sql, args).fetchall()
+        name_key = entity_name_key(name)
+        rows.sort(key=lambda row: (row['name_key'] != name_key, bool(row['inactive']), row['rank']))
+        return [self._company(row) for row in rows[:limit]]
+
+    @staticmethod
+    def _company(row: sqlite3.Row) -> Dict:
+        """Shape a row like a company of the OpenCorporates API."""
+        return {
+            "name": row['name'],
+            "company_number": row['company_number'],
+            "jurisdiction_code": row['jurisdiction_code'],
+            "company_type": row['company_type'],
+            "current_status": row['current_status'],
+            "inactive": bool(row['inactive']),
+            "incorporation_date": row['incorporation_date'],
+            "dissolution_date": row['dissolution_date'],
+            "registered_address_in_full": row['registered_address'],
+            "previous_names": [{"company_name": previous} for previous in json.loads(row['previous_names'] or '[]')],
+            "registry_url": row['registry_url'],
+            "opencorporates_url": f"https://opencorporates.com/companies/{row['jurisdiction_code']}/{row['company_number']}",
+            "source": {"publisher": "Local registry mirror", "url": row['registry_url'], "file": row['source_file']},
+        }
+
+
+def search_registry_mirror(mirror: RegistryMirror, name: str, jurisdiction_code: Optional[str] = None,
+                           country_code: Optional[str] = None) -> Optional[Dict]:
+    """
+    Search the mirror like the OpenCorporates companies/search API.
+
+    Args:
+        mirror: The registry mirror
+        name: The company name
+        jurisdiction_code: OpenCorporates jurisdiction code to search in
+        country_code: ISO alpha-2 code to search in
+
+    Returns:
+        The search response, or None if the mirror found nothing and does not
+        cover the jurisdiction, so its answer is not authoritative
+    """
+    companies = mirror.search(name, jurisdiction_code, country_code)
+    if not companies and not mirror.covers(jurisdiction_code, country_code):
+        return None
+    return {"results": {"companies": [{"company": company} for company in companies],
+                        "total_count": len(companies)}}
+
+
+def get_registry_mirror(mirror_file: str) -> Optional[RegistryMirror]:
+    """
+    Get the process-wide registry mirror.
+
+    Args:
+        mirror_file: Path of the mirror database
+
+    Returns:
+        The mirror, or None if nothing has been imported into it yet
+    """
+    global _mirror
+
+    if _mirror is None or _mirror.mirror_file != mirror_file:
+        if not os.path.isfile(mirror_file):
+            return None
+        with _mirror_lock:
+            if _mirror is None or _mirror.mirror_file != mirror_file:
+                _mirror = RegistryMirror(mirror_file)
+    return _mirror
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        data_folder = sys.argv[1]
+        database_file = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_folder, 'registry_mirror.db')
+    else:
+        from dags.config.settings import REGISTRY_DATA_FOLDER, REGISTRY_MIRROR_FILE
+        data_folder, database_file = REGISTRY_DATA_FOLDER, REGISTRY_MIRROR_FILE
+    print(RegistryMirror(database_file).import_folder(data_folder))
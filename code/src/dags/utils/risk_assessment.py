@@ -4,6 +4,8 @@ import logging
 import re
 from datetime import datetime
 from dags.utils.gemini_util import create_genai_model
+from dags.utils.jurisdiction import jurisdiction_risk_features
+from dags.utils.evidence_compaction import compact_evidence, model_token_counter
 
 from config.settings import (
     RESULTS_FOLDER
@@ -68,7 +70,13 @@ def generate_risk_assessment(transaction_data=None, transaction_id=None, transac
             "extracted_entities": entities,
             "organizations": {},
             "people": {},
-            "wikidata_people": {}
+            "wikidata_people": {},
+            # Resolved countries of all jurisdictions mentioned, flagging offshore financial centres
+            "jurisdictions": jurisdiction_risk_features(
+                list(entities.get("jurisdictions") or [])
+                + [org.get("jurisdiction") for org in entities.get("organizations") or []]
+                + [person.get("country") for person in entities.get("people") or []]
+            ) if entities else []
         }
         
         # Add organization results
@@ -128,10 +136,32 @@ def generate_risk_assessment(transaction_data=None, transaction_id=None, transac
         elif all_results and 'discovered_people' in all_results:
             assessment_data["wikidata_people"] = all_results['discovered_people']
         
+        # Add the adverse media articles the news results of all entities refer to
+        if all_results and 'news_articles' in all_results:
+            assessment_data["news_articles"] = all_results['news_articles']
+        else:
+            assessment_data["news_articles"] = load_transaction_data(
+                RESULTS_FOLDER, transaction_id, "news_articles.json"
+            ) or {}
+        
+        # Add the sanctions and PEP hits of the multi-hop officer network, with their paths
+        network = (all_results or {}).get('network_expansion')
+        if network:
+            assessment_data["network_expansion"] = {
+                "entities": len(network.get("nodes", [])),
+                "hops": network.get("hops"),
+                "truncated": network.get("truncated"),
+                "hits": network.get("hits", []),
+            }
+        
         # Save the raw data for debugging and auditing
         save_transaction_data(RESULTS_FOLDER, transaction_id, "raw_assessment_data.json", assessment_data)
         logger.info(f"Saved raw assessment data to transaction folder")
         
+        # Keep only the evidence the analysis uses, within the token budget
+        evidence, evidence_tokens = compact_evidence(assessment_data, count_tokens=model_token_counter(model))
+        logger.info(f"Risk assessment evidence is {evidence_tokens} tokens")
+        
         # Create a prompt for risk assessment
         prompt = f"""
         You are a financial crime expert specialized in Anti-Money Laundering (AML) risk assessment. Analyze the following transaction data through these specific lenses:
@@ -140,7 +170,7 @@ def generate_risk_assessment(transaction_data=None, transaction_id=None, transac
         {transaction_text}
 
         EXTRACTED ENTITIES AND VERIFICATION RESULTS:
-        {json.dumps(assessment_data, indent=2)}
+        {evidence}
 
         Mandatory Analysis Framework:
 
@@ -0,0 +1,268 @@
+"""
+Re-screening of historical entities when the sanctions lists change.
+
+Every run compares the local OpenSanctions exports (see
+dags.utils.sanctions_store) with the list state of the previous run, entity by
+entity. Only the entries that were added or whose names, schema or other
+properties changed are matched against the Organization and Person nodes
+already stored in Neo4j:
+
+    1. each changed entry's names are looked up in the Neo4j full-text index
+       over the entities' normalized name keys
+    2. the candidates found are scored against an in-memory name index of the
+       changed entries only, with the same similarity as regular screening
+    3. matches are linked to a SanctionedEntity node and the transactions the
+       matched entities were involved in are flagged for review
+
+The cost of a run therefore grows with the size of the list delta, not with
+the number of transactions screened so far.
+"""
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dags.utils.name_index import NameIndex
+from dags.utils.name_normalization import name_tokens
+from dags.utils.sanctions_store import (
+    MATCHABLE_SCHEMAS, sanctions_export_files, sanctions_data_fingerprint,
+    sanctions_dataset_version, load_sanctions_records, sanctions_record_names
+)
+
+logger = logging.getLogger(__name__)
+
+# File in the re-screening folder keeping the list state of the last run
+RESCREEN_STATE_FILE = 'sanctions_state.json'
+
+# Fields of a list entry that do not affect matching and change on every export
+VOLATILE_FIELDS = ('first_seen', 'last_seen')
+
+# Neo4j labels and the sanctions schemas their nodes can match
+LABEL_SCHEMAS = {
+    'Organization': MATCHABLE_SCHEMAS['Organization'],
+    'Person': MATCHABLE_SCHEMAS['Person'],
+}
+
+# Number of name queries sent to Neo4j in one request
+NEO4J_QUERY_BATCH = 500
+
+# Maximum number of entities the full-text index returns per name
+CANDIDATES_PER_NAME = 25
+
+# Tokens at least this long are searched with an edit distance of one
+FUZZY_MIN_TOKEN_LENGTH = 5
+
+
+def sanctions_entity_digests(records: List[Dict]) -> Dict[str, str]:
+    """
+    Get a digest of every list entry that changes whenever the entry changes.
+
+    Args:
+        records: Entries as returned by load_sanctions_records
+
+    Returns:
+        Dictionary mapping entry ids to digests
+    """
+    digests = {}
+    for record in records:
+        stable = {key: value for key, value in record.items() if key not in VOLATILE_FIELDS}
+        encoded = json.dumps(stable, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        digests[record['id']] = hashlib.sha1(encoded).hexdigest()[:16]
+    return digests
+
+
+def read_rescreen_state(state_file: str) -> Optional[Dict]:
+    """
+    Read the list state of the last re-screening run.
+
+    Args:
+        state_file: Path of the state file
+
+    Returns:
+        The state, or None if there was no previous run
+    """
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_rescreen_state(state_file: str, state: Dict) -> None:
+    """
+    Atomically replace the list state of the last re-screening run.
+
+    Args:
+        state_file: Path of the state file
+        state: The new state
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    temp_file = f"{state_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(temp_file, state_file)
+
+
+def name_search_query(name: str) -> Optional[str]:
+    """
+    Build the full-text query finding entities whose name keys share tokens with a name.
+
+    Args:
+        name: A name of a list entry
+
+    Returns:
+        The Lucene query, or None if the name has no searchable tokens
+    """
+    terms = [
+        f"{token}~1" if len(token) >= FUZZY_MIN_TOKEN_LENGTH else token
+        for token in dict.fromkeys(name_tokens(name))
+        if len(token) > 1
+    ]
+    return ' OR '.join(terms) or None
+
+
+def find_rescreening_matches(delta_records: List[Dict], neo4j_manager, threshold: float,
+                             top_k: int = 5) -> List[Dict]:
+    """
+    Match changed list entries against the entities stored in Neo4j.
+
+    Args:
+        delta_records: The added and changed list entries
+        neo4j_manager: A connected Neo4jManager
+        threshold: Minimum similarity score between 0 and 1
+        top_k: Maximum number of list entries matched per entity
+
+    Returns:
+        List of matches with the entity's element 'id', 'label' and 'name' and
+        the list entry's 'entity_id', 'caption', 'schema', 'datasets', 'score'
+        and 'matched_name'
+    """
+    if not delta_records:
+        return []
+
+    queries = list(dict.fromkeys(
+        query
+        for record in delta_records
+        for query in map(name_search_query, sanctions_record_names(record))
+        if query
+    ))
+    candidates = {}
+    for start in range(0, len(queries), NEO4J_QUERY_BATCH):
+        for node in neo4j_manager.search_entities_by_name(queries[start:start + NEO4J_QUERY_BATCH], CANDIDATES_PER_NAME):
+            candidates[node['id']] = node
+
+    delta_index = NameIndex(delta_records, sanctions_record_names)
+    matches = []
+    for node in candidates.values():
+        allowed = LABEL_SCHEMAS.get(node['label'], set())
+        entries = [entry for entry in delta_index.search(node['name'] or '', threshold, top_k * 4)
+                   if entry.get('schema') in allowed]
+        for entry in entries[:top_k]:
+            matches.append({
+                "id": node['id'],
+                "label": node['label'],
+                "name": node['name'],
+                "entity_id": entry['id'],
+                "caption": entry['caption'],
+                "schema": entry['schema'],
+                "datasets": entry.get('datasets') or [],
+                "score": entry['match_score'],
+                "matched_name": entry['matched_name'],
+            })
+
+    logger.info(f"Matched {len(delta_records)} changed list entries against {len(candidates)} "
+                f"candidate entities from {len(queries)} name queries: {len(matches)} matches")
+    return matches
+
+
+def _delta_records(records: List[Dict], digests: Dict[str, str],
+                   previous_digests: Dict[str, str]) -> Tuple[List[Dict], int]:
+    """Select the entries that are new or changed, and count the removed ones."""
+    delta = [record for record in records if previous_digests.get(record['id']) != digests[record['id']]]
+    removed = sum(1 for entity_id in previous_digests if entity_id not in digests)
+    return delta, removed
+
+
+def rescreen_sanctions_delta(sanctions_data_folder: str, rescreen_folder: str, threshold: float,
+                             neo4j_manager=None, full: bool = False) -> Dict:
+    """
+    Re-screen the stored entities against the list entries changed since the last run.
+
+    The first run only records the list state, since the stored entities were
+    screened against the lists when their transactions were processed, unless
+    a full re-screening is requested.
+
+    Args:
+        sanctions_data_folder: Folder holding the OpenSanctions exports
+        rescreen_folder: Folder for the list state and the re-screening reports
+        threshold: Minimum similarity score between 0 and 1
+        neo4j_manager: Neo4jManager to use, a new connection by default
+        full: Match all list entries instead of the changed ones only
+
+    Returns:
+        Dictionary with the status and a summary of the run
+    """
+    try:
+        export_files = sanctions_export_files(sanctions_data_folder)
+        if not export_files:
+            return {"status": "skipped", "reason": f"No sanctions exports in {sanctions_data_folder}", "data": None}
+
+        state_file = os.path.join(rescreen_folder, RESCREEN_STATE_FILE)
+        state = read_rescreen_state(state_file)
+        fingerprint = sanctions_data_fingerprint(export_files)
+        version = sanctions_dataset_version(export_files)
+        if state and state.get("fingerprint") == fingerprint and not full:
+            return {"status": "success", "data": {"mode": "unchanged", "version": version}}
+
+        records = load_sanctions_records(export_files)
+        digests = sanctions_entity_digests(records)
+        new_state = {
+            "version": version,
+            "fingerprint": fingerprint,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "entities": digests,
+        }
+
+        if state is None and not full:
+            write_rescreen_state(state_file, new_state)
+            logger.info(f"Recorded baseline of {len(records)} sanctions entries for version {version}")
+            return {"status": "success", "data": {"mode": "baseline", "version": version, "entries": len(records)}}
+
+        previous_digests = {} if full else state.get("entities", {})
+        delta, removed = _delta_records(records, digests, previous_digests)
+
+        if neo4j_manager is None:
+            from dags.utils.neo4j_utils import Neo4jManager
+            with Neo4jManager() as manager:
+                matches = find_rescreening_matches(delta, manager, threshold)
+                transaction_ids = manager.flag_sanctions_matches(matches, version)
+        else:
+            matches = find_rescreening_matches(delta, neo4j_manager, threshold)
+            transaction_ids = neo4j_manager.flag_sanctions_matches(matches, version)
+
+        summary = {
+            "mode": "full" if full else "delta",
+            "version": version,
+            "previous_version": (state or {}).get("version"),
+            "entries": len(records),
+            "changed_entries": len(delta),
+            "removed_entries": removed,
+            "matches": len(matches),
+            "flagged_transactions": len(transaction_ids),
+        }
+        report_file = os.path.join(rescreen_folder, f"rescreen_{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}.json")
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump({**summary, "matched_entities": matches, "transaction_ids": transaction_ids}, f, indent=2)
+
+        # Only advance the state once the matches are stored, so a failed run is repeated
+        write_rescreen_state(state_file, new_state)
+
+        logger.info(f"Re-screened {len(delta)} changed sanctions entries of version {version}: "
+                    f"{len(matches)} matches, {len(transaction_ids)} transactions flagged")
+        return {"status": "success", "data": {**summary, "report_file": report_file}}
+
+    except Exception as e:
+        logger.error(f"Error re-screening sanctions delta: {str(e)}")
+        return {"status": "failed", "reason": f"Error re-screening sanctions delta: {str(e)}", "data": None}
@@ -0,0 +1,347 @@
+"""
+Local sanctions screening over OpenSanctions bulk exports.
+
+OpenSanctions / FollowTheMoney exports dropped into the sanctions data folder
+are compiled into a memory-mapped name index (see dags.utils.name_index), so
+entities can be screened without a network round trip or API quota. Both
+export formats of data.opensanctions.org are understood:
+
+    *.csv                      the "targets.simple.csv" export
+    *.json, *.jsonl, *.ftm.json line-delimited FollowTheMoney entities, e.g.
+                               "entities.ftm.json" or "targets.nested.json"
+
+Matches are returned in the shape of the OpenSanctions /match API results
+(id, caption, schema, properties, datasets, score, match), so the local store
+can stand in for the API, e.g. for offline load testing.
+
+The index is rebuilt automatically whenever a file in the folder is added,
+replaced or removed. It can also be built ahead of time:
+
+    python -m dags.utils.sanctions_store [sanctions_data_folder] [sanctions_index_file]
+"""
+import os
+import sys
+import csv
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from dags.utils.name_index import (
+    CompiledNameIndex, LayeredNameIndex, write_compiled_index, read_compiled_index_fingerprint, index_lock
+)
+
+logger = logging.getLogger(__name__)
+
+# Default file name of the compiled index inside the sanctions data folder
+SANCTIONS_INDEX_NAME = 'sanctions.idx'
+
+# Schemas of the entities that can be screened; sanctions, addresses and the
+# other FollowTheMoney helper entities of a full export are skipped
+SCREENABLE_SCHEMAS = {
+    'Person', 'Company', 'Organization', 'LegalEntity', 'PublicBody', 'Vessel', 'Airplane'
+}
+
+# Candidate schemas that can match a query schema, as in the OpenSanctions matcher
+MATCHABLE_SCHEMAS = {
+    'Person': {'Person', 'LegalEntity'},
+    'Company': {'Company', 'Organization', 'LegalEntity'},
+    'Organization': {'Organization', 'Company', 'PublicBody', 'LegalEntity'},
+    'LegalEntity': {'LegalEntity', 'Person', 'Company', 'Organization', 'PublicBody'},
+}
+
+# Name properties of an entity that are matched against
+NAME_PROPERTIES = ('name', 'alias', 'previousName')
+
+# Columns of targets.simple.csv and the FollowTheMoney properties they hold
+_SIMPLE_CSV_PROPERTIES = {
+    'aliases': 'alias',
+    'birth_date': 'birthDate',
+    'countries': 'country',
+    'addresses': 'address',
+    'identifiers': 'idNumber',
+    'phones': 'phone',
+    'emails': 'email',
+}
+
+# Process-wide cache of opened sanctions indexes, keyed by the data folder they were built from
+_index_cache: Dict[str, LayeredNameIndex] = {}
+_index_lock = threading.Lock()
+
+
+def default_sanctions_index_file(sanctions_data_folder: str) -> str:
+    """
+    Get the default location of the compiled index for a sanctions data folder.
+
+    Args:
+        sanctions_data_folder: Folder holding the OpenSanctions exports
+
+    Returns:
+        Path of the compiled index file
+    """
+    return os.path.join(sanctions_data_folder, SANCTIONS_INDEX_NAME)
+
+
+def sanctions_export_files(sanctions_data_folder: str) -> List[str]:
+    """
+    List the export files in the sanctions data folder.
+
+    Args:
+        sanctions_data_folder: Folder holding the OpenSanctions exports
+
+    Returns:
+        Sorted paths of the CSV and JSON export files
+    """
+    if not os.path.isdir(sanctions_data_folder):
+        return []
+    return sorted(
+        os.path.join(sanctions_data_folder, file_name)
+        for file_name in os.listdir(sanctions_data_folder)
+        if file_name.endswith(('.csv', '.json', '.jsonl'))
+        and os.path.isfile(os.path.join(sanctions_data_folder, file_name))
+    )
+
+
+def sanctions_data_fingerprint(export_files: Sequence[str]) -> str:
+    """
+    Get a cheap fingerprint that changes whenever an export file is added, replaced or removed.
+
+    Args:
+        export_files: Paths of the export files
+
+    Returns:
+        Fingerprint of the export files
+    """
+    digest = hashlib.sha1()
+    for export_file in export_files:
+        stat = os.stat(export_file)
+        digest.update(f"{os.path.basename(export_file)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+    return f"{len(export_files)}:{digest.hexdigest()[:16]}"
+
+
+def _split(value: Optional[str]) -> List[str]:
+    """Split a ';'-separated column of targets.simple.csv into its values."""
+    return [part.strip() for part in (value or '').split(';') if part.strip()]
+
+
+def _entity_from_simple_row(row: Dict) -> Dict:
+    """Convert a row of targets.simple.csv to a FollowTheMoney-style entity."""
+    properties = {'name': [row['name']]} if row.get('name') else {}
+    for column, prop in _SIMPLE_CSV_PROPERTIES.items():
+        values = _split(row.get(column))
+        if values:
+            properties[prop] = values
+    return {
+        'id': row.get('id'),
+        'caption': row.get('name') or row.get('id'),
+        'schema': row.get('schema') or 'LegalEntity',
+        'properties': properties,
+        'datasets': _split(row.get('dataset')),
+        'first_seen': row.get('first_seen') or None,
+        'last_seen': row.get('last_seen') or None,
+    }
+
+
+def _entity_from_ftm(entity: Dict) -> Dict:
+    """Keep the fields of a FollowTheMoney entity that are returned with a match."""
+    properties = entity.get('properties') or {}
+    names = properties.get('name') or []
+    return {
+        'id': entity.get('id'),
+        'caption': entity.get('caption') or (names[0] if names else entity.get('id')),
+        'schema': entity.get('schema'),
+        # Nested exports inline related entities, which are not needed for matching
+        'properties': {
+            prop: [value for value in values if isinstance(value, str)]
+            for prop, values in properties.items()
+            if isinstance(values, list) and any(isinstance(value, str) for value in values)
+        },
+        'datasets': entity.get('datasets') or [],
+        'first_seen': entity.get('first_seen'),
+        'last_seen': entity.get('last_seen'),
+    }
+
+
+def _read_export_file(export_file: str) -> Iterator[Dict]:
+    """Read the entities of one export file."""
+    if export_file.endswith('.csv'):
+        with open(export_file, 'r', encoding='utf-8') as csv_file:
+            for row in csv.DictReader(csv_file):
+                yield _entity_from_simple_row(row)
+        return
+
+    with open(export_file, 'r', encoding='utf-8') as json_file:
+        for line_number, line in enumerate(json_file, 1):
+            if not line.strip():
+                continue
+            try:
+                entity = json.loads(line)
+            except ValueError:
+                # e.g. a pretty-printed index.json downloaded next to the export
+                logger.warning(f"Skipping {export_file}: line {line_number} is not a FollowTheMoney entity")
+                return
+            if isinstance(entity, dict) and entity.get('id') and entity.get('schema'):
+                yield _entity_from_ftm(entity)
+
+
+def load_sanctions_records(export_files: Sequence[str]) -> List[Dict]:
+    """
+    Read the screenable entities of all export files.
+
+    Entities appearing in several exports are kept once, as first seen.
+
+    Args:
+        export_files: Paths of the export files
+
+    Returns:
+        List of entities in the OpenSanctions result shape, without scores
+    """
+    records = {}
+    for export_file in export_files:
+        for entity in _read_export_file(export_file):
+            if entity['schema'] in SCREENABLE_SCHEMAS and entity['id'] not in records:
+                records[entity['id']] = entity
+    return list(records.values())
+
+
+def sanctions_record_names(record: Dict) -> Iterable[str]:
+    """
+    Get the names and aliases of a sanctions entity.
+
+    Args:
+        record: An entity as returned by load_sanctions_records
+
+    Returns:
+        List of names for the entity
+    """
+    properties = record.get('properties') or {}
+    names = [name for prop in NAME_PROPERTIES for name in properties.get(prop, [])]
+    return names or [record.get('caption') or '']
+
+
+def sanctions_dataset_version(export_files: Sequence[str]) -> str:
+    """
+    Derive the dataset version from the modification time of the newest export.
+
+    Args:
+        export_files: Paths of the export files
+
+    Returns:
+        The dataset version
+    """
+    modified = max(os.stat(export_file).st_mtime for export_file in export_files)
+    return f"local-{datetime.fromtimestamp(modified, tz=timezone.utc).strftime('%Y%m%d%H%M%S')}"
+
+
+def build_sanctions_index(sanctions_data_folder: str, sanctions_index_file: Optional[str] = None) -> str:
+    """
+    Compile all exports in the sanctions data folder into an index.
+
+    Args:
+        sanctions_data_folder: Folder holding the OpenSanctions exports
+        sanctions_index_file: Path of the compiled index, defaults to sanctions.idx in the folder
+
+    Returns:
+        Path of the compiled index file
+    """
+    sanctions_index_file = sanctions_index_file or default_sanctions_index_file(sanctions_data_folder)
+    export_files = sanctions_export_files(sanctions_data_folder)
+    if not export_files:
+        raise FileNotFoundError(f"No OpenSanctions exports found in {sanctions_data_folder}")
+
+    logger.info(f"Compiling sanctions index {sanctions_index_file} from {len(export_files)} exports")
+    write_compiled_index(
+        sanctions_index_file, load_sanctions_records(export_files), sanctions_record_names,
+        sanctions_data_fingerprint(export_files)
+    )
+    return sanctions_index_file
+
+
+def get_sanctions_index(sanctions_data_folder: str, sanctions_index_file: Optional[str] = None) -> LayeredNameIndex:
+    """
+    Get the memory-mapped sanctions index for a data folder, compiling it if needed.
+
+    A file lock ensures only one worker on the node compiles the index while
+    the others wait and then reuse the result.
+
+    Args:
+        sanctions_data_folder: Folder holding the OpenSanctions exports
+        sanctions_index_file: Path of the compiled index, defaults to sanctions.idx in the folder
+
+    Returns:
+        The name index over all sanctioned entities, with the dataset version in its 'version' attribute
+    """
+    sanctions_index_file = sanctions_index_file or default_sanctions_index_file(sanctions_data_folder)
+    export_files = sanctions_export_files(sanctions_data_folder)
+    if not export_files:
+        raise FileNotFoundError(f"No OpenSanctions exports found in {sanctions_data_folder}")
+    fingerprint = sanctions_data_fingerprint(export_files)
+
+    index = _index_cache.get(sanctions_data_folder)
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+
+    with _index_lock:
+        index = _index_cache.get(sanctions_data_folder)
+        if index is not None and index.fingerprint == fingerprint:
+            return index
+
+        if read_compiled_index_fingerprint(sanctions_index_file) != fingerprint:
+            with index_lock(sanctions_index_file):
+                if read_compiled_index_fingerprint(sanctions_index_file) != fingerprint:
+                    build_sanctions_index(sanctions_data_folder, sanctions_index_file)
+
+        index = LayeredNameIndex(
+            CompiledNameIndex(sanctions_index_file),
+            fingerprint=fingerprint, version=sanctions_dataset_version(export_files),
+        )
+        _index_cache[sanctions_data_folder] = index
+        return index
+
+
+def match_sanctions(index: LayeredNameIndex, queries: Iterable[Tuple[str, str]],
+                    threshold: float, top_k: int) -> Dict[Tuple[str, str], List[Dict]]:
+    """
+    Screen many entities against a local sanctions index.
+
+    Args:
+        index: The index returned by get_sanctions_index
+        queries: (schema, name) pairs, the schema being e.g. 'Company' or 'Person'
+        threshold: Minimum similarity score between 0 and 1
+        top_k: Maximum number of matches per entity
+
+    Returns:
+        Dictionary mapping every (schema, name) pair to its matches, best first,
+        in the shape of the OpenSanctions /match API results
+    """
+    queries = list(dict.fromkeys(queries))
+    names = list(dict.fromkeys(name for _, name in queries))
+    # Candidates of other schemas are dropped afterwards, so search a little deeper
+    matches_by_name = index.search_batch(names, threshold, top_k * 4)
+
+    results = {}
+    for schema, name in queries:
+        allowed = MATCHABLE_SCHEMAS.get(schema, {schema})
+        results[(schema, name)] = [
+            {
+                **{key: value for key, value in match.items() if key not in ('match_score', 'matched_name')},
+                'score': match['match_score'],
+                'match': True,
+            }
+            for match in matches_by_name[name]
+            if match.get('schema') in allowed
+        ][:top_k]
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1:
+        data_folder = sys.argv[1]
+        index_file = sys.argv[2] if len(sys.argv) > 2 else None
+    else:
+        from dags.config.settings import SANCTION_DATA_FOLDER, SANCTIONS_INDEX_FILE
+        data_folder, index_file = SANCTION_DATA_FOLDER, SANCTIONS_INDEX_FILE
+    print(build_sanctions_index(data_folder, index_file))
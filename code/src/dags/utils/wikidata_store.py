@@ -0,0 +1,455 @@
+"""
+Offline subset of Wikidata for organization lookups.
+
+A Wikidata truthy dump (latest-truthy.nt.gz or .bz2, N-Triples) is filtered
+down to what query_wikidata uses and written to a SQLite database:
+
+    organizations   items that are instances of a common organization class
+                    or have a legal form, founder, CEO or board member
+    claims          their country (P17), legal form (P1454), founders (P112),
+                    CEO (P169), inception (P571), website (P856) and board
+                    members (P3320)
+    entities        the English label of every organization and claim value,
+                    and whether it is a human (P31 = Q5)
+    names           English labels and aliases of the organizations, with an
+                    FTS5 index over their normalized form
+
+Lookups return the shape of the SPARQL lookups of data_enrichment, so
+enrichment can resolve organizations and their people without the public
+query service. The dump is read in a single pass: every label, type and claim
+of interest goes into staging tables first, which are pruned to the
+organizations and the entities they reference once the dump is read. The
+store is built next to its final path and replaces it atomically:
+
+    python -m dags.utils.wikidata_store dump_file [wikidata_store_file]
+"""
+import os
+import re
+import bz2
+import sys
+import gzip
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dags.utils.name_normalization import entity_name_key, name_tokens, normalize_name
+
+logger = logging.getLogger(__name__)
+
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/Q'
+DIRECT_CLAIM_PREFIX = 'http://www.wikidata.org/prop/direct/'
+LABEL_PREDICATE = 'http://www.w3.org/2000/01/rdf-schema#label'
+ALIAS_PREDICATE = 'http://www.w3.org/2004/02/skos/core#altLabel'
+
+# Properties kept for organizations, with the labels the SPARQL label service gives them
+PROPERTY_LABELS = {
+    'P17': 'country',
+    'P1454': 'legal form',
+    'P112': 'founded by',
+    'P169': 'chief executive officer',
+    'P571': 'inception',
+    'P856': 'official website',
+    'P3320': 'board member',
+}
+
+# Properties whose human values are the associated people of an organization
+PEOPLE_PROPERTIES = ('P169', 'P112', 'P3320')
+
+# Properties that mark an item as an organization
+ORGANIZATION_PROPERTIES = ('P1454', 'P112', 'P169', 'P3320')
+
+# Classes (P31) that mark an item as an organization: organization, business,
+# company, enterprise, public company, privately held company, corporation,
+# holding company, bank, financial institution, conglomerate, nonprofit
+# organization, foundation, government agency and state-owned enterprise
+ORGANIZATION_CLASSES = (
+    43229, 4830453, 783794, 6881511, 891723, 1589009, 167037, 219577, 22687, 650241, 206361,
+    163740, 157031, 327333, 270791,
+)
+
+HUMAN_CLASS = 5
+
+# Full-text hits re-ranked per lookup
+SEARCH_CANDIDATES = 20
+
+# Minimum share of a full-text hit's name tokens found in the queried name, so
+# "Russia" does not resolve to "Sberbank of Russia"
+MIN_TOKEN_OVERLAP = 0.5
+
+# Associated people returned per organization, as in the SPARQL lookups
+MAX_ASSOCIATED_PEOPLE = 10
+
+# Staging rows written per transaction during a build
+BUILD_BATCH_SIZE = 50000
+
+_TRIPLE_RE = re.compile(r'<([^>]+)> <([^>]+)> (.+) \.\s*$')
+_LITERAL_RE = re.compile(r'"((?:[^"\\]|\\.)*)"(?:@([\w-]+)|\^\^<[^>]+>)?$')
+_ESCAPE_RE = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+_ESCAPES = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _unescape(value: str) -> str:
+    """Decode the escape sequences of an N-Triples literal."""
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] in 'uU' and len(escape) > 1:
+            return chr(int(escape[1:], 16))
+        return _ESCAPES.get(escape, escape)
+    return _ESCAPE_RE.sub(replace, value) if '\\' in value else value
+
+
+def _qid(iri: str) -> Optional[int]:
+    """Get the numeric id of a Wikidata item IRI, or None for anything else."""
+    if iri.startswith(ENTITY_PREFIX) and iri[len(ENTITY_PREFIX):].isdigit():
+        return int(iri[len(ENTITY_PREFIX):])
+    return None
+
+
+def _open_dump(dump_file: str):
+    if dump_file.endswith('.bz2'):
+        return bz2.open(dump_file, 'rt', encoding='utf-8')
+    if dump_file.endswith('.gz'):
+        return gzip.open(dump_file, 'rt', encoding='utf-8')
+    return open(dump_file, 'r', encoding='utf-8')
+
+
+def read_truthy_dump(lines: Iterable[str]) -> Iterator[Tuple[str, int, str, Optional[int], Optional[str]]]:
+    """
+    Read the triples of interest of a truthy dump.
+
+    Args:
+        lines: Lines of the N-Triples dump
+
+    Returns:
+        Iterator of ('label' | 'alias' | 'type' | 'claim', item id, property,
+        value item id, literal value) tuples
+    """
+    for line in lines:
+        # Cheap checks first: the dump has billions of triples, most of them irrelevant
+        if DIRECT_CLAIM_PREFIX in line:
+            if '/P31> ' not in line and not any(f'/{prop}> ' in line for prop in PROPERTY_LABELS):
+                continue
+        elif not line.rstrip().endswith('@en .'):
+            continue
+
+        match = _TRIPLE_RE.match(line)
+        if not match:
+            continue
+        subject, predicate, obj = match.groups()
+        item_id = _qid(subject)
+        if item_id is None:
+            continue
+
+        if predicate in (LABEL_PREDICATE, ALIAS_PREDICATE):
+            literal = _LITERAL_RE.match(obj)
+            if literal and literal.group(2) == 'en':
+                yield ('label' if predicate == LABEL_PREDICATE else 'alias', item_id, '', None,
+                       _unescape(literal.group(1)))
+            continue
+
+        prop = predicate[len(DIRECT_CLAIM_PREFIX):]
+        if obj.startswith('<'):
+            value_id, value = _qid(obj[1:-1]), obj[1:-1]
+        else:
+            literal = _LITERAL_RE.match(obj)
+            value_id, value = None, _unescape(literal.group(1)) if literal else obj
+        if prop == 'P31':
+            if value_id == HUMAN_CLASS or value_id in ORGANIZATION_CLASSES:
+                yield ('type', item_id, prop, value_id, None)
+        elif prop in PROPERTY_LABELS:
+            yield ('claim', item_id, prop, value_id, None if value_id is not None else value)
+
+
+def build_wikidata_store(dump_file: str, store_file: str) -> str:
+    """
+    Build the Wikidata subset store from a truthy dump.
+
+    Args:
+        dump_file: Path of the N-Triples dump, plain, gzipped or bzip2-compressed
+        store_file: Path of the store
+
+    Returns:
+        Path of the store
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(store_file)), exist_ok=True)
+    temp_file = f"{store_file}.{os.getpid()}.tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+
+    connection = sqlite3.connect(temp_file)
+    connection.execute("PRAGMA journal_mode=OFF")
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute("CREATE TABLE staging_names (id INTEGER NOT NULL, is_label INTEGER NOT NULL, name TEXT NOT NULL)")
+    connection.execute("CREATE TABLE staging_types (id INTEGER NOT NULL, class_id INTEGER NOT NULL)")
+    connection.execute("CREATE TABLE staging_claims (id INTEGER NOT NULL, property TEXT NOT NULL, value_id INTEGER, value TEXT)")
+
+    batches = {'names': [], 'types': [], 'claims': []}
+
+    def flush():
+        with connection:
+            connection.executemany("INSERT INTO staging_names VALUES (?, ?, ?)", batches['names'])
+            connection.executemany("INSERT INTO staging_types VALUES (?, ?)", batches['types'])
+            connection.executemany("INSERT INTO staging_claims VALUES (?, ?, ?, ?)", batches['claims'])
+        for batch in batches.values():
+            batch.clear()
+
+    logger.info(f"Reading Wikidata dump {dump_file}")
+    with _open_dump(dump_file) as lines:
+        for count, (kind, item_id, prop, value_id, value) in enumerate(read_truthy_dump(lines), 1):
+            if kind in ('label', 'alias'):
+                batches['names'].append((item_id, int(kind == 'label'), value))
+            elif kind == 'type':
+                batches['types'].append((item_id, value_id))
+            else:
+                batches['claims'].append((item_id, prop, value_id, value))
+            if count % BUILD_BATCH_SIZE == 0:
+                flush()
+    flush()
+
+    logger.info("Pruning the staged triples to organizations and the entities they reference")
+    organization_classes = ','.join(str(class_id) for class_id in ORGANIZATION_CLASSES)
+    organization_properties = ','.join(f"'{prop}'" for prop in ORGANIZATION_PROPERTIES)
+    with connection:
+        connection.executescript(f"""
+            CREATE TABLE organizations (id INTEGER PRIMARY KEY);
+            INSERT OR IGNORE INTO organizations
+                SELECT id FROM staging_types WHERE class_id IN ({organization_classes})
+                UNION SELECT id FROM staging_claims WHERE property IN ({organization_properties});
+
+            CREATE TABLE claims (entity_id INTEGER NOT NULL, property TEXT NOT NULL, value_id INTEGER, value TEXT);
+            INSERT INTO claims SELECT id, property, value_id, value FROM staging_claims
+                WHERE id IN (SELECT id FROM organizations);
+            CREATE INDEX claims_entity ON claims (entity_id);
+            CREATE INDEX claims_value ON claims (value_id);
+
+            CREATE TABLE entities (
+                id INTEGER PRIMARY KEY, label TEXT, is_human INTEGER NOT NULL DEFAULT 0,
+                is_organization INTEGER NOT NULL DEFAULT 0, claims INTEGER NOT NULL DEFAULT 0);
+            INSERT OR IGNORE INTO entities (id) SELECT id FROM organizations
+                UNION SELECT value_id FROM claims WHERE value_id IS NOT NULL;
+            CREATE INDEX staging_names_id ON staging_names (id);
+            UPDATE entities SET label = (
+                SELECT name FROM staging_names WHERE staging_names.id = entities.id AND is_label = 1 LIMIT 1);
+            UPDATE entities SET is_human = 1 WHERE id IN (SELECT id FROM staging_types WHERE class_id = {HUMAN_CLASS});
+            UPDATE entities SET is_organization = 1 WHERE id IN (SELECT id FROM organizations);
+            UPDATE entities SET claims = (SELECT COUNT(*) FROM claims WHERE claims.entity_id = entities.id)
+                WHERE is_organization = 1;
+
+            CREATE TABLE names (entity_id INTEGER NOT NULL, name_key TEXT NOT NULL, search_name TEXT NOT NULL);
+        """)
+
+    names = connection.execute(
+        "SELECT id, name FROM staging_names WHERE id IN (SELECT id FROM organizations)"
+    )
+    insert = connection.cursor()
+    batch = []
+    for item_id, name in names:
+        batch.append((item_id, entity_name_key(name), normalize_name(name)))
+        if len(batch) >= BUILD_BATCH_SIZE:
+            insert.executemany("INSERT INTO names VALUES (?, ?, ?)", batch)
+            batch.clear()
+    insert.executemany("INSERT INTO names VALUES (?, ?, ?)", batch)
+    connection.commit()
+
+    with connection:
+        connection.executescript("""
+            CREATE INDEX names_key ON names (name_key);
+            CREATE VIRTUAL TABLE names_fts USING fts5(search_name, content='names', content_rowid='rowid');
+            INSERT INTO names_fts (names_fts) VALUES ('rebuild');
+            DROP TABLE staging_names;
+            DROP TABLE staging_types;
+            DROP TABLE staging_claims;
+            DROP TABLE organizations;
+        """)
+    organizations = connection.execute("SELECT COUNT(*) FROM entities WHERE is_organization = 1").fetchone()[0]
+    connection.execute("VACUUM")
+    connection.close()
+
+    os.replace(temp_file, store_file)
+    logger.info(f"Built Wikidata store {store_file} with {organizations} organizations")
+    return store_file
+
+
+class WikidataStore:
+    """
+    Read-only access to a Wikidata subset store.
+
+    Connections are opened per process and thread.
+    """
+
+    def __init__(self, store_file: str):
+        self.store_file = store_file
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get the connection of the current process and thread."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(f"file:{self.store_file}?mode=ro", uri=True)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def resolve(self, name: str) -> Optional[int]:
+        """
+        Find the organization best matching a name.
+
+        Organizations with a label or alias of the same sorted-token key come
+        first, then the full-text hits of all tokens whose names share enough
+        tokens with the query; ties are broken by the number of claims, a
+        proxy of how well known an organization is.
+
+        Args:
+            name: The organization name
+
+        Returns:
+            The numeric item id, or None if no organization matches
+        """
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT n.entity_id FROM names n JOIN entities e ON e.id = n.entity_id "
+            "WHERE n.name_key = ? ORDER BY e.claims DESC LIMIT 1", (entity_name_key(name),)
+        ).fetchone()
+        if row:
+            return row[0]
+
+        tokens = set(name_tokens(name))
+        if not tokens:
+            return None
+        rows = connection.execute(
+            "SELECT n.entity_id, n.search_name, e.claims FROM names_fts JOIN names n ON n.rowid = names_fts.rowid "
+            "JOIN entities e ON e.id = n.entity_id WHERE names_fts MATCH ? ORDER BY bm25(names_fts) LIMIT ?",
+            (' '.join(f'"{token}"' for token in tokens), SEARCH_CANDIDATES)
+        ).fetchall()
+        candidates = []
+        for item_id, search_name, claims in rows:
+            overlap = len(tokens) / max(len(set(search_name.split()) | tokens), 1)
+            if overlap >= MIN_TOKEN_OVERLAP:
+                candidates.append((overlap, claims, item_id))
+        return max(candidates)[2] if candidates else None
+
+    def has(self, item_id: int, organization: bool = False) -> bool:
+        """
+        Check whether the store holds an item.
+
+        The store holds every organization of the dump with its claims, and the
+        entities those claims reference, so the organizations of a person held
+        here are complete.
+
+        Args:
+            item_id: The numeric item id
+            organization: Whether the item must be an organization
+
+        Returns:
+            True if the store holds the item
+        """
+        return self._connection().execute(
+            "SELECT 1 FROM entities WHERE id = ?" + (" AND is_organization = 1" if organization else ""), (item_id,)
+        ).fetchone() is not None
+
+    def details(self, item_id: int) -> Dict:
+        """
+        Get the properties and associated people of an organization.
+
+        Args:
+            item_id: The numeric item id
+
+        Returns:
+            Dictionary with the 'properties' and the 'associated_people', as
+            the SPARQL detail queries of data_enrichment return them
+        """
+        rows = self._connection().execute(
+            "SELECT c.property, c.value_id, c.value, e.label, e.is_human FROM claims c "
+            "LEFT JOIN entities e ON e.id = c.value_id WHERE c.entity_id = ? ORDER BY c.rowid", (item_id,)
+        ).fetchall()
+
+        properties = {}
+        associated_people = []
+        for prop, value_id, value, label, is_human in rows:
+            value_label = label or (f"Q{value_id}" if value_id is not None else value) or "Unknown"
+            properties[PROPERTY_LABELS[prop]] = value_label
+            if prop in PEOPLE_PROPERTIES and is_human and len(associated_people) < MAX_ASSOCIATED_PEOPLE:
+                person = {"name": value_label, "role": PROPERTY_LABELS[prop], "source": "wikidata",
+                          "entity_id": f"Q{value_id}"}
+                if person not in associated_people:
+                    associated_people.append(person)
+        return {"properties": properties, "associated_people": associated_people}
+
+    def organizations_of_people(self, person_ids: Iterable[int]) -> Dict[int, List[Dict]]:
+        """
+        Get the organizations people founded, lead or sit on the board of.
+
+        Args:
+            person_ids: Numeric item ids of the people
+
+        Returns:
+            Dictionary mapping each person id to the organizations' 'entity_id',
+            'name' and the person's 'role'
+        """
+        person_ids = list(person_ids)
+        organizations = {person_id: [] for person_id in person_ids}
+        placeholders = ','.join('?' * len(person_ids))
+        people_properties = ','.join(f"'{prop}'" for prop in PEOPLE_PROPERTIES)
+        rows = self._connection().execute(
+            f"SELECT c.value_id, c.entity_id, e.label, c.property FROM claims c JOIN entities e ON e.id = c.entity_id "
+            f"WHERE c.value_id IN ({placeholders}) AND c.property IN ({people_properties}) "
+            f"ORDER BY e.claims DESC", person_ids
+        ).fetchall() if person_ids else []
+        for person_id, item_id, label, prop in rows:
+            organizations[person_id].append(
+                {"entity_id": f"Q{item_id}", "name": label or f"Q{item_id}", "role": PROPERTY_LABELS[prop]}
+            )
+        return organizations
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        """
+        Look up an organization and its associated people.
+
+        Args:
+            name: The organization name
+
+        Returns:
+            Dictionary with the 'entity_id', 'properties' and
+            'associated_people', or None if no organization matches
+        """
+        item_id = self.resolve(name)
+        if item_id is None:
+            return None
+        return {"entity_id": f"Q{item_id}", **self.details(item_id)}
+
+
+def get_wikidata_store(store_file: str) -> Optional[WikidataStore]:
+    """
+    Get the process-wide Wikidata store.
+
+    Args:
+        store_file: Path of the store
+
+    Returns:
+        The store, or None if it has not been built
+    """
+    global _store
+
+    if _store is None or _store.store_file != store_file:
+        if not os.path.isfile(store_file):
+            return None
+        with _store_lock:
+            if _store is None or _store.store_file != store_file:
+                _store = WikidataStore(store_file)
+    return _store
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python -m dags.utils.wikidata_store dump_file [wikidata_store_file]")
+    if len(sys.argv) > 2:
+        output_file = sys.argv[2]
+    else:
+        from dags.config.settings import WIKIDATA_STORE_FILE
+        output_file = WIKIDATA_STORE_FILE
+    print(build_wikidata_store(sys.argv[1], output_file))
@@ -2,15 +2,44 @@
 import pytest
 import json
 import os
+import sqlite3
+import sys
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import ModuleType, SimpleNamespace
 from unittest.mock import patch, MagicMock
 
 # Import the component being tested - adjust the import paths as needed
 try:
     from dags.utils.data_enrichment import (
         check_pep_list,
+        screen_pep_batch,
         check_sanctions,
+        check_sanctions_batch,
         get_open_corporates_data,
+        query_wikidata,
+        query_wikidata_batch,
+        check_adverse_news,
+        check_adverse_news_batch,
+        collect_news_articles,
+        wikidata_organization_people,
+        wikidata_person_organizations,
     )
+    from dags.utils.http_client import get_http_session
+    from dags.utils.enrichment_cache import SQLiteEnrichmentCache
+    from dags.utils.registry_mirror import RegistryMirror
+    from dags.utils.wikidata_store import WikidataStore, build_wikidata_store
+    from dags.utils.network_expansion import expand_network
+    from dags.utils.news_store import NewsStore
+    from dags.utils.adverse_media import score_articles
+    from dags.utils.concurrent_checks import run_checks
+    from dags.utils.evidence_compaction import compact_evidence
+    from dags.utils.rate_limiter import LocalRateLimiter, acquire, report_rate_limited
+    from dags.utils.sanctions_rescreening import rescreen_sanctions_delta
+    from dags.utils.jurisdiction import resolve_jurisdiction, jurisdiction_risk_features
 except ImportError:
     # Skip tests if imports fail
     raise ImportError(
@@ -28,6 +57,14 @@ def sample_transaction_id():
     return "TEST-UNIT-001"
 
 
+@pytest.fixture(autouse=True)
+def enrichment_cache(tmp_path):
+    """Give every test an empty enrichment cache."""
+    cache = SQLiteEnrichmentCache(str(tmp_path / "enrichment_cache.db"), max_entries=3)
+    with patch("dags.utils.data_enrichment.get_enrichment_cache", return_value=cache):
+        yield cache
+
+
 @pytest.fixture
 def mock_response():
     """Create a mock response for API calls."""
@@ -38,28 +75,31 @@ def mock_response():
     return mock
 
 
+@pytest.fixture
+def pep_data_file(tmp_path):
+    """Write a small PEP data file in the OpenSanctions CSV format."""
+    pep_file = tmp_path / "pep_data.csv"
+    pep_file.write_text(
+        "id,schema,name,aliases,countries\n"
+        f"Q1,Person,{SAMPLE_PEP},Viktor F. Yanukovych;Виктор Янукович,ua\n",
+        encoding="utf-8",
+    )
+    return str(pep_file)
+
+
 @pytest.mark.unit
 class TestPEPDetection:
     """Tests for PEP detection functionality."""
 
-    @patch("dags.utils.data_enrichment.open")
-    @patch("os.path.exists")
     def test_check_pep_list_positive(
-        self, mock_exists, mock_open, sample_transaction_id
+        self, pep_data_file, tmp_path, sample_transaction_id
     ):
         """Test PEP detection with a known PEP."""
         # Setup mocks
-        mock_exists.return_value = True
-        mock_file = MagicMock()
-        mock_file.__enter__.return_value = mock_file
-        mock_file.__iter__.return_value = [
-            "name\tposition\tcountry\talias\n",
-            f"{SAMPLE_PEP}\tFormer President\tUkraine\tViktor F. Yanukovych\n",
-        ]
-        mock_open.return_value = mock_file
-
-        # Execute
-        result = check_pep_list(SAMPLE_PEP, transaction_id=sample_transaction_id)
+        with patch("dags.utils.data_enrichment.PEP_DATA_FILE", pep_data_file), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            # Execute
+            result = check_pep_list(SAMPLE_PEP, transaction_id=sample_transaction_id)
 
         # Assert
         assert result["status"] == "success"
@@ -71,35 +111,46 @@ class TestPEPDetection:
                 break
         assert match, "PEP should be found in the results"
 
-    @patch("dags.utils.data_enrichment.open")
-    @patch("os.path.exists")
     def test_check_pep_list_negative(
-        self, mock_exists, mock_open, sample_transaction_id
+        self, pep_data_file, tmp_path, sample_transaction_id
     ):
         """Test PEP detection with a non-PEP."""
         # Setup mocks
-        mock_exists.return_value = True
-        mock_file = MagicMock()
-        mock_file.__enter__.return_value = mock_file
-        mock_file.__iter__.return_value = [
-            "name\tposition\tcountry\talias\n",
-            f"{SAMPLE_PEP}\tFormer President\tUkraine\tViktor F. Yanukovych\n",
-        ]
-        mock_open.return_value = mock_file
-
-        # Execute
-        result = check_pep_list("John Doe", transaction_id=sample_transaction_id)
+        with patch("dags.utils.data_enrichment.PEP_DATA_FILE", pep_data_file), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            # Execute
+            result = check_pep_list("John Doe", transaction_id=sample_transaction_id)
 
         # Assert
         assert result["status"] == "success"
         assert len(result["data"]) == 0
 
+    def test_screen_pep_batch(self, pep_data_file, tmp_path, sample_transaction_id):
+        """Test screening several people against the PEP list at once."""
+        with patch("dags.utils.data_enrichment.PEP_DATA_FILE", pep_data_file), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            results = screen_pep_batch(
+                [SAMPLE_PEP, "John Doe", SAMPLE_PEP, ""],
+                dag_run=MagicMock(conf={"transaction_id": sample_transaction_id}),
+            )
+
+        assert set(results) == {SAMPLE_PEP, "John Doe", ""}
+        assert results[SAMPLE_PEP]["status"] == "success"
+        assert results[SAMPLE_PEP]["data"][0]["name"] == SAMPLE_PEP
+        assert results["John Doe"]["status"] == "success"
+        assert results["John Doe"]["data"] == []
+        assert results["John Doe"]["dataset_version"] == results[SAMPLE_PEP]["dataset_version"]
+        assert results[""]["status"] == "failed"
+
+        dataset = json.loads((tmp_path / sample_transaction_id / "screening_datasets" / "pep.json").read_text())
+        assert dataset["version"] == results[SAMPLE_PEP]["dataset_version"]
+
 
 @pytest.mark.unit
 class TestSanctionsDetection:
     """Tests for sanctions detection functionality."""
 
-    @patch("requests.Session")
+    @patch("dags.utils.data_enrichment.get_http_session")
     def test_check_sanctions_positive(self, mock_session, sample_transaction_id):
         """Test sanctions detection with a sanctioned entity."""
         # Setup mock
@@ -136,7 +187,7 @@ class TestSanctionsDetection:
         assert len(result["data"]) > 0
         assert result["data"][0]["caption"] == SAMPLE_ORG
 
-    @patch("requests.Session")
+    @patch("dags.utils.data_enrichment.get_http_session")
     def test_check_sanctions_negative(self, mock_session, sample_transaction_id):
         """Test sanctions detection with a non-sanctioned entity."""
         # Setup mock
@@ -157,14 +208,121 @@ class TestSanctionsDetection:
         assert result["status"] == "success"
         assert len(result["data"]) == 0
 
+    @patch("dags.utils.data_enrichment.get_http_session")
+    def test_check_sanctions_batch_chunks_and_fans_out(
+        self, mock_session, tmp_path, sample_transaction_id
+    ):
+        """Test that many entities are screened in chunked multi-query requests."""
+        def match(url, json, **kwargs):
+            return MagicMock(json=MagicMock(return_value={
+                "responses": {
+                    key: {"results": [{"caption": query["properties"]["name"][0], "score": 0.9}]
+                          if query["properties"]["name"][0] == SAMPLE_ORG else []}
+                    for key, query in json["queries"].items()
+                }
+            }))
+
+        mock_session.return_value.post.side_effect = match
+
+        entities = [("Company", SAMPLE_ORG), ("Person", "Jane Doe"), ("Person", "John Doe"), ("Company", SAMPLE_ORG)]
+        with patch("dags.utils.data_enrichment.OPENSANCTIONS_MAX_BATCH", 2), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            results = check_sanctions_batch(entities, transaction_id=sample_transaction_id)
+
+        assert mock_session.return_value.post.call_count == 2
+        assert results["Company"][SAMPLE_ORG]["data"][0]["caption"] == SAMPLE_ORG
+        assert results["Person"]["Jane Doe"] == {"status": "success", "data": [], "cache": "miss"}
+        assert results["Person"]["John Doe"] == {"status": "success", "data": [], "cache": "miss"}
+
+    @patch("dags.utils.data_enrichment.get_http_session")
+    def test_check_sanctions_batch_uses_cache(self, mock_session, tmp_path, sample_transaction_id):
+        """Test that entities screened before are answered from the enrichment cache."""
+        mock_session.return_value.post.return_value.json.return_value = {
+            "responses": {"q1": {"results": [{"caption": SAMPLE_ORG, "score": 0.9}]}}
+        }
+
+        with patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            first = check_sanctions("Company", SAMPLE_ORG, transaction_id=sample_transaction_id)
+            # A differently written name of the same entity hits the same entry
+            second = check_sanctions("Company", "SBERBANK of  russia", transaction_id=sample_transaction_id)
+            other_schema = check_sanctions("Person", SAMPLE_ORG, transaction_id=sample_transaction_id)
+
+        assert first["cache"] == "miss"
+        assert second == {"status": "success", "data": first["data"], "cache": "hit"}
+        assert other_schema["cache"] == "miss"
+        assert mock_session.return_value.post.call_count == 2
+
+    @patch("dags.utils.data_enrichment.get_http_session")
+    def test_check_sanctions_batch_partial_response_is_not_cached(self, mock_session, tmp_path, sample_transaction_id):
+        """Test that an entity missing from the response fails instead of being cached as clean."""
+        mock_session.return_value.post.return_value.json.return_value = {"responses": {"q1": {"results": []}}}
+
+        entities = [("Person", "Jane Doe"), ("Person", "John Doe")]
+        with patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            results = check_sanctions_batch(entities, transaction_id=sample_transaction_id)
+            retried = check_sanctions_batch(entities, transaction_id=sample_transaction_id)
+
+        assert results["Person"]["Jane Doe"]["status"] == "success"
+        assert results["Person"]["John Doe"]["status"] == "failed"
+        assert retried["Person"]["Jane Doe"]["cache"] == "hit"
+        assert retried["Person"]["John Doe"] == {"status": "success", "data": [], "cache": "miss"}
+        # Only the failed entity is screened again
+        assert mock_session.return_value.post.call_args.kwargs["json"]["queries"] == {
+            "q1": {"schema": "Person", "properties": {"name": ["John Doe"]}}
+        }
+
+    @patch("dags.utils.data_enrichment.get_http_session")
+    def test_check_sanctions_batch_local_exports(
+        self, mock_session, tmp_path, sample_transaction_id
+    ):
+        """Test screening against OpenSanctions exports in the sanctions data folder."""
+        sanctions_folder = tmp_path / "sanctions"
+        sanctions_folder.mkdir()
+        (sanctions_folder / "targets.simple.csv").write_text(
+            "id,schema,name,aliases,countries,dataset\n"
+            f"NK-1,Company,{SAMPLE_ORG},Sberbank;PAO Sberbank,ru,US OFAC SDN\n"
+            "NK-2,Person,Sberbank Gref,,ru,EU FSF\n",
+            encoding="utf-8",
+        )
+        (sanctions_folder / "entities.ftm.json").write_text(
+            json.dumps({"id": "NK-3", "schema": "Person", "caption": "Jane Roe",
+                        "properties": {"name": ["Jane Roe"], "alias": ["Джейн Роу"]}, "datasets": ["eu_fsf"]})
+            + "\n"
+            + json.dumps({"id": "NK-4", "schema": "Sanction", "properties": {"program": ["SDN"]}})
+            + "\n",
+            encoding="utf-8",
+        )
+
+        entities = [("Company", "Sberbank"), ("Person", "Dzheyn Rou"), ("Person", "John Doe")]
+        with patch("dags.utils.data_enrichment.SANCTIONS_SCREENING_MODE", "auto"), \
+                patch("dags.utils.data_enrichment.SANCTION_DATA_FOLDER", str(sanctions_folder)), \
+                patch("dags.utils.data_enrichment.SANCTIONS_INDEX_FILE", str(sanctions_folder / "sanctions.idx")), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            results = check_sanctions_batch(
+                entities, dag_run=MagicMock(conf={"transaction_id": sample_transaction_id})
+            )
+
+        mock_session.assert_not_called()
+        company_matches = results["Company"]["Sberbank"]["data"]
+        # The person sharing a token with the company name is not a candidate for a Company query
+        assert [match["id"] for match in company_matches] == ["NK-1"]
+        assert company_matches[0]["caption"] == SAMPLE_ORG
+        assert company_matches[0]["datasets"] == ["US OFAC SDN"]
+        assert company_matches[0]["score"] > 0.70
+        assert results["Person"]["Dzheyn Rou"]["data"][0]["id"] == "NK-3"
+        assert results["Person"]["John Doe"] == {"status": "success", "data": []}
+
+        dataset = json.loads((tmp_path / sample_transaction_id / "screening_datasets" / "sanctions.json").read_text())
+        assert dataset["version"].startswith("local-")
+
 
 @pytest.mark.unit
 class TestCorporateRegistry:
     """Tests for corporate registry lookup functionality."""
 
-    @patch("requests.get")
+    @patch("dags.utils.data_enrichment.get_http_session")
     def test_open_corporates_lookup_positive(
-        self, mock_get, mock_response, sample_transaction_id
+        self, mock_session, mock_response, sample_transaction_id
     ):
         """Test corporate registry lookup with a known entity."""
         # Setup mock
@@ -184,7 +342,7 @@ class TestCorporateRegistry:
                 ]
             }
         }
-        mock_get.return_value = mock_response
+        mock_session.return_value.get.return_value = mock_response
 
         # Execute
         result = get_open_corporates_data(
@@ -195,15 +353,17 @@ class TestCorporateRegistry:
         # Assert
         assert result["status"] == "success"
         assert result["data"]["name"] == SAMPLE_ORG
+        # "Russia" is not pycountry's official name but still narrows the search
+        assert mock_session.return_value.get.call_args.kwargs["params"]["country_code"] == "ru"
 
-    @patch("requests.get")
+    @patch("dags.utils.data_enrichment.get_http_session")
     def test_open_corporates_lookup_negative(
-        self, mock_get, mock_response, sample_transaction_id
+        self, mock_session, mock_response, sample_transaction_id
     ):
         """Test corporate registry lookup with an unknown entity."""
         # Setup mock
         mock_response.json.return_value = {"results": {"companies": []}}
-        mock_get.return_value = mock_response
+        mock_session.return_value.get.return_value = mock_response
 
         # Execute
         result = get_open_corporates_data(
@@ -214,3 +374,724 @@ class TestCorporateRegistry:
         # Assert
         assert result["status"] == "no_results"
         assert result["data"] is None
+
+    @patch("dags.utils.data_enrichment.get_http_session")
+    def test_registry_mirror_lookup(self, mock_session, tmp_path, sample_transaction_id):
+        """Test lookups in a mirror of OpenCorporates and Companies House bulk files."""
+        registry_folder = tmp_path / "registry"
+        registry_folder.mkdir()
+        (registry_folder / "ru_companies.csv").write_text(
+            "company_number,jurisdiction_code,name,current_status,incorporation_date,registered_address.in_full\n"
+            f"1027700132195,ru,PJSC {SAMPLE_ORG},Active,1991-06-20,\"Moscow, Russia\"\n"
+            "1027700000001,ru,Sberbank Leasing JSC,Liquidated,1993-01-01,Moscow\n",
+            encoding="utf-8",
+        )
+        (registry_folder / "BasicCompanyData.csv").write_text(
+            "CompanyName, CompanyNumber,CompanyStatus,IncorporationDate,CountryOfOrigin,PreviousName_1.CompanyName\n"
+            "ACME TRADING LIMITED,01234567,Active,02/03/2004,United Kingdom,ACME HOLDINGS LTD\n",
+            encoding="utf-8",
+        )
+        mirror = RegistryMirror(str(tmp_path / "registry_mirror.db"))
+        assert mirror.import_folder(str(registry_folder)) == {"BasicCompanyData.csv": 1, "ru_companies.csv": 2}
+        assert mirror.import_folder(str(registry_folder)) == {}
+
+        # Legal forms are ignored, previous names are searchable
+        acme = mirror.search("Acme Holdings Ltd", country_code="gb")
+        assert acme[0]["company_number"] == "01234567"
+        assert acme[0]["incorporation_date"] == "2004-03-02"
+        assert mirror.covers(country_code="GB") and not mirror.covers(country_code="us")
+
+        with patch("dags.utils.data_enrichment.get_registry_mirror", return_value=mirror):
+            result = get_open_corporates_data(
+                {"name": SAMPLE_ORG, "jurisdiction": "Russia"}, transaction_id=sample_transaction_id
+            )
+            assert result["status"] == "success" and result["source"] == "registry_mirror"
+            assert result["data"]["company_number"] == "1027700132195"
+
+            # A covered jurisdiction is answered by the mirror alone
+            result = get_open_corporates_data(
+                {"name": "Unknown Company", "jurisdiction": "UK"}, transaction_id=sample_transaction_id
+            )
+            assert result["status"] == "no_results" and result["source"] == "registry_mirror"
+            mock_session.assert_not_called()
+
+            # Elsewhere the API is asked
+            mock_session.return_value.get.return_value.json.return_value = {"results": {"companies": []}}
+            result = get_open_corporates_data(
+                {"name": "Unknown Company", "jurisdiction": "France"}, transaction_id=sample_transaction_id
+            )
+            assert result["source"] == "opencorporates"
+            mock_session.assert_called_once_with("opencorporates")
+
+
+@pytest.mark.unit
+class TestWikidata:
+    """Tests for Wikidata enrichment."""
+
+    @patch("dags.utils.data_enrichment._run_sparql")
+    def test_single_query_returns_properties_and_people(self, mock_sparql, sample_transaction_id):
+        """Test that the entity, its properties and its people come from one SPARQL query."""
+        company = {"type": "uri", "value": "http://www.wikidata.org/entity/Q205012"}
+        mock_sparql.return_value = {"results": {"bindings": [
+            {"company": company, "kind": {"value": "property"},
+             "propLabel": {"value": "country"}, "valueLabel": {"value": "Russia"}},
+            {"company": company, "kind": {"value": "person"}, "propLabel": {"value": "chief executive officer"},
+             "value": {"value": "http://www.wikidata.org/entity/Q4160221"}, "valueLabel": {"value": "Herman Gref"}},
+            {"company": company, "kind": {"value": "person"}, "propLabel": {"value": "chief executive officer"},
+             "value": {"value": "http://www.wikidata.org/entity/Q4160221"}, "valueLabel": {"value": "Herman Gref"}},
+        ]}}
+
+        result = query_wikidata('Sberbank "PJSC"', transaction_id=sample_transaction_id)
+
+        assert mock_sparql.call_count == 1
+        assert 'mwapi:search "Sberbank \\"PJSC\\""' in mock_sparql.call_args.args[0]
+        assert result["status"] == "success"
+        assert result["data"]["entity_id"] == "Q205012"
+        assert result["data"]["properties"] == {"country": "Russia"}
+        assert result["associated_people"] == [{
+            "name": "Herman Gref", "role": "chief executive officer", "source": "wikidata",
+            "entity_id": "Q4160221", "entity_connection": 'Sberbank "PJSC"',
+        }]
+
+    @patch("dags.utils.data_enrichment._run_sparql")
+    def test_batch_resolves_all_organizations_in_two_queries(self, mock_sparql, sample_transaction_id):
+        """Test that a batch is searched with one query and detailed with one VALUES query."""
+        def company(qid):
+            return {"type": "uri", "value": f"http://www.wikidata.org/entity/{qid}"}
+
+        mock_sparql.side_effect = [
+            {"results": {"bindings": [
+                {"name": {"value": SAMPLE_ORG}, "company": company("Q205012")},
+                {"name": {"value": "Gazprom"}, "company": company("Q102673")},
+            ]}},
+            {"results": {"bindings": [
+                {"company": company("Q205012"), "kind": {"value": "property"},
+                 "propLabel": {"value": "country"}, "valueLabel": {"value": "Russia"}},
+                {"company": company("Q102673"), "kind": {"value": "person"},
+                 "propLabel": {"value": "chief executive officer"}, "valueLabel": {"value": "Alexei Miller"}},
+            ]}},
+        ]
+
+        results = query_wikidata_batch([SAMPLE_ORG, "Gazprom", "Unknown Company", SAMPLE_ORG],
+                                       transaction_id=sample_transaction_id)
+
+        assert mock_sparql.call_count == 2
+        assert "VALUES ?company { wd:Q205012 wd:Q102673 }" in mock_sparql.call_args.args[0]
+        assert results[SAMPLE_ORG]["data"]["properties"] == {"country": "Russia"}
+        assert results["Gazprom"]["associated_people"][0]["entity_connection"] == "Gazprom"
+        assert results["Unknown Company"]["status"] == "no_results"
+
+        # Cached organizations are not looked up again
+        results = query_wikidata_batch([SAMPLE_ORG], transaction_id=sample_transaction_id)
+        assert results[SAMPLE_ORG]["cache"] == "hit" and mock_sparql.call_count == 2
+
+    @patch("dags.utils.data_enrichment._run_sparql")
+    def test_local_store_built_from_truthy_dump(self, mock_sparql, tmp_path, sample_transaction_id):
+        """Test lookups in the subset store built from a truthy dump."""
+        entity = "<http://www.wikidata.org/entity/{}>"
+        claim = "<http://www.wikidata.org/prop/direct/{}>"
+        label = "<http://www.w3.org/2000/01/rdf-schema#label>"
+        alias = "<http://www.w3.org/2004/02/skos/core#altLabel>"
+        triples = [
+            (entity.format("Q205012"), label, '"Sberbank"@en'),
+            (entity.format("Q205012"), alias, f'"{SAMPLE_ORG}"@en'),
+            (entity.format("Q205012"), label, '"\\u0421\\u0431\\u0435\\u0440\\u0431\\u0430\\u043D\\u043A"@ru'),
+            (entity.format("Q205012"), claim.format("P31"), entity.format("Q22687")),
+            (entity.format("Q205012"), claim.format("P17"), entity.format("Q159")),
+            (entity.format("Q205012"), claim.format("P571"),
+             '"1841-11-12T00:00:00Z"^^<http://www.w3.org/2001/XMLSchema#dateTime>'),
+            (entity.format("Q205012"), claim.format("P169"), entity.format("Q4160221")),
+            (entity.format("Q159"), label, '"Russia"@en'),
+            (entity.format("Q159"), claim.format("P17"), entity.format("Q159")),
+            (entity.format("Q4160221"), label, '"Herman Gref"@en'),
+            (entity.format("Q4160221"), claim.format("P31"), entity.format("Q5")),
+        ]
+        dump_file = tmp_path / "truthy.nt"
+        dump_file.write_text("".join(f"{s} {p} {o} .\n" for s, p, o in triples), encoding="utf-8")
+        store = WikidataStore(build_wikidata_store(str(dump_file), str(tmp_path / "wikidata.db")))
+
+        found = store.lookup("sberbank of russia")
+        assert found["entity_id"] == "Q205012"
+        assert found["properties"] == {"country": "Russia", "inception": "1841-11-12T00:00:00Z",
+                                       "chief executive officer": "Herman Gref"}
+        # Countries are not organizations
+        assert store.lookup("Russia") is None
+
+        with patch("dags.utils.data_enrichment.get_wikidata_store", return_value=store):
+            result = query_wikidata(SAMPLE_ORG, transaction_id=sample_transaction_id)
+        assert result["cache"] == "local" and mock_sparql.call_count == 0
+        assert result["associated_people"][0]["name"] == "Herman Gref"
+        assert store.organizations_of_people([4160221]) == {
+            4160221: [{"entity_id": "Q205012", "name": "Sberbank", "role": "chief executive officer"}]
+        }
+
+    def test_network_expansion_is_bounded_and_batched(self, tmp_path, sample_transaction_id):
+        """Test the multi-hop expansion with its fan-out cap, node budget and one screening batch per hop."""
+        def link(entity_id, name):
+            return {"entity_id": entity_id, "name": name, "role": "director / manager"}
+
+        officers = {
+            "Q1": [link("Q10", "Herman Gref"), link("Q11", "Alexander Vedyakhin"), link("Q12", "Oleg Ganeev")],
+            "Q20": [link("Q10", "Herman Gref"), link("Q21", "Lev Khasis")],
+        }
+        organizations = {"Q10": [link("Q1", SAMPLE_ORG), link("Q20", "Sberbank CIB")]}
+        sanctions_calls = []
+
+        def check_sanctions_batch(entities, **context):
+            sanctions_calls.append(list(entities))
+            hits = {"Lev Khasis": {"status": "success", "data": [{"id": "NK-1"}]}}
+            return {schema: {name: hits.get(name, {"status": "no_results", "data": None})
+                             for _, name in entities} for schema in ("Person", "Company")}
+
+        with patch("dags.utils.network_expansion.wikidata_organization_people",
+                   side_effect=lambda ids: {i: officers.get(i, []) for i in ids}), \
+                patch("dags.utils.network_expansion.wikidata_person_organizations",
+                      side_effect=lambda ids: {i: organizations.get(i, []) for i in ids}), \
+                patch("dags.utils.network_expansion.check_sanctions_batch", side_effect=check_sanctions_batch), \
+                patch("dags.utils.network_expansion.screen_pep_batch", return_value={}) as mock_pep, \
+                patch("dags.utils.network_expansion.RESULTS_FOLDER", str(tmp_path)):
+            result = expand_network(sample_transaction_id, [{"name": SAMPLE_ORG, "entity_id": "Q1"}],
+                                    screened_names=["Herman Gref"], max_hops=3, max_fanout=2, max_nodes=10)
+
+            network = result["data"]
+            assert result["status"] == "success"
+            # Oleg Ganeev is over the fan-out cap of Q1; Q1 itself is not revisited
+            assert [(node["entity_id"], node["hop"]) for node in network["nodes"]] == [
+                ("Q1", 0), ("Q10", 1), ("Q11", 1), ("Q20", 2), ("Q21", 3)
+            ]
+            # One batch per hop, without the names screened by the transaction
+            assert sanctions_calls == [[("Person", "Alexander Vedyakhin")], [("Company", "Sberbank CIB")],
+                                       [("Person", "Lev Khasis")]]
+            assert mock_pep.call_count == 2
+            assert [node["name"] for node in network["hits"]] == ["Lev Khasis"]
+            assert {"source": "Q10", "target": "Q20", "role": "director / manager"} in network["edges"]
+            assert network["hops"] == 3 and not network["truncated"]
+
+            budget = expand_network(sample_transaction_id, [{"name": SAMPLE_ORG, "entity_id": "Q1"}],
+                                    max_hops=3, max_fanout=2, max_nodes=3)
+        assert len(budget["data"]["nodes"]) == 3 and budget["data"]["truncated"]
+
+    @patch("dags.utils.data_enrichment._run_sparql")
+    def test_network_lookups_fall_back_to_sparql_for_ids_missing_locally(self, mock_sparql):
+        """Test that in auto mode only the ids the local store holds are answered by it."""
+        store = MagicMock()
+        store.has.side_effect = lambda item_id, organization=False: item_id == 1
+        store.details.return_value = {"properties": {}, "associated_people": [
+            {"name": "Herman Gref", "role": "chief executive officer", "entity_id": "Q10"}
+        ]}
+        store.organizations_of_people.return_value = {1: []}
+        mock_sparql.return_value = {"results": {"bindings": [
+            {"company": {"value": "http://www.wikidata.org/entity/Q2"}, "kind": {"value": "person"},
+             "propLabel": {"value": "chief executive officer"},
+             "value": {"value": "http://www.wikidata.org/entity/Q21"}, "valueLabel": {"value": "Lev Khasis"}},
+        ]}}
+
+        with patch("dags.utils.data_enrichment.get_wikidata_store", return_value=store), \
+                patch("dags.utils.data_enrichment.WIKIDATA_LOOKUP_MODE", "auto"):
+            people = wikidata_organization_people(["Q1", "Q2"])
+            assert people["Q1"][0]["name"] == "Herman Gref"
+            assert people["Q2"][0]["name"] == "Lev Khasis"
+            assert "VALUES ?company { wd:Q2 }" in mock_sparql.call_args.args[0]
+
+            mock_sparql.return_value = {"results": {"bindings": [
+                {"person": {"value": "http://www.wikidata.org/entity/Q2"},
+                 "company": {"value": "http://www.wikidata.org/entity/Q20"}, "companyLabel": {"value": "Sberbank CIB"},
+                 "propLabel": {"value": "director / manager"}},
+            ]}}
+            organizations = wikidata_person_organizations(["Q1", "Q2"])
+            assert organizations == {"Q1": [], "Q2": [
+                {"entity_id": "Q20", "name": "Sberbank CIB", "role": "director / manager"}
+            ]}
+            store.organizations_of_people.assert_called_once_with([1])
+
+        with patch("dags.utils.data_enrichment.get_wikidata_store", return_value=store), \
+                patch("dags.utils.data_enrichment.WIKIDATA_LOOKUP_MODE", "local"):
+            calls = mock_sparql.call_count
+            assert list(wikidata_organization_people(["Q2"])) == ["Q2"]
+            assert mock_sparql.call_count == calls
+
+
+@pytest.mark.unit
+class TestAdverseNews:
+    """Tests for the incremental GDELT adverse media fetch."""
+
+    @patch("dags.utils.data_enrichment.get_http_session")
+    def test_fetches_only_articles_since_watermark(self, mock_session, tmp_path, sample_transaction_id):
+        """Test a full pull, a fresh check without request and a delta merged into the stored articles."""
+        def article(url, seendate):
+            return {"url": url, "title": url, "domain": "example.com", "seendate": seendate, "tone": -5}
+
+        responses = [
+            {"articles": [article("https://a", "20240110T080000Z"), article("https://b", "20240112T093000Z")]},
+            {"articles": [article("https://b", "20240112T093000Z"), article("https://c", "20240115T120000Z")]},
+        ]
+        mock_session.return_value.get.return_value.json.side_effect = responses
+        store = NewsStore(str(tmp_path / "news_store.db"))
+
+        with patch("dags.utils.data_enrichment.get_news_store", return_value=store), \
+                patch("dags.utils.data_enrichment.NEWS_RETENTION_DAYS", None), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            full = check_adverse_news(SAMPLE_ORG, transaction_id=sample_transaction_id)
+            fresh = check_adverse_news(SAMPLE_ORG.upper(), transaction_id=sample_transaction_id)
+            with patch("dags.utils.data_enrichment.NEWS_REFRESH_INTERVAL", 0):
+                delta = check_adverse_news(SAMPLE_ORG, transaction_id=sample_transaction_id)
+
+        urls = [call.args[0] for call in mock_session.return_value.get.call_args_list]
+        assert len(urls) == 2
+        assert "startdatetime" not in urls[0]
+        # The delta window starts an hour before the newest article seen
+        assert urls[1].endswith("&startdatetime=20240112083000")
+        assert (full["cache"], fresh["cache"], delta["cache"]) == ("miss", "hit", "delta")
+        assert [item["url"] for item in store.articles(SAMPLE_ORG)] == ["https://c", "https://b", "https://a"]
+        assert store.watermark(SAMPLE_ORG, "fraud+scam+scandal+sanctions+corruption+lawsuit+investigation")[
+            "seen_until"] == "20240115T120000Z"
+
+    @patch("dags.utils.adverse_media._sentiment_analyzer", return_value=False)
+    def test_scores_articles_of_all_entities_in_one_batch(self, mock_analyzer):
+        """Test the theme, sentiment and recency scoring and the top K per entity."""
+        def article(title, seendate, tone=0):
+            return {"article_id": title, "url": f"https://news/{title}", "title": title, "domain": "example.com",
+                    "seendate": seendate, "tone": tone}
+
+        now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+        articles = {
+            SAMPLE_ORG: [
+                article("Bank opens new branch", "20240530T080000Z", tone=3),
+                article("Bank fined over money laundering failures", "20240529T080000Z"),
+                article("Bank fined over money laundering failures in 2021", "20210529T080000Z"),
+                article("Regulator opens bribery probe and fraud charges", "20240520T080000Z"),
+                article("Quarterly results disappoint", "20240531T080000Z", tone=-6),
+            ],
+            SAMPLE_PEP: [article("Yanukovych sanctions extended", "20240401T080000Z")],
+            "Nobody": [],
+        }
+        scored = score_articles(articles, top_k=3, min_score=0.15, half_life_days=365, now=now)
+
+        titles = [item["article_id"] for item in scored[SAMPLE_ORG]]
+        # Several themes outrank one; the old article decays below the neutral ones
+        assert titles == ["Regulator opens bribery probe and fraud charges",
+                          "Bank fined over money laundering failures", "Quarterly results disappoint"]
+        assert scored[SAMPLE_ORG][0]["themes"] == ["fraud", "corruption", "legal_action"]
+        assert scored[SAMPLE_ORG][2]["sentiment"] == -0.6 and scored[SAMPLE_ORG][2]["themes"] == []
+        assert scored[SAMPLE_PEP][0]["themes"] == ["sanctions"]
+        assert scored["Nobody"] == []
+
+    def test_articles_are_stored_once_across_entities(self, tmp_path, sample_transaction_id):
+        """Test that copies of an article under other URLs or titles are stored once and referenced by id."""
+        title = "Sberbank fined over money laundering failures in Moscow branch"
+        copies = [
+            {"url": "https://www.reuters.com/business/sberbank-fined/?utm_source=twitter", "title": title,
+             "domain": "reuters.com", "seendate": "20240529T080000Z"},
+            {"url": "http://reuters.com/business/sberbank-fined", "title": title,
+             "domain": "reuters.com", "seendate": "20240529T090000Z"},
+            {"url": "https://news.example.com/2024/05/29/12345", "title": f"{title.upper()} - Example News",
+             "domain": "news.example.com", "seendate": "20240529T100000Z"},
+        ]
+        other = {"url": "https://news.example.com/other", "title": "Herman Gref questioned in bribery probe",
+                 "domain": "news.example.com", "seendate": "20240530T100000Z"}
+        store = NewsStore(str(tmp_path / "news_store.db"))
+
+        assert store.merge(SAMPLE_ORG, "q", copies, full=True) == 1
+        assert store.merge("Herman Gref", "q", [copies[2], other], full=True) == 2
+        org_articles = store.articles(SAMPLE_ORG)
+        person_articles = store.articles("Herman Gref")
+        assert len(org_articles) == 1 and org_articles[0]["url"] == copies[0]["url"]
+        assert org_articles[0]["article_id"] in {article["article_id"] for article in person_articles}
+        # The earliest copy dates the article for the entity
+        assert store.watermark(SAMPLE_ORG, "q")["seen_until"] == "20240529T080000Z"
+
+        news = {"status": "success", "data": [{"article_id": article["article_id"]} for article in person_articles]}
+        with patch("dags.utils.data_enrichment.get_news_store", return_value=store), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            articles = collect_news_articles(sample_transaction_id, [
+                {"news": {"status": "success", "data": [{"article_id": org_articles[0]["article_id"]}]}},
+                {"news": news}, {"news": {"status": "failed", "data": []}},
+            ])
+        assert sorted(article["title"] for article in articles.values()) == [other["title"], title]
+
+        # Articles no entity refers to anymore are deleted
+        store.merge(SAMPLE_ORG, "q", [], full=True)
+        assert store.get_articles([org_articles[0]["article_id"]]) != {}
+        store.merge("Herman Gref", "q", [], full=True)
+        assert store.get_articles(article["article_id"] for article in person_articles) == {}
+
+    def test_same_article_stored_concurrently_from_two_stores(self, tmp_path):
+        """Test that two workers storing the same articles at once share one copy of each."""
+        articles = [{"url": f"https://news.example.com/{i}", "title": f"Fine {i}", "seendate": "20240529T080000Z"}
+                    for i in range(200)]
+        stores = [NewsStore(str(tmp_path / "news_store.db")) for _ in range(2)]
+        barrier = threading.Barrier(2)
+
+        def merge(store, entity_name):
+            barrier.wait()
+            return store.merge(entity_name, "q", articles, full=False)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            added = list(executor.map(merge, stores, [SAMPLE_ORG, "Herman Gref"]))
+
+        assert added == [200, 200]
+        assert {article["article_id"] for article in stores[0].articles(SAMPLE_ORG)} \
+            == {article["article_id"] for article in stores[1].articles("Herman Gref")}
+
+    @patch("dags.utils.data_enrichment._fetch_adverse_news")
+    def test_batch_scores_once_and_fails_per_entity(self, mock_fetch, tmp_path, sample_transaction_id):
+        """Test that a failed fetch only fails its entity and the rest are scored in one call."""
+        def fetch(entity_name, allow_fetch=True):
+            if entity_name == "Broken Ltd":
+                raise requests.exceptions.ConnectionError("connection reset")
+            if entity_name == "Locked Ltd":
+                raise sqlite3.OperationalError("database is locked")
+            return [{"article_id": "a1", "url": "https://x", "title": f"{entity_name} charged with fraud",
+                     "seendate": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")}], "miss"
+
+        mock_fetch.side_effect = fetch
+        with patch("dags.utils.data_enrichment.score_articles", wraps=score_articles) as mock_score, \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            results = check_adverse_news_batch(
+                [("Company", SAMPLE_ORG), ("Company", "Broken Ltd"), ("Company", "Locked Ltd"),
+                 ("Person", SAMPLE_PEP), ("Person", SAMPLE_PEP)],
+                transaction_id=sample_transaction_id
+            )
+
+        assert mock_score.call_count == 1 and mock_fetch.call_count == 4
+        assert results["Company"]["Broken Ltd"]["status"] == "failed"
+        assert results["Company"]["Locked Ltd"]["status"] == "failed"
+        assert results["Company"][SAMPLE_ORG]["data"][0]["themes"] == ["fraud", "legal_action"]
+        assert results["Person"][SAMPLE_PEP]["status"] == "success"
+        assert list(tmp_path.glob(f"*/entity_data/people_results/news/{SAMPLE_PEP.replace(' ', '_')}.json"))
+
+    @patch("dags.utils.data_enrichment._fetch_adverse_news")
+    def test_batch_caps_gdelt_fetches(self, mock_fetch, tmp_path, sample_transaction_id):
+        """Test that entities over the fetch limit are left to their own tasks, unless stored and fresh."""
+        def fetch(entity_name, allow_fetch=True):
+            if entity_name == "Fresh Ltd":
+                return [], "hit"
+            return ([], "miss") if allow_fetch else None
+
+        mock_fetch.side_effect = fetch
+        with patch("dags.utils.data_enrichment.ADVERSE_MEDIA_BATCH_MAX_FETCHES", 1), \
+                patch("dags.utils.data_enrichment.RESULTS_FOLDER", str(tmp_path)):
+            results = check_adverse_news_batch(
+                [("Company", SAMPLE_ORG), ("Company", "Other Ltd"), ("Company", "Fresh Ltd")],
+                transaction_id=sample_transaction_id
+            )
+
+        assert results["Company"][SAMPLE_ORG]["cache"] == "miss"
+        assert results["Company"]["Fresh Ltd"]["cache"] == "hit"
+        assert "Other Ltd" not in results["Company"]
+
+
+@pytest.mark.unit
+class TestHttpClient:
+    """Tests for the shared provider HTTP sessions."""
+
+    def test_sessions_are_shared_per_provider(self):
+        """Test that a provider's session is reused and configured with timeouts and retries."""
+        session = get_http_session("opencorporates")
+        assert get_http_session("opencorporates") is session
+        assert get_http_session("gdelt") is not session
+
+        adapter = session.get_adapter("https://api.opencorporates.com")
+        assert adapter.timeout[0] > 0 and adapter.timeout[1] > 0
+        assert adapter.max_retries.respect_retry_after_header
+        assert 429 in adapter.max_retries.status_forcelist
+        assert adapter.provider == "opencorporates"
+
+    def test_every_retry_waits_for_the_rate_limit(self):
+        """Test that each retry takes a rate limit token and a retried 429 slows the provider down."""
+        retry = get_http_session("gdelt").get_adapter("https://api.gdeltproject.org").max_retries
+        retry = retry.new(backoff_factor=0)
+        assert retry.provider == "gdelt"
+
+        with patch("dags.utils.http_client.acquire") as acquire_token, \
+                patch("dags.utils.http_client.report_rate_limited") as report:
+            retry.sleep(SimpleNamespace(status=503, headers={}))
+            retry.sleep(SimpleNamespace(status=429, headers={"Retry-After": "0"}))
+        assert [c.args for c in acquire_token.call_args_list] == [("gdelt",), ("gdelt",)]
+        report.assert_called_once_with("gdelt", 0)
+
+    def test_rate_limiter_bucket_and_adaptive_slowdown(self):
+        """Test the token bucket and the slowdown after a 429 response."""
+        limiter = LocalRateLimiter({"gdelt": (2.0, 2.0)})
+        with patch("dags.utils.rate_limiter.time.monotonic", return_value=100.0):
+            assert limiter.try_acquire("gdelt") == 0
+            assert limiter.try_acquire("gdelt") == 0
+            # The burst is used up, the next token arrives at 2 requests per second
+            assert limiter.try_acquire("gdelt") == pytest.approx(0.5)
+            assert acquire("other", limiter=limiter) == 0
+
+            report_rate_limited("gdelt", retry_after=3, limiter=limiter)
+            assert limiter.try_acquire("gdelt") == pytest.approx(3)
+        with patch("dags.utils.rate_limiter.time.monotonic", return_value=103.0):
+            # The Retry-After pause is over, but tokens refill at half the rate
+            assert limiter.try_acquire("gdelt") == pytest.approx(1 / (2.0 * (0.5 + 3 / 300)))
+
+
+@pytest.mark.unit
+class TestConcurrentChecks:
+    """Tests for the concurrent provider checks of an entity task."""
+
+    def test_checks_run_concurrently_with_timeouts(self):
+        """Test that checks overlap, a slow check times out and a failing one does not fail the others."""
+        def check(result, seconds):
+            def run():
+                time.sleep(seconds)
+                return result
+            return run
+
+        def broken():
+            raise ValueError("bad response")
+
+        started = time.monotonic()
+        results = run_checks(
+            {"sanctions": check({"status": "success", "data": []}, 0.2),
+             "news": check({"status": "success", "data": []}, 0.2),
+             "wikidata": check({"status": "success", "data": {}}, 2.0),
+             "pep": broken},
+            timeouts={"wikidata": 0.4}, max_workers=4
+        )
+        elapsed = time.monotonic() - started
+
+        assert list(results) == ["sanctions", "news", "wikidata", "pep"]
+        assert results["sanctions"]["status"] == results["news"]["status"] == "success"
+        assert results["wikidata"]["status"] == "failed" and "timed out" in results["wikidata"]["reason"]
+        assert results["wikidata"]["data"] is None and results["wikidata"]["associated_people"] == []
+        assert results["pep"]["status"] == "failed" and "bad response" in results["pep"]["reason"]
+        # The slowest check within its timeout, not the sum of all checks
+        assert elapsed < 1.0
+
+    def test_rate_limit_wait_stops_at_the_check_deadline(self):
+        """Test that a check does not wait for a rate limit past its deadline."""
+        limiter = LocalRateLimiter({"opensanctions": (0.01, 1.0)})
+
+        def screen():
+            for _ in range(2):
+                acquire("opensanctions", limiter=limiter, max_wait=300)
+            return {"status": "success", "data": []}
+
+        started = time.monotonic()
+        results = run_checks({"sanctions": screen}, timeouts={"sanctions": 5})
+
+        assert results["sanctions"]["status"] == "failed" and "deadline" in results["sanctions"]["reason"]
+        assert results["sanctions"]["data"] == []
+        assert time.monotonic() - started < 1.0
+        # Without a deadline the wait is only bound by max_wait
+        assert acquire("opensanctions", limiter=limiter, max_wait=0) == 0
+
+
+@pytest.mark.unit
+class TestGeminiModelPool:
+    """Tests for the pooled Gemini models, with a stubbed google.generativeai."""
+
+    @pytest.fixture
+    def gemini(self):
+        import dags.config
+        import dags.config.settings
+
+        genai = MagicMock()
+        genai.GenerativeModel.side_effect = lambda **kwargs: SimpleNamespace(_client=None, _async_client=None,
+                                                                             **kwargs)
+        genai.client._ClientManager.return_value.make_client.side_effect = lambda name: MagicMock(name=name)
+        google = ModuleType("google")
+        google.generativeai = genai
+        with patch.dict(sys.modules, {"google": google, "google.generativeai": genai,
+                                      "google.generativeai.client": genai.client,
+                                      "config": dags.config, "config.settings": dags.config.settings}):
+            sys.modules.pop("dags.utils.gemini_util", None)
+            import dags.utils.gemini_util as gemini_util
+            yield gemini_util, genai
+
+    def test_models_are_pooled_per_key_model_and_config(self, gemini):
+        """Test that a model is built once per key, model and config, with a client of its own."""
+        gemini_util, genai = gemini
+
+        model = gemini_util.get_genai_model("key-a")
+        assert gemini_util.get_genai_model("key-a") is model
+        assert gemini_util.get_genai_model("key-b") is not model
+        assert gemini_util.get_genai_model("key-a", generation_config={"temperature": 0}) is not model
+        assert gemini_util.get_genai_model("key-a", model_name="other-model") is not model
+        assert genai.GenerativeModel.call_count == 4
+
+        assert model._client is not None and model._async_client is not None
+        genai.client._ClientManager.return_value.configure.assert_any_call(api_key="key-a")
+        genai.configure.assert_not_called()
+
+        # A forked child process builds its own models
+        with patch("dags.utils.gemini_util.os.getpid", return_value=-1):
+            assert gemini_util.get_genai_model("key-a") is not model
+
+    def test_falls_back_to_configure_without_private_client_api(self, gemini):
+        """Test that a model is still built if the SDK's private client API is missing."""
+        gemini_util, genai = gemini
+        genai.client._ClientManager.side_effect = AttributeError("_ClientManager")
+
+        model = gemini_util.get_genai_model("key-c")
+
+        assert model._client is None
+        genai.configure.assert_called_once_with(api_key="key-c")
+
+
+@pytest.mark.unit
+class TestEvidenceCompaction:
+    """Tests for the compaction of the risk assessment evidence."""
+
+    @staticmethod
+    def _assessment_data(matches=12):
+        return {
+            "transaction_text": "Payment of 1,000,000 USD " * 100,
+            "transaction_id": "txn_1",
+            "extracted_entities": {"organizations": ["Acme Ltd"], "people": ["Jane Roe"]},
+            "organizations": {
+                "Acme Ltd": {
+                    "opencorporates": {"status": "success", "data": {
+                        "name": "ACME LTD", "company_number": "123", "current_status": "Dissolved",
+                        "registry_url": "https://example.org/123", "officers": [{"name": "x"}] * 50,
+                    }},
+                    "sanctions": {"status": "failed", "reason": "Timed out", "data": None},
+                    "news": {"status": "success", "data": [
+                        {"article_id": f"a{i}", "score": 0.9 - i / 100, "themes": ["fraud"]} for i in range(8)
+                    ]},
+                    "discovered_people": [{"name": "Jane Roe"}],
+                },
+            },
+            "people": {
+                "Jane Roe": {"pep": {"status": "success", "data": [
+                    {"caption": f"Jane Roe {i}", "score": 0.9, "schema": "Person", "id": f"p{i}",
+                     "properties": {"country": ["ru"], "notes": ["long " * 200]}} for i in range(matches)
+                ]}},
+            },
+            "news_articles": {
+                f"a{i}": {"title": f"Acme fraud {i}", "url": f"https://news.example/{i}", "source": "example"}
+                for i in range(10)
+            },
+        }
+
+    def test_keeps_used_fields_and_summarizes_lists(self):
+        """Test that unused fields are dropped and long lists become counts and their top items."""
+        text, tokens = compact_evidence(self._assessment_data(), token_budget=100000, top_k=5)
+        evidence = json.loads(text)
+
+        assert ", " not in text and "transaction_text" not in evidence
+        acme = evidence["organizations"]["Acme Ltd"]
+        assert acme["opencorporates"] == {"name": "ACME LTD", "company_number": "123", "current_status": "Dissolved"}
+        assert acme["sanctions"] == {"status": "failed", "reason": "Timed out"}
+        assert "discovered_people" not in acme
+        pep = evidence["people"]["Jane Roe"]["pep"]
+        assert pep["count"] == 12 and len(pep["top"]) == 5
+        assert pep["top"][0] == {"caption": "Jane Roe 0", "schema": "Person", "score": 0.9, "country": ["ru"]}
+        # Only the articles still referenced are included, without their URLs
+        assert acme["news"]["count"] == 8
+        assert sorted(evidence["news_articles"]) == [f"a{i}" for i in range(5)]
+        assert evidence["news_articles"]["a0"] == {"title": "Acme fraud 0", "source": "example"}
+
+    def test_shrinks_to_the_token_budget(self):
+        """Test that the evidence keeps fewer items until it fits the budget of the token counter."""
+        assessment_data = self._assessment_data(matches=200)
+        full, full_tokens = compact_evidence(assessment_data, token_budget=100000, count_tokens=len, top_k=100)
+        text, tokens = compact_evidence(assessment_data, token_budget=full_tokens // 10, count_tokens=len, top_k=100)
+
+        assert tokens == len(text) <= full_tokens // 10
+        assert json.loads(text)["people"]["Jane Roe"]["pep"]["count"] == 200
+
+
+@pytest.mark.unit
+class TestEnrichmentCache:
+    """Tests for the cross-transaction enrichment cache."""
+
+    def test_entries_expire_and_are_bounded(self, enrichment_cache):
+        """Test per-provider TTLs and the eviction of the oldest entries."""
+        enrichment_cache.ttls = {"gdelt": 60, "wikidata": 0}
+        with patch("dags.utils.enrichment_cache.time.time", return_value=1000.0):
+            enrichment_cache.set("gdelt", SAMPLE_ORG, [{"title": "t"}])
+            enrichment_cache.set("wikidata", SAMPLE_ORG, {"entity_info": None})
+            assert enrichment_cache.get("gdelt", SAMPLE_ORG) == [{"title": "t"}]
+            # A TTL of 0 disables caching for the provider
+            assert enrichment_cache.get("wikidata", SAMPLE_ORG) is None
+        with patch("dags.utils.enrichment_cache.time.time", return_value=1061.0):
+            assert enrichment_cache.get("gdelt", SAMPLE_ORG) is None
+
+        for position in range(5):
+            with patch("dags.utils.enrichment_cache.time.time", return_value=2000.0 + position):
+                enrichment_cache.set("opensanctions", f"Company {position}", [])
+        with patch("dags.utils.enrichment_cache.time.time", return_value=2010.0):
+            enrichment_cache._evict()
+            assert enrichment_cache.get("opensanctions", "Company 0") is None
+            assert enrichment_cache.get("opensanctions", "Company 4") == []
+
+
+@pytest.mark.unit
+class TestSanctionsRescreening:
+    """Tests for the delta re-screening of stored entities."""
+
+    def test_rescreens_only_changed_entries(self, tmp_path):
+        """Test that only added or changed list entries are matched against stored entities."""
+        sanctions_folder = tmp_path / "sanctions"
+        sanctions_folder.mkdir()
+        export = sanctions_folder / "targets.simple.csv"
+        header = "id,schema,name,aliases,dataset,last_seen\n"
+        export.write_text(header + "NK-1,Person,Jane Roe,,EU FSF,2024-01-01\n", encoding="utf-8")
+
+        neo4j = MagicMock()
+        neo4j.search_entities_by_name.return_value = [
+            {"id": "4:abc:1", "label": "Organization", "name": SAMPLE_ORG},
+            {"id": "4:abc:2", "label": "Person", "name": "Sberbank Roe"},
+        ]
+        neo4j.flag_sanctions_matches.return_value = ["TX-1"]
+
+        baseline = rescreen_sanctions_delta(str(sanctions_folder), str(tmp_path / "rescreen"), 0.85, neo4j)
+        assert baseline["data"]["mode"] == "baseline"
+        neo4j.search_entities_by_name.assert_not_called()
+
+        # Only the new entry is screened; a changed last_seen does not count as a change
+        export.write_text(header + "NK-1,Person,Jane Roe,,EU FSF,2024-01-02\n"
+                          f"NK-2,Company,{SAMPLE_ORG},Sberbank,US OFAC SDN,2024-01-02\n", encoding="utf-8")
+        os.utime(export, ns=(0, 10 ** 18))
+        result = rescreen_sanctions_delta(str(sanctions_folder), str(tmp_path / "rescreen"), 0.85, neo4j)
+
+        assert result["status"] == "success"
+        assert result["data"]["changed_entries"] == 1
+        assert result["data"]["flagged_transactions"] == 1
+        queries = neo4j.search_entities_by_name.call_args[0][0]
+        assert "roe" not in " ".join(queries)
+        matches, version = neo4j.flag_sanctions_matches.call_args[0]
+        # The person named like the company is not matched against a Company entry
+        assert [(match["id"], match["entity_id"]) for match in matches] == [("4:abc:1", "NK-2")]
+        assert version == result["data"]["version"]
+
+        unchanged = rescreen_sanctions_delta(str(sanctions_folder), str(tmp_path / "rescreen"), 0.85, neo4j)
+        assert unchanged["data"]["mode"] == "unchanged"
+
+
+@pytest.mark.unit
+class TestJurisdiction:
+    """Tests for the jurisdiction resolver."""
+
+    @pytest.mark.parametrize("text,code,subdivision", [
+        ("UK", "GB", None),
+        ("BVI", "VG", None),
+        ("Cayman Islands", "KY", None),
+        ("U.S.A.", "US", None),
+        ("Korea, Republic of", "KR", None),
+        ("Road Town, British Virgin Islands", "VG", None),
+        ("Delaware", "US", "US-DE"),
+        ("Georgia", "GE", None),
+        ("deu", "DE", None),
+    ])
+    def test_resolves_aliases(self, text, code, subdivision):
+        """Test that common names, abbreviations and territories resolve to ISO codes."""
+        jurisdiction = resolve_jurisdiction(text)
+        assert jurisdiction.country_code == code
+        assert jurisdiction.subdivision_code == subdivision
+
+    def test_unknown_and_ambiguous_jurisdictions(self):
+        """Test that unknown or ambiguous jurisdictions and words that are codes do not resolve."""
+        assert resolve_jurisdiction("Nowhere") is None
+        # Both the British and the US Virgin Islands
+        assert resolve_jurisdiction("Virgin Islands") is None
+        # "and" is Andorra's alpha-3 code
+        assert resolve_jurisdiction("Trade and Commerce") is None
+
+    def test_risk_features_flag_offshore_centres(self):
+        """Test the jurisdiction features of the risk assessment."""
+        features = jurisdiction_risk_features(["BVI", "Germany", "BVI", None])
+        assert [(f["country_code"], f["offshore_financial_centre"]) for f in features] == [("VG", True), ("DE", False)]
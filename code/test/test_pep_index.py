@@ -0,0 +1,152 @@
+# File: tests/test_pep_index.py
+import os
+import pytest
+
+from dags.utils.pep_index import get_pep_index, get_pep_similarity_engine, default_pep_index_file
+from dags.utils.pep_refresh import refresh_pep_dataset
+from dags.utils.similarity_engine import search_batch_vectorized
+from dags.utils.name_index import CompiledNameIndex
+
+PEP_ROWS = (
+    "id,schema,name,aliases,countries\n"
+    "Q1,Person,Viktor Yanukovych,Viktor F. Yanukovych,ua\n"
+    "Q2,Person,Angela Merkel,,de\n"
+    "Q3,Person,Viktor Orban,Orbán Viktor,hu\n"
+)
+
+
+@pytest.fixture
+def pep_data_file(tmp_path):
+    pep_file = tmp_path / "pep_data.csv"
+    pep_file.write_text(PEP_ROWS, encoding="utf-8")
+    return str(pep_file)
+
+
+@pytest.mark.unit
+class TestPEPIndex:
+    """Tests for the compiled PEP index."""
+
+    def test_lookup_matches_name_and_alias_tokens(self, pep_data_file):
+        index = get_pep_index(pep_data_file)
+
+        assert [row["id"] for row in index.lookup("Viktor Smith")] == ["Q1", "Q3"]
+        assert [row["id"] for row in index.lookup("ORBÁN")] == ["Q3"]
+        assert index.lookup("Al Li") == []
+
+    def test_index_is_reused_until_file_changes(self, pep_data_file):
+        index = get_pep_index(pep_data_file)
+        assert get_pep_index(pep_data_file) is index
+
+        with open(pep_data_file, "a", encoding="utf-8") as f:
+            f.write("Q4,Person,Olaf Scholz,,de\n")
+        stat = os.stat(pep_data_file)
+        os.utime(pep_data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+        rebuilt = get_pep_index(pep_data_file)
+        assert rebuilt is not index
+        assert [row["id"] for row in rebuilt.lookup("Olaf Scholz")] == ["Q4"]
+
+    def test_compiled_index_is_written_next_to_data_file(self, pep_data_file):
+        get_pep_index(pep_data_file)
+
+        compiled = CompiledNameIndex(default_pep_index_file(pep_data_file))
+        assert len(compiled) == 3
+        assert compiled.record(2) == {
+            "id": "Q3", "schema": "Person", "name": "Viktor Orban",
+            "aliases": "Orbán Viktor", "countries": "hu",
+        }
+
+    def test_search_ranks_fuzzy_matches(self, pep_data_file):
+        index = get_pep_index(pep_data_file)
+
+        matches = index.search("Orban Viktor", threshold=0.85, top_k=10)
+        assert [row["id"] for row in matches] == ["Q3"]
+        assert matches[0]["match_score"] >= 0.95
+        assert matches[0]["matched_name"] in ("Viktor Orban", "Orbán Viktor")
+
+        assert index.search("Viktor Smith", threshold=0.85, top_k=10) == []
+        assert [row["id"] for row in index.search("Angela Merkle", threshold=0.85, top_k=10)] == ["Q2"]
+
+    def test_search_respects_top_k(self, pep_data_file):
+        index = get_pep_index(pep_data_file)
+
+        matches = index.search("Viktor", threshold=0.0, top_k=1)
+        assert len(matches) == 1
+
+    def test_vectorized_search_matches_loop_search(self, pep_data_file):
+        index = get_pep_index(pep_data_file)
+        engine = get_pep_similarity_engine(index)
+        assert get_pep_similarity_engine(index) is engine
+
+        names = ["Orban Viktor", "Angela Merkle", "Viktor Smith", "Viktor Janukovych"]
+        assert search_batch_vectorized(index, engine, names, 0.85, 10) == index.search_batch(names, 0.85, 10)
+
+    def test_refresh_applies_delta_without_rebuilding_base(self, pep_data_file, tmp_path):
+        index = get_pep_index(pep_data_file)
+        base_fingerprint = index.base.fingerprint
+
+        snapshot = tmp_path / "snapshot.csv"
+        snapshot.write_text(
+            PEP_ROWS.replace("Angela Merkel,,de", "Angela Merkel,Angela Dorothea Merkel,de")
+            .replace("Q1,Person,Viktor Yanukovych,Viktor F. Yanukovych,ua\n", "")
+            + "Q4,Person,Olaf Scholz,,de\n",
+            encoding="utf-8",
+        )
+
+        result = refresh_pep_dataset(pep_data_file, snapshot_file=str(snapshot), version="20250401",
+                                     compaction_ratio=2.0)
+        assert result["status"] == "success"
+        assert result["data"]["mode"] == "delta"
+        assert (result["data"]["added"], result["data"]["changed"], result["data"]["removed"]) == (1, 1, 1)
+
+        refreshed = get_pep_index(pep_data_file)
+        assert refreshed is not index
+        assert refreshed.version == "20250401"
+        assert refreshed.base.fingerprint == base_fingerprint
+        assert [row["id"] for row in refreshed.lookup("Yanukovych")] == []
+        assert [row["id"] for row in refreshed.search("Olaf Scholz", 0.85, 10)] == ["Q4"]
+        assert [row["aliases"] for row in refreshed.search("Dorothea Merkel", 0.85, 10)] == ["Angela Dorothea Merkel"]
+
+    def test_refresh_compacts_large_deltas(self, pep_data_file, tmp_path):
+        get_pep_index(pep_data_file)
+
+        snapshot = tmp_path / "snapshot.csv"
+        snapshot.write_text("id,schema,name,aliases,countries\nQ9,Person,Olaf Scholz,,de\n", encoding="utf-8")
+
+        result = refresh_pep_dataset(pep_data_file, snapshot_file=str(snapshot), version="20250402")
+        assert result["data"]["mode"] == "compacted"
+
+        refreshed = get_pep_index(pep_data_file)
+        assert refreshed.delta is None
+        assert len(refreshed) == 1
+        assert refreshed.version == "20250402"
+
+    def test_refresh_of_unchanged_data_updates_the_version(self, pep_data_file, tmp_path):
+        index = get_pep_index(pep_data_file)
+
+        snapshot = tmp_path / "snapshot.csv"
+        with open(pep_data_file, encoding="utf-8") as f:
+            snapshot.write_text(f.read(), encoding="utf-8")
+
+        result = refresh_pep_dataset(pep_data_file, snapshot_file=str(snapshot), version="20250403")
+        assert result["data"]["mode"] == "unchanged"
+
+        refreshed = get_pep_index(pep_data_file)
+        assert refreshed is index
+        assert refreshed.version == "20250403"
+
+    def test_search_matches_transliterated_and_umlaut_spellings(self, tmp_path):
+        pep_file = tmp_path / "pep_data.csv"
+        pep_file.write_text(
+            "id,schema,name,aliases,countries\n"
+            "Q1,Person,Hans Müller,,de\n"
+            "Q2,Person,Владимир Путин,,ru\n"
+            "Q3,Person,Muhammad Ali,,eg\n",
+            encoding="utf-8",
+        )
+        index = get_pep_index(str(pep_file))
+
+        assert [row["id"] for row in index.search("Mueller, Hans", 0.85, 10)] == ["Q1"]
+        assert [row["id"] for row in index.search("Vladimir Putin", 0.85, 10)] == ["Q2"]
+        assert index.search("Vladimir Putin", 0.85, 10)[0]["match_score"] == 1.0
+        assert index.key_candidate_ids("Mohammed Ali") == [2]